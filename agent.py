@@ -18,6 +18,9 @@ import logging
 import numpy as np
 
 from city import City 
+from transit import Transit
+from locations import LocationIndex
+from scenario import Scenario, compile_scenario, FIXED, FREE, FLEX
 
 # Read config.yaml for simulation parameters
 with open("config.yaml", "r") as f:
@@ -25,31 +28,24 @@ with open("config.yaml", "r") as f:
 
 DAY_LENGTH = config['simulation']['day_length']
 BUS_PRICE = 0.005
+SCENARIO = compile_scenario(config) # Default scenario of agents, see Agent(scenario=...)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename='simulation.log', encoding='utf-8', filemode='w', level=logging.INFO)
 
-def get_building_coords(building : str, return_tuple=True):
-    # TODO: UNUSED - Walking currently takes random effects, it should be scaled with distance in the upcoming commits
-    if building[:4] == "home":
-        coord = config['houses'][building]
-        
-    elif building[:4] == "work":
-        coord = config['workplace_locations'][building]
-        
-    else:
-        coord = None
-        raise ValueError(f"Unknown building name: {building}. Please make sure this building is either declared in .yaml or implemented correctly in if-else above")
-    
-    if return_tuple:
-        return (coord[0], coord[1])
-    else:
-        return np.array(coord)
+def _draw_crowd():
+    crowd = int( random.random() * 10 )
+    logger.warning(f"Crowd level not provided. Randomly chosen crowd level: {crowd}")
+    return crowd
+
+def _draw_walk_length():
+    length = random.randint(1, 20) # This should be updated if you want to introduce other locations, e.g. a park to rest or actual bus stops
+    logger.warning(f"No length is provided! Estimated length (RANDOM) {length}.")
+    return length
 
 def _get_crowd_cost(tolerance, crowd=None):
     if crowd is None:
-        crowd = int( random.random() * 10 )
-        logger.warning(f"Crowd level not provided. Randomly chosen crowd level: {crowd}")
+        crowd = _draw_crowd()
 
     return -(float(crowd ** 2)/float(tolerance+1e-12)) # 1e-12 to avoid division by zero
     
@@ -58,16 +54,27 @@ class Agent:
                  name : str, 
                  social_tolerance : float,
                  city : City, 
-                 home : str ="home_0", 
-                 workplace : str ="workplace_0", 
-                 income : float = 5.0):
+                 home : int, 
+                 workplace : int, 
+                 income : float = 5.0,
+                 transit : Transit = None,
+                 locations : LocationIndex = None,
+                 scenario : Scenario = None):
         
+        # Buildings are integer ids of the scenario, names are accepted for convenience
+        self.scenario = scenario if scenario is not None else SCENARIO
+        if isinstance(home, str): home = self.scenario.building_id(home)
+        if isinstance(workplace, str): workplace = self.scenario.building_id(workplace)
+
         self.name = name
         self.city = city
+        self.transit = transit # If no transit provided, bus crowd will be randomized
         self.home = home
         self.workplace = workplace
        
         self.where = home
+        self.locations = locations # If no location index provided, socialization at work will be randomized
+        self.uid = locations.add(home) if locations is not None else None
         self.wealth = float(0)
         self.TIMESTEP_INCOME = income
         self.in_recovery = False # True if in "meltdown"
@@ -75,6 +82,10 @@ class Agent:
         self.recovery_timer = 0
         self.social_burnout_sum = 0
         self.energy_burnout_sum = 0
+        self.trace = None # Optional decision_trace.TraceRecorder of the realized actions
+        self.last_action = None # Action taken in the current time step, None while in burnout recovery or in transit
+        self.commutes = None # Optional commutes.CommuteTracker, walks take several time steps then
+        self.in_transit = False
 
         self.NEED_CATEGORIES = {
         "energy": {"category": "physical", "max": 1, "timestep_multiplier":0.98},
@@ -150,9 +161,7 @@ class Agent:
         
         elif action == "walk":
             if "length" not in kwargs.keys(): 
-                len =  random.randint(1, 20) # This should be updated if you want to introduce other locations, e.g. a park to rest or actual bus stops
-                logger.warning(f"No length is provided! Estimated length (RANDOM) {len}.") 
-                
+                len = _draw_walk_length()
             else:
                 # print("Length got: ", kwargs["length"])
                 len = kwargs["length"]
@@ -178,7 +187,8 @@ class Agent:
                 needs_dict["financial_security"] = -0.5
 
         elif action == "work":
-            social_factor =  +0.1 if random.random() < 0.5 else 0 # Potentially socialize during work
+            socialize = kwargs["socialize"] if "socialize" in kwargs.keys() else self._draw_socialize()
+            social_factor = +0.1 if socialize else 0 # Potentially socialize during work
 
             needs_dict["energy"] = -0.2
             needs_dict["alone_time"] = -social_factor
@@ -197,6 +207,23 @@ class Agent:
         
         return needs_dict
 
+    def get_colleagues_present(self):
+        # Number of other agents at the workplace, working from home has no colleagues around
+        if self.where != self.workplace:
+            return 0
+        return self.locations.count(self.where) - 1
+
+    def get_social_chance(self):
+        # Chance to socialize during work. With n colleagues present it is n/(n+1),
+        # e.g. a coin flip with a single colleague and none when working alone.
+        if self.locations is None:
+            return 0.5
+        colleagues = self.get_colleagues_present()
+        return colleagues / (colleagues + 1)
+
+    def _draw_socialize(self):
+        return random.random() < self.get_social_chance()
+
     def _check_burnout(self):
         # If low social energy, enter recovery
         if self.needs["alone_time"] <= 0:
@@ -232,18 +259,19 @@ class Agent:
         return False
 
     def get_fixed_policy_actions(self, time, location_str):
+        day_length = self.scenario.day_length
         if location_str == "home":
-            if time % DAY_LENGTH < 10:
+            if time % day_length < 10:
                 return ["sleep", "rest"]
-            elif time % DAY_LENGTH < 60: # TODO: how to define fixed and flexible work hours?
+            elif time % day_length < 60: # TODO: how to define fixed and flexible work hours?
                 return [ "walk", "take_bus"] # Assumption: cannot sleep during work hours
             else:
                 return ["sleep", "rest"]
        
         elif location_str == "work":
-            if time % DAY_LENGTH < 20:
+            if time % day_length < 20:
                 return ["walk", "take_bus", "wait"] # Wait until shift starts
-            elif time % DAY_LENGTH < 60: # TODO: how to define fixed and flexible work hours?
+            elif time % day_length < 60: # TODO: how to define fixed and flexible work hours?
                 return ["rest",  "work"] # Assumption: going back home not available during fixed work hours
             else:
                 return ["walk", "take_bus"]
@@ -273,41 +301,41 @@ class Agent:
 
         # TODO-workplace policies comes here, i.e. you can only work at certain hours
         # and possibly you can only go to work 1-2 hours before work shift starts
-        policy = config["policy"][self.workplace]
+        policy = self.scenario.policy_of[self.workplace]
 
         # Home actions based on policy
         if self.where == self.home:
-            if policy == "fixed":
+            if policy == FIXED:
                 return self.get_fixed_policy_actions(time, "home")
 
-            elif policy == "free":
+            elif policy == FREE:
                 return self.get_free_policy_actions(time, "home")
             
-            elif policy == "flex":
+            elif policy == FLEX:
                 return self.get_flex_policy_actions(time, "home")
             
             else:  
-                logger.warning(f"Unknown policy {policy}")
+                logger.warning(f"Unknown policy id {policy}")
                 return []
         
         # Workplace actions based on policy
         elif self.where == self.workplace:
-            if policy == "fixed":
+            if policy == FIXED:
                 return self.get_fixed_policy_actions(time, "work")
             
-            elif policy == "free":
+            elif policy == FREE:
                 return self.get_free_policy_actions(time, "work")
             
-            elif policy == "flex":
+            elif policy == FLEX:
                 return self.get_flex_policy_actions(time, "work")
 
             else:  
-                logger.warning(f"Unknown policy {policy}")
+                logger.warning(f"Unknown policy id {policy}")
                 return []  
             
         # Undefined place
         else:
-            logger.error(f"No actions available at {self.where}")
+            logger.error(f"No actions available at {self.scenario.name(self.where)}")
             return []
     
     #def get_available_actions(self, time, estimate):
@@ -323,20 +351,46 @@ class Agent:
         kwargs = {}
 
         if action == "walk" and self.city is not None: # If no city provided, walk will be randomized
-            home_coord = get_building_coords(self.home)
-            work_coord = get_building_coords(self.workplace)
+            home_coord = self.scenario.coord_tuples[self.home]
+            work_coord = self.scenario.coord_tuples[self.workplace]
             
             if estimate:
                 cost = self.city.get_estimated_path_cost(home_coord, work_coord) # WARNING: Assumes walk is only between work and home
+            elif self.city.reservations is not None:
+                # Cooperative routing with the other commuters, waits in congestion make the walk longer
+                start, target = self.scenario.coord_tuples[self.where], self.scenario.coord_tuples[self.get_destination()]
+                path = self.city.cooperative_path(start, target, agent=id(self))
+                kwargs["path"] = path # Reserved for this agent, walked by depart() in multi-tick commutes
+                cost = len(path) if path else float('inf')
             else:
                 cost = self.city.get_shortest_path_length(home_coord, work_coord)
             kwargs["length"] = cost
 
-        if action == "take_bus":
-            pass # TODO: Crowd level can be estimated / observed here
+        if action == "take_bus" and self.transit is not None:
+            # Forecast crowd while deliberating, observed crowd of this tick otherwise
+            kwargs["crowd"] = self.transit.get_crowd(self.get_bus_route(), forecast=estimate)
 
         return kwargs
 
+    def draw_action_kwargs(self, action):
+        # kwargs of the action to take, with its random effects drawn, so that the
+        # realized action can be recorded (see decision_trace.py) and applied again
+        kwargs = self.get_action_kwargs(action, estimate=False)
+        if action == "take_bus" and "crowd" not in kwargs:
+            kwargs["crowd"] = _draw_crowd()
+        elif action == "walk" and "length" not in kwargs:
+            kwargs["length"] = _draw_walk_length()
+        elif action == "work":
+            kwargs["socialize"] = self._draw_socialize()
+        return kwargs
+
+    def get_destination(self):
+        # WARNING: Assumes agent can only either at workplace or home
+        return self.workplace if self.where == self.home else self.home
+
+    def get_bus_route(self):
+        return self.transit.get_route(self.where, self.get_destination())
+
     def compute_urgency(self, need_key):
         max_val = self.NEED_CATEGORIES[need_key]["max"]
         if max_val is None:
@@ -366,24 +420,43 @@ class Agent:
         logger.info(f"[ACT] Best action chosen: {best_action}")
         return best_action
 
-    def deliberate_action(self, time):
+    def decide(self, time, choose=None):
+        # Returns the chosen action, or None if this time step is
+        # spent on burnout recovery (or meltdown). choose(time) replaces
+        # choose_action(), e.g. to replay recorded actions
+        self.last_action = None
         if self.in_recovery:
             logger.info(f"[BURNOUT] Agent {self.name} is in the recovery from {self.burnout_state} burnout... Accumulated social {self.social_burnout_sum } and {self.energy_burnout_sum} energy burnout scores.")
             self._recover_burnout_step()
             if self.burnout_state == "social": self.social_burnout_sum += 1
             if self.burnout_state == "energy": self.energy_burnout_sum += 1
-            return
+            return None
+
+        if self.in_transit: # Still walking, see commutes.py
+            return None
         
         if self._check_burnout(): # Enters recovery if needed
             if self.burnout_state == "social":
                 effect = self.get_action_effect("meltdown")
                 self.apply_action("meltdown", effect=effect)
-            return
+            return None
        
-        chosen_action = self.choose_action(time)
-        kwargs = self.get_action_kwargs(chosen_action, estimate=False)        
+        return (choose or self.choose_action)(time)
+
+    def act(self, chosen_action, kwargs=None):
+        # kwargs of an already realized action (e.g. from a trace) are applied as they are
+        if kwargs is None:
+            kwargs = self.draw_action_kwargs(chosen_action)
         effect = self.get_action_effect(chosen_action, **kwargs) # WARNING: choose_action() also calls this as estimated_effects, here we call it again because actions may have random effects
-        self.apply_action(chosen_action, effect=effect)
+        self.apply_action(chosen_action, effect=effect, path=kwargs.get("path"))
+        self.last_action = chosen_action
+        if self.trace is not None:
+            self.trace.record(self, chosen_action, kwargs)
+
+    def deliberate_action(self, time):
+        chosen_action = self.decide(time)
+        if chosen_action is not None:
+            self.act(chosen_action)
 
         
     def _get_distance(self, start, end, type="manhattan"): 
@@ -430,7 +503,8 @@ class Agent:
             logger.warning(f"Agent can only rest at {self.home}! Currently at {self.where}.")
     """
 
-    def apply_action(self, action, effect):
+    def apply_action(self, action, effect, path=None):
+        # path: cells of a walk reserved by cooperative routing, see get_action_kwargs()
         
         logger.info(f'Agent {self.name} takes action: {action} with effects {effect}. Current wealth: {self.wealth}')
 
@@ -442,8 +516,10 @@ class Agent:
             self.wealth -= BUS_PRICE
         
         # Relocate Agent
-        if action == "take_bus" or action == "walk":
-            self.where = self.workplace if self.where == self.home else self.home # WARNING: Assumes agent can only either at workplace or home
+        if action == "walk" and self.commutes is not None:
+            self.depart(self.get_destination(), path=path)
+        elif action == "take_bus" or action == "walk":
+            self.relocate(self.get_destination())
 
         assert len(effect) == len(self.needs), f"Please provide an array of effects with the same length of needs. Provided effect has length {len(effect)}, expected length {len(self.needs)}."
         for key in self.needs.keys():
@@ -457,9 +533,66 @@ class Agent:
 
         self._clamp_needs()
 
+    def relocate(self, building):
+        self.where = building
+        if self.locations is not None:
+            self.locations.move(self.uid, building)
+        if self.commutes is not None:
+            self.commutes.place(self, building)
+
+    def depart(self, building, path=None):
+        # Start walking to building along path (default: the shortest path), the agent
+        # arrives after several time steps (see commutes.py)
+        if not self.commutes.depart(self, building, path=path):
+            self.relocate(building)
+            return
+        self.in_transit = True
+        if self.locations is not None:
+            self.locations.leave(self.uid)
+
+    def arrive(self, building):
+        self.in_transit = False
+        self.relocate(building)
+
     def final_wealth(self):
         return self.wealth
     
     def report(self):
         print(f"{self.name} final wealth: {self.final_wealth()}")
-        # TODO: More attributes to report?
\ No newline at end of file
+        # TODO: More attributes to report?
+
+def decide_and_act(agents, time, defer_bus=False):
+    # Every agent decides and acts for a single time step. If defer_bus,
+    # agents choosing take_bus are not applied but returned instead, so
+    # that they can ride once the riders of every route are counted.
+    riders = []
+    for agent in agents:
+        logger.info(f'[{time}] Time step ------------')
+        chosen_action = agent.decide(time)
+        if defer_bus and chosen_action == "take_bus":
+            riders.append(agent)
+            continue
+        if chosen_action is not None:
+            agent.act(chosen_action)
+        agent.decay_needs_sat() # Water tank model, decay needs
+    return riders
+
+def ride_bus(riders):
+    for agent in riders:
+        agent.act("take_bus")
+        agent.decay_needs_sat()
+
+def step_agents(agents, time, transit=None, commutes=None):
+    # Advance a population by a single time step. If a transit system is
+    # given, the bus crowd is the realized number of riders on each route.
+    # If a commute tracker is given, walking agents advance first.
+    if commutes is not None:
+        commutes.advance()
+    if transit is None:
+        decide_and_act(agents, time)
+        return
+
+    transit.begin_tick(time)
+    riders = decide_and_act(agents, time, defer_bus=True)
+    transit.observe([agent.get_bus_route() for agent in riders])
+    ride_bus(riders)
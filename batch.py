@@ -0,0 +1,199 @@
+"""
+
+Batch runs of many scenarios. Scenario specs are streamed from a JSON lines
+file (or stdin), one scenario per line, e.g.
+
+    {"id": "small-fixed", "config": {"simulation": {"num_agents": 50}}, "seed": 3, "map": "maze-128-128-10.map", "policy": "fixed"}
+
+where config holds overrides of config.yaml (merged key by key), map is a map
+name, path or hash (see map_registry.py), layout an optional building layout,
+policy one policy or a list of them (default: every policy), and args further
+commute_simulation.py options, e.g. ["--converge"]. Only id and seed are
+required.
+
+Scenarios run headless on a bounded pool of long-lived worker processes, so
+maps stay loaded across the scenarios of a worker, and results go through the
+result cache. Specs are only read while fewer than 2 x jobs scenarios are in
+flight, and one JSON line with the per-policy metrics (see replicates.METRICS)
+is written per scenario as soon as it finishes:
+
+    python batch.py scenarios.jsonl -j 4 -o results/batch/results.jsonl
+
+Options that a scenario ignores (e.g. --cooperative with --chunked) are listed
+under "warnings" in its record. Per-action logging is disabled in the workers.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import copy
+import random
+import logging
+import argparse
+import contextlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+POLICIES = ["fixed", "free", "flex"]
+
+
+def merge_config(base, overrides):
+    # Copy of base with the (nested) keys of overrides replaced
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def read_specs(path):
+    # Scenario specs of a JSON lines file, or of stdin for "-"
+    f = sys.stdin if path == "-" else open(path, "r")
+    try:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                spec = {"error": str(e)}
+            if "id" not in spec or "seed" not in spec:
+                print(f"WARNING: Skipping line {number} of {path}, expected a scenario with at least id and seed: {line}", file=sys.stderr)
+                continue
+            yield spec
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+BASE_CONFIG = None # config.yaml, set in every worker
+
+
+def _init_worker(base_config):
+    global BASE_CONFIG
+    BASE_CONFIG = base_config
+    logging.disable(logging.INFO)
+
+def run_scenario(spec, results_dir, use_cache=True):
+    """Run a scenario spec in this process, returns its result record."""
+    import commute_simulation as sim
+    from scenario import compile_scenario
+    from result_cache import ResultCache
+    from results_store import load_results
+    from replicates import METRICS
+
+    start = time.perf_counter()
+    record = {"id": spec["id"], "seed": spec["seed"], "policies": {}}
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(usage):
+            args = sim.get_parser().parse_args(["--headless", "--seed", str(spec["seed"]), *spec.get("args", [])])
+        sim.configure(merge_config(BASE_CONFIG, spec.get("config", {})))
+        if args.num_agents is not None:
+            sim.NUM_AGENTS = args.num_agents
+        if spec.get("layout", args.layout) is not None:
+            sim.apply_layout(spec.get("layout", args.layout))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            city = None if args.randomize_walk else sim.MAPS.get(spec.get("map", args.map)) # Stays loaded for the next scenarios
+            scenario = compile_scenario(sim.config, city)
+            if city is not None:
+                sim.MAPS.precompute(city, scenario.coords)
+            warnings, cache = sim.check_run_options(args, ResultCache.from_config(sim.config) if use_cache else None)
+            if args.telemetry is not None:
+                warnings.append("--telemetry is not supported in batch runs, nothing is published")
+            if warnings:
+                record["warnings"] = warnings
+
+            policies = spec.get("policy", POLICIES)
+            for policy in [policies] if isinstance(policies, str) else policies:
+                res_path = sim.prepare_results_path(policy, results_dir=os.path.join(results_dir, str(spec["id"])))
+                random.seed(args.seed)
+                np.random.seed(args.seed)
+                cached = False
+                if cache is not None:
+                    metrics, cached = sim.run_policy_cached(args, city, scenario, policy, res_path, cache)
+                else:
+                    metrics, _ = sim.run_policy(args, city, scenario, policy, res_path)
+                if isinstance(metrics, str):
+                    metrics, _ = load_results(metrics)
+                result = {"results": res_path, "cached": cached}
+                if metrics is not None:
+                    result["metrics"] = {name: fn(metrics) for name, fn in METRICS.items()}
+                record["policies"][policy] = result
+    except SystemExit: # Invalid args
+        record["error"] = usage.getvalue().strip().splitlines()[-1]
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_s"] = time.perf_counter() - start
+    record["worker"] = os.getpid()
+    return record
+
+def run_batch(specs, base_config, out, results_dir, jobs=1, max_pending=None, use_cache=True):
+    """
+    Run the scenarios of the specs iterable on jobs processes and write a JSON line to out per
+    finished scenario. At most max_pending (default: 2 x jobs) scenarios are read ahead.
+    """
+    max_pending = max_pending or 2 * jobs
+    finished = failed = 0
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(base_config,)) as pool:
+        running = {}
+        while True:
+            # Back-pressure: the next spec is only read once a slot is free
+            while len(running) < max_pending:
+                spec = next(specs, None)
+                if spec is None:
+                    break
+                running[pool.submit(run_scenario, spec, results_dir, use_cache)] = spec
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                spec = running.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e: # E.g. a worker killed by the OS
+                    record = {"id": spec["id"], "seed": spec["seed"], "error": f"{type(e).__name__}: {e}"}
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                finished += 1
+                failed += "error" in record
+    return finished, failed
+
+
+if __name__ == "__main__":
+    import yaml
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("specs", help="JSON lines file of scenario specs, - for stdin.", type=str)
+    parser.add_argument("-j", "--jobs", help="Number of worker processes. Default: 1", type=int, default=1)
+    parser.add_argument("--max-pending", help="Scenarios submitted to the pool ahead of the finished ones. Default: 2 x jobs", type=int, default=None)
+    parser.add_argument("--results-dir", help="Directory of the scenario results, saved under <results-dir>/<id>/<policy>. Default: results/batch", type=str, default=os.path.join("results", "batch"))
+    parser.add_argument("--no-cache", help="Always simulate instead of reusing cached results.", action="store_true", default=False)
+    parser.add_argument("-o", "--output", help="JSON lines file of the result records, - for stdout. Default: <results-dir>/results.jsonl", type=str, default=None)
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.results_dir, "results.jsonl")
+    if output == "-":
+        out = sys.stdout
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        out = open(output, "w")
+    start = time.perf_counter()
+    try:
+        finished, failed = run_batch(read_specs(args.specs), config, out, args.results_dir, jobs=args.jobs,
+                                     max_pending=args.max_pending, use_cache=not args.no_cache)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Ran {finished} scenarios ({failed} failed) in {time.perf_counter() - start:.1f} s" +
+          (f", results saved to: {output}" if out is not sys.stdout else ""), file=sys.stderr)
@@ -0,0 +1,230 @@
+"""
+
+Reproducible benchmarks for pathfinding, agent deliberation and end-to-end
+simulation throughput. Results are stored as JSON, and can be compared with
+a previously stored baseline to catch performance regressions, e.g.
+
+    python benchmark.py --output results/benchmarks/baseline.json
+    (... change the code ...)
+    python benchmark.py --baseline results/benchmarks/baseline.json
+
+Every benchmark is repeated and the best repetition is reported, since the
+slower ones are dominated by noise from the rest of the system.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import argparse
+import numpy as np
+
+from city import City
+from agent import Agent, step_agents
+from transit import Transit
+from locations import LocationIndex
+from scenario import compile_scenario, POLICIES
+from io_handler import get_binary_map
+from results_store import get_code_version
+
+import yaml
+with open("config.yaml", "r") as f:
+    config = yaml.safe_load(f)
+
+SHIPPED_MAP = os.path.join(os.path.dirname(__file__), 'assets', 'maze-128-128-10.map')
+
+
+################################################################################################################
+# Inputs
+################################################################################################################
+
+def make_random_map(size, density=0.2, seed=0):
+    # Synthetic map with uniformly scattered obstacles
+    rng = np.random.default_rng(seed)
+    return (rng.random((size, size)) < density).astype(int)
+
+def get_reachable_cells(city, seed=0):
+    # Free cells reachable from a random free cell, so that sampled pairs always have a path
+    rng = random.Random(seed)
+    field = city.distance_field(rng.choice(city.get_free_cell_coords()))
+    return [tuple(map(int, c)) for c in np.argwhere(field >= 0)]
+
+def sample_pairs(city, num_pairs, seed=0):
+    rng = random.Random(seed)
+    cells = get_reachable_cells(city, seed)
+    return [(rng.choice(cells), rng.choice(cells)) for _ in range(num_pairs)]
+
+def make_scenario_config(city, num_homes=4, seed=0):
+    # Config with buildings on random free cells of the city, one workplace per policy
+    rng = random.Random(seed)
+    cells = get_reachable_cells(city, seed)
+    bench_config = dict(config)
+    bench_config["houses"] = {f"home_{i}": list(rng.choice(cells)) for i in range(num_homes)}
+    bench_config["workplace_locations"] = {f"workplace_{i}": list(rng.choice(cells)) for i in range(len(POLICIES))}
+    bench_config["policy"] = {f"workplace_{i}": policy for i, policy in enumerate(POLICIES)}
+    bench_config["transit"] = dict(config.get("transit", {}))
+    bench_config["transit"]["routes"] = {"bus_0": list(bench_config["houses"]) + list(bench_config["workplace_locations"])}
+    return bench_config
+
+def make_agents(city, scenario_config, num_agents, policy=None, seed=0):
+    rng = random.Random(seed)
+    scenario = compile_scenario(scenario_config)
+    transit = Transit.from_config(scenario_config, scenario)
+    locations = LocationIndex(buildings=scenario.building_names, capacity=num_agents)
+    workplaces = scenario.workplaces if policy is None else scenario.workplaces_with_policy(policy)
+    agents = [Agent(name="A" + str(i), social_tolerance=rng.randint(1, 7), city=city,
+                    home=rng.choice(scenario.homes), workplace=rng.choice(workplaces),
+                    transit=transit, locations=locations, scenario=scenario) for i in range(num_agents)]
+    return agents, transit
+
+
+################################################################################################################
+# Benchmarks
+################################################################################################################
+
+def best_rate(fn, num_ops, repeat, setup=None):
+    # Best throughput (ops per second) of fn() over repeat runs. If setup is given, every
+    # run gets a fresh setup() result as argument, built outside of the timed region
+    best = float('inf')
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return num_ops / best if best > 0 else float('inf')
+
+def bench_astar(maps, num_queries, repeat, num_landmarks=8):
+    # Manhattan and ALT (landmark) heuristics, also reports the mean node expansions per query
+    results = {}
+    for name, city in maps.items():
+        pairs = sample_pairs(city, num_queries)
+        city.precompute_landmarks(num_landmarks)
+        for heuristic, prefix in (("manhattan", "astar"), ("alt", "astar_alt")):
+            city.heuristic = heuristic
+            expansions = []
+            def run():
+                expansions.clear()
+                for start, target in pairs:
+                    city.shortest_path(start, target)
+                    expansions.append(city.last_expansions)
+            results[f"{prefix}/{name}"] = {"value": best_rate(run, num_queries, repeat), "unit": "queries/s",
+                                           "expansions_per_query": float(np.mean(expansions))}
+        city.heuristic = "manhattan"
+    return results
+
+def bench_deliberate(city, num_calls, repeat):
+    results = {}
+    scenario_config = make_scenario_config(city)
+    for policy in POLICIES:
+        def setup():
+            agents, _ = make_agents(city, scenario_config, num_agents=1, policy=policy)
+            random.seed(0)
+            return agents[0]
+        def run(agent):
+            for t in range(num_calls):
+                agent.deliberate_action(t)
+                agent.decay_needs_sat()
+        results[f"deliberate/{policy}"] = {"value": best_rate(run, num_calls, repeat, setup=setup), "unit": "calls/s"}
+    return results
+
+def bench_end_to_end(maps, agent_counts, num_ticks, repeat):
+    results = {}
+    for name, city in maps.items():
+        scenario_config = make_scenario_config(city)
+        scenario = compile_scenario(scenario_config, city)
+        city.precompute_distances(scenario.coords)
+        for num_agents in agent_counts:
+            def setup():
+                agents = make_agents(city, scenario_config, num_agents)
+                random.seed(0)
+                return agents
+            def run(population):
+                agents, transit = population
+                for t in range(num_ticks):
+                    step_agents(agents, t, transit=transit)
+            results[f"end_to_end/{name}/agents_{num_agents}"] = {"value": best_rate(run, num_ticks, repeat, setup=setup), "unit": "ticks/s"}
+    return results
+
+
+################################################################################################################
+# Results
+################################################################################################################
+
+def get_metadata(args):
+    return {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "git_revision": get_code_version(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "args": vars(args)}
+
+def compare_to_baseline(results, baseline, tolerance):
+    # Returns the names of benchmarks that got slower than baseline by more than tolerance
+    regressions = []
+    print(f"\n{'benchmark':<45} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, res in results.items():
+        if name not in baseline:
+            print(f"{name:<45} {'-':>12} {res['value']:>12.1f} {'new':>7}")
+            continue
+        ratio = res["value"] / baseline[name]["value"] # All benchmarks are throughputs, higher is better
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<45} {baseline[name]['value']:>12.1f} {res['value']:>12.1f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", help="Path of the JSON results. Default: results/benchmarks/latest.json", type=str, default=os.path.join("results", "benchmarks", "latest.json"))
+    parser.add_argument("-b", "--baseline", help="JSON results of a previous run to compare with.", type=str, default=None)
+    parser.add_argument("--tolerance", help="Relative slowdown w.r.t. baseline reported as a regression. Default: 0.1", type=float, default=0.1)
+    parser.add_argument("--suites", help="Benchmark suites to run. Default: astar deliberate end_to_end", nargs="+", default=["astar", "deliberate", "end_to_end"])
+    parser.add_argument("--repeat", help="Repetitions per benchmark, the best one is reported. Default: 3", type=int, default=3)
+    parser.add_argument("--queries", help="Number of A* queries per map. Default: 200", type=int, default=200)
+    parser.add_argument("--calls", help="Number of deliberate_action calls per policy. Default: 2000", type=int, default=2000)
+    parser.add_argument("--ticks", help="Number of ticks per end-to-end run. Default: 48", type=int, default=48)
+    parser.add_argument("--agents", help="Agent counts of the end-to-end runs. Default: 10 100 1000", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--map-sizes", help="Sizes of the synthetic maps. Default: 64 128 256", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--with-logging", help="Keep simulation logging enabled while benchmarking.", action="store_true", default=False)
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        logging.disable(logging.CRITICAL)
+
+    maps = {"maze-128-128-10": City(map_array=get_binary_map(mapfile_path=SHIPPED_MAP))}
+    for size in args.map_sizes:
+        maps[f"random-{size}-{size}-20"] = City(map_array=make_random_map(size))
+
+    results = {}
+    if "astar" in args.suites:
+        results.update(bench_astar(maps, args.queries, args.repeat))
+    if "deliberate" in args.suites:
+        results.update(bench_deliberate(maps["maze-128-128-10"], args.calls, args.repeat))
+    if "end_to_end" in args.suites:
+        results.update(bench_end_to_end(maps, args.agents, args.ticks, args.repeat))
+
+    for name, res in results.items():
+        expansions = f"  ({res['expansions_per_query']:.0f} expansions/query)" if "expansions_per_query" in res else ""
+        print(f"{name:<45} {res['value']:>12.1f} {res['unit']}{expansions}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"metadata": get_metadata(args), "results": results}, f, indent=2)
+    print(f"Benchmark results saved to: {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
@@ -0,0 +1,263 @@
+"""
+
+Chunked execution of very large populations under a memory budget.
+
+Instead of keeping a Python list of NUM_AGENTS Agent objects, the state of
+the whole population lives in memory-mapped arrays on disk (one file per
+attribute, see AgentStateStore). Every tick, the population is processed in
+fixed-size chunks: a small pool of Agent objects is loaded from the arrays,
+advanced for one tick, and written back. Only one chunk of Agent objects is
+resident at a time, so the population size is limited by disk, not RAM.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import time
+import json
+import shutil
+import resource
+import tempfile
+import tracemalloc
+import numpy as np
+
+from agent import Agent, decide_and_act, ride_bus, step_agents
+from locations import LocationIndex
+
+BURNOUT_STATES = (None, "social", "energy") # Stored as int8 codes
+
+
+def get_rss_mb():
+    # Current resident set size from /proc (Linux), falls back to peak RSS
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return _get_maxrss_mb()
+
+def _get_maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10 # ru_maxrss is in KB on Linux
+
+def get_peak_rss_mb():
+    return max(_get_maxrss_mb(), get_rss_mb())
+
+
+class AgentStateStore:
+    """Columnar, memory-mapped state of a population of agents."""
+    def __init__(self, num_agents, need_keys, workdir, mode="w+"):
+        # mode: "w+" creates the arrays, "r" or "r+" opens the arrays of an existing store
+        self.num_agents = num_agents
+        self.need_keys = list(need_keys)
+        self.workdir = workdir
+        os.makedirs(workdir, exist_ok=True)
+
+        self.fields = {
+            "social_tolerance": (np.int64, ()), # Integer like collect_metrics(), so summary groups are keyed "1", "2", ... in every mode
+            "home": (np.int32, ()),            # Building id of the scenario
+            "workplace": (np.int32, ()),       # Building id of the scenario
+            "at_home": (np.bool_, ()),         # Agent is either at home or at workplace
+            "wealth": (np.float64, ()),
+            "needs": (np.float64, (len(self.need_keys),)),
+            "in_recovery": (np.bool_, ()),
+            "burnout_state": (np.int8, ()),
+            "recovery_timer": (np.int32, ()),
+            "social_burnout_sum": (np.int32, ()),
+            "energy_burnout_sum": (np.int32, ()),
+            "bus_route": (np.int32, ()),       # Route of a deferred bus ride in the current tick, -1 if none
+        }
+        for name, (dtype, shape) in self.fields.items():
+            path = os.path.join(workdir, f"{name}.dat")
+            arr = np.memmap(path, dtype=dtype, mode=mode, shape=(num_agents,) + shape)
+            setattr(self, name, arr)
+
+    @property
+    def bytes_per_agent(self):
+        total = 0
+        for dtype, shape in self.fields.values():
+            total += np.dtype(dtype).itemsize * int(np.prod(shape, dtype=int))
+        return total
+
+    def load(self, agents, rows):
+        # Copy the given rows (a slice or an index array) into the pooled Agent objects
+        cols = {name: getattr(self, name)[rows].tolist() for name in self.fields}
+        ids = range(rows.start, rows.stop) if isinstance(rows, slice) else rows.tolist()
+        for j, agent in enumerate(agents):
+            agent.name = "A" + str(ids[j])
+            agent.uid = ids[j]
+            agent.social_tolerance = cols["social_tolerance"][j]
+            agent.home = cols["home"][j]
+            agent.workplace = cols["workplace"][j]
+            agent.where = agent.home if cols["at_home"][j] else agent.workplace
+            agent.wealth = cols["wealth"][j]
+            agent.needs = dict(zip(self.need_keys, cols["needs"][j]))
+            agent.in_recovery = cols["in_recovery"][j]
+            agent.burnout_state = BURNOUT_STATES[cols["burnout_state"][j]]
+            agent.recovery_timer = cols["recovery_timer"][j]
+            agent.social_burnout_sum = cols["social_burnout_sum"][j]
+            agent.energy_burnout_sum = cols["energy_burnout_sum"][j]
+
+    def dump(self, agents, rows):
+        self.at_home[rows] = [a.where == a.home for a in agents]
+        self.wealth[rows] = [a.wealth for a in agents]
+        self.needs[rows] = [[a.needs[k] for k in self.need_keys] for a in agents]
+        self.in_recovery[rows] = [a.in_recovery for a in agents]
+        self.burnout_state[rows] = [BURNOUT_STATES.index(a.burnout_state) for a in agents]
+        self.recovery_timer[rows] = [a.recovery_timer for a in agents]
+        self.social_burnout_sum[rows] = [a.social_burnout_sum for a in agents]
+        self.energy_burnout_sum[rows] = [a.energy_burnout_sum for a in agents]
+
+    def flush(self):
+        for name in self.fields:
+            getattr(self, name).flush()
+
+
+def estimate_agent_bytes(city, scenario, home, workplace, sample_size=256):
+    # Measure the Python heap footprint of a hydrated Agent object
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    sample = [Agent(name="A0", social_tolerance=1, city=city, home=home, workplace=workplace, scenario=scenario) for _ in range(sample_size)]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del sample
+    return max(1, (after - before) // sample_size)
+
+def get_chunk_size(memory_budget_mb, bytes_per_agent, num_agents):
+    # Half of the budget is reserved for the interpreter, the city and
+    # the memory-mapped pages that are resident at the time
+    chunk_size = int(memory_budget_mb * 2**20 * 0.5) // bytes_per_agent
+    if chunk_size < 1:
+        raise ValueError(f"Memory budget of {memory_budget_mb} MB is too small to hold a single agent ({bytes_per_agent} bytes).")
+    return min(chunk_size, num_agents)
+
+
+def init_locations(store, buildings, chunk_size):
+    # Location index over every building, membership is memory-mapped
+    # next to the agent states and every agent starts at home
+    where = np.memmap(os.path.join(store.workdir, "where.dat"), dtype=np.int32, mode="w+", shape=(store.num_agents,))
+    for start in range(0, store.num_agents, chunk_size):
+        stop = min(start + chunk_size, store.num_agents)
+        where[start:stop] = store.home[start:stop]
+    return LocationIndex(buildings=buildings, where=where)
+
+def init_population(store, homes, workplaces, tolerances, initial_needs, chunk_size):
+    for start in range(0, store.num_agents, chunk_size):
+        stop = min(start + chunk_size, store.num_agents)
+        n = stop - start
+        store.social_tolerance[start:stop] = np.random.choice(tolerances, size=n)
+        store.home[start:stop] = np.random.choice(homes, size=n)
+        store.workplace[start:stop] = np.random.choice(workplaces, size=n)
+        store.at_home[start:stop] = True
+        store.wealth[start:stop] = 0
+        store.needs[start:stop] = initial_needs
+        store.in_recovery[start:stop] = False
+        store.burnout_state[start:stop] = 0
+        store.recovery_timer[start:stop] = 0
+        store.social_burnout_sum[start:stop] = 0
+        store.energy_burnout_sum[start:stop] = 0
+        store.bus_route[start:stop] = -1
+    store.flush()
+
+
+def step_chunked(store, pool, t, transit=None):
+    # Advance the whole population by a single time step, chunk by chunk
+    num_agents, chunk_size = store.num_agents, len(pool)
+    if transit is None:
+        for start in range(0, num_agents, chunk_size):
+            rows = slice(start, min(start + chunk_size, num_agents))
+            chunk = pool[:rows.stop - start]
+            store.load(chunk, rows)
+            step_agents(chunk, t)
+            store.dump(chunk, rows)
+        return
+
+    # Bus riders are deferred and their routes kept in the store until
+    # the riders of every route are counted over the whole population
+    transit.begin_tick(t)
+    counts = np.zeros(transit.num_routes, dtype=np.int64)
+    for start in range(0, num_agents, chunk_size):
+        rows = slice(start, min(start + chunk_size, num_agents))
+        chunk = pool[:rows.stop - start]
+        store.load(chunk, rows)
+        riders = set(decide_and_act(chunk, t, defer_bus=True))
+        store.dump(chunk, rows)
+        routes = np.array([a.get_bus_route() if a in riders else -1 for a in chunk], dtype=np.int32)
+        store.bus_route[rows] = routes
+        counts += np.bincount(routes[routes >= 0], minlength=transit.num_routes)
+    transit.observe_counts(counts)
+
+    for start in range(0, num_agents, chunk_size):
+        rows = start + np.flatnonzero(store.bus_route[start:min(start + chunk_size, num_agents)] >= 0)
+        if rows.size == 0:
+            continue
+        chunk = pool[:rows.size]
+        store.load(chunk, rows)
+        ride_bus(chunk)
+        store.dump(chunk, rows)
+        store.bus_route[rows] = -1
+
+
+def run_chunked(city, scenario, homes, workplaces, tolerances, num_agents, max_ticks, summary,
+                memory_budget_mb=512, chunk_size=None, workdir=None, report_every=240, stats_path=None,
+                transit=None, track_locations=True):
+    """
+    Simulate num_agents agents for max_ticks ticks, processing the population in
+    chunks so that at most chunk_size Agent objects are alive at a time. Final
+    agent states are reduced into the given StreamingSummary, which is returned.
+    homes and workplaces are the building ids of the scenario agents are assigned to.
+    """
+    if chunk_size is None:
+        chunk_size = get_chunk_size(memory_budget_mb, estimate_agent_bytes(city, scenario, homes[0], workplaces[0]), num_agents)
+    chunk_size = min(chunk_size, num_agents)
+
+    remove_workdir = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="agents_")
+
+    pool = [Agent(name="A0", social_tolerance=1, city=city, home=homes[0], workplace=workplaces[0], transit=transit, scenario=scenario) for _ in range(chunk_size)]
+    need_keys = list(pool[0].needs.keys())
+    store = AgentStateStore(num_agents, need_keys, workdir)
+    print(f"Chunked run: {num_agents} agents in chunks of {chunk_size}, state in {workdir} ({store.bytes_per_agent * num_agents / 2**20:.1f} MB on disk)")
+
+    init_population(store, homes, workplaces, tolerances,
+                    initial_needs=[pool[0].initial_needs[k] for k in need_keys], chunk_size=chunk_size)
+    if track_locations:
+        locations = init_locations(store, scenario.building_names, chunk_size)
+        for agent in pool:
+            agent.locations = locations
+
+    tick_rates = []
+    rss = []
+    try:
+        for t in range(max_ticks):
+            tick_start = time.perf_counter()
+            step_chunked(store, pool, t, transit=transit)
+
+            elapsed = time.perf_counter() - tick_start
+            tick_rates.append(num_agents / elapsed if elapsed > 0 else float('inf'))
+            rss.append(get_rss_mb())
+            if (t + 1) % report_every == 0 or t == max_ticks - 1:
+                print(f"[{t+1}/{max_ticks}] {tick_rates[-1]:.0f} agent-steps/s, RSS {rss[-1]:.1f} MB, peak RSS {get_peak_rss_mb():.1f} MB")
+
+        # Reduce final states chunk by chunk
+        store.flush()
+        for start in range(0, num_agents, chunk_size):
+            stop = min(start + chunk_size, num_agents)
+            summary.update_arrays(tolerance=store.social_tolerance[start:stop],
+                                  wealth=store.wealth[start:stop],
+                                  social_burnout=store.social_burnout_sum[start:stop],
+                                  energy_burnout=store.energy_burnout_sum[start:stop])
+    finally:
+        del store
+        if track_locations:
+            del locations
+        if remove_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if stats_path is not None:
+        with open(stats_path, "w") as f:
+            json.dump({"num_agents": num_agents, "chunk_size": chunk_size, "memory_budget_mb": memory_budget_mb,
+                       "agent_steps_per_sec": tick_rates, "rss_mb": rss, "peak_rss_mb": get_peak_rss_mb()}, f)
+        print(f"Throughput stats saved to: {stats_path}")
+    return summary
@@ -17,21 +17,84 @@ WARNING: .map files in MAPF benchmarks are assumed to consist of only
 """
 
 
+import copy
 import numpy as np
 import heapq
+from collections import deque
+
+
+class ReservationTable:
+    """
+    Hashed space-time reservation table of cooperative pathfinding: the agent
+    occupying a cell at a time step, in one hash table of cells per time step
+    so that past time steps are dropped at once. Time steps are moves, a
+    simulation tick spans cells_per_tick of them.
+    """
+    def __init__(self, cells_per_tick=64):
+        self.cells_per_tick = cells_per_tick
+        self.now = 0 # First time step of the current tick
+        self._slots = {} # time step -> {cell: agent}
+
+    def begin_tick(self, tick):
+        self.now = tick * self.cells_per_tick
+        for t in [t for t in self._slots if t < self.now]:
+            del self._slots[t]
+
+    def reserve(self, cell, t, agent):
+        self._slots.setdefault(t, {})[cell] = agent
+
+    def owner(self, cell, t):
+        slot = self._slots.get(t)
+        return slot.get(cell) if slot else None
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots.values())
+
 
 class City:
-    def __init__(self, width=30, height=30, map_array=None):
+    def __init__(self, width=30, height=30, map_array=None, copy_array=True):
         # Warning: Map array is assumed to be consisting of 0 and 1s
         # where 0 means movable cell and 1 means obstacle cell.
+        # If copy_array is False, map_array is used as is (e.g. a shared memory buffer)
         if map_array is not None:
-            self.grid = np.array(map_array)
+            self.grid = np.array(map_array) if copy_array else map_array
             self.width, self.height = self.grid.shape
         else:
             self.width = width
             self.height = height
             self.grid = np.zeros((width, height))  # 0: free, 1: obstacle
 
+        # Precomputed shortest path lengths between a set of cells (e.g. buildings),
+        # see precompute_distances()
+        self.distance_table = None
+        self.distance_coords = []
+        self._distance_index = {}
+        self.last_expansions = 0 # Nodes expanded by the last shortest_path() query
+        self.last_lookup_hit = False # Whether the last get_shortest_path_length() query was served by the distance table
+        self._labels = None # Connected component of every cell, see labels
+        self._component_sizes = None
+        self._target_fields = {} # Distance fields to the targets of cooperative paths
+        self._moves = {} # Free neighbors of the cells visited by cooperative paths, and the cell itself
+        self.reservations = None # ReservationTable, see enable_cooperative()
+        self.window = 16
+        self.heuristic = "manhattan" # A* heuristic of shortest_path(): "manhattan" or "alt" (landmarks)
+        self.landmarks = [] # Landmark cells of the ALT heuristic, see precompute_landmarks()
+        self._landmark_fields = None # Distance from every landmark to every cell, one row per flat cell index
+        self.estimator = "manhattan" # Walk estimates of get_estimated_path_cost(): "manhattan" or "coarse"
+        self.coarse = None # CoarseGrid of the coarse estimator, see coarse_grid.py
+
+    def for_run(self, heuristic="manhattan", estimator="manhattan"):
+        """
+        Per-run view of the city. It shares the grid and the derived data (components,
+        distance table, landmarks, coarse grid) but has its own pathfinding settings and
+        reservations, so runs never change a City shared by the map registry.
+        """
+        view = copy.copy(self)
+        view.heuristic = heuristic
+        view.estimator = estimator
+        view.reservations = None
+        return view
+
     def get_free_cell_coords(self, grid=None, free_value=0):
         """
         Returns a list of (row, col) coordinates where the grid value equals `free_value`.
@@ -42,6 +105,44 @@ class City:
         coords = np.argwhere(grid == free_value)
         return [tuple(coord) for coord in coords]  
 
+    ############################################################################################################
+    # Connected components
+    ############################################################################################################
+
+    @property
+    def labels(self):
+        """
+        Connected component id of every cell (4-connected free cells), -1 for obstacles.
+        Computed once on first use, component 0 is the largest one.
+        """
+        if self._labels is None:
+            self._labels, self._component_sizes = label_components(self.grid == 0)
+        return self._labels
+
+    @property
+    def component_sizes(self):
+        self.labels
+        return self._component_sizes
+
+    def component_of(self, coord):
+        return int(self.labels[coord[0], coord[1]])
+
+    def is_reachable(self, start, target):
+        # O(1) lookup, a path exists iff both cells are free and in the same component
+        label = self.labels[start[0], start[1]]
+        return label >= 0 and label == self.labels[target[0], target[1]]
+
+    def sample_free_cells(self, num_cells, component=0, replace=False, rng=None):
+        """
+        Samples (row, col) free cells of a connected component (by default the largest),
+        so sampled cells (e.g. houses and workplaces) are always mutually reachable.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        cells = np.flatnonzero(self.labels.ravel() == component)
+        picked = rng.choice(cells, size=num_cells, replace=replace)
+        rows, cols = np.divmod(picked, self.height)
+        return [(int(r), int(c)) for r, c in zip(rows, cols)]
+
     def in_bounds(self, coord):
         x, y = coord
         return 0 <= x < self.width and 0 <= y < self.height
@@ -57,19 +158,47 @@ class City:
 
     def get_estimated_path_cost(self, start, target):
         assert self.in_bounds(start) and self.in_bounds(target), f"Coordinates out of bounds"
+        if self.estimator == "coarse" and self.coarse is not None:
+            return self.coarse.estimate(start, target) # Obstacle-aware, see coarse_grid.py
         return abs(start[0] - target[0]) + abs(start[1] - target[1])  # Manhattan
 
+    def get_landmark_bound(self, start, target):
+        # ALT lower bound of the path length (in moves) by the triangle inequality, max over landmarks of |d_L(target) - d_L(start)|
+        if not self.is_reachable(start, target):
+            return float('inf')
+        if self._landmark_fields is None: # No landmarks loaded, see precompute_landmarks()
+            return abs(start[0] - target[0]) + abs(start[1] - target[1])
+        h = self.height
+        return max(map(abs, map(int.__sub__, self._landmark_fields[start[0] * h + start[1]].tolist(),
+                                              self._landmark_fields[target[0] * h + target[1]].tolist())))
+
+    def _get_heuristic(self, target):
+        # A* heuristic to target, ALT bounds are combined with Manhattan (both are admissible and consistent).
+        # Landmarks that cannot reach the target cannot reach the searched cells either, their bound is 0
+        tx, ty = target
+        if self.heuristic != "alt" or self._landmark_fields is None:
+            return lambda c: abs(c[0] - tx) + abs(c[1] - ty)
+        fields, h = self._landmark_fields, self.height
+        to_target = fields[tx * h + ty].tolist()
+        return lambda c: max(abs(c[0] - tx) + abs(c[1] - ty), *map(abs, map(int.__sub__, fields[c[0] * h + c[1]].tolist(), to_target)))
+
     def shortest_path(self, start, target):
         assert self.in_bounds(start) and self.in_bounds(target), "Start or target out of bounds"
         assert self.is_free(start) and self.is_free(target), "Start or target is blocked"
+        if not self.is_reachable(start, target):
+            self.last_expansions = 0
+            return None # Different components, no need to search
+        heuristic = self._get_heuristic(target)
 
         frontier = []
         heapq.heappush(frontier, (0, start))
         came_from = {start: None}
         cost_so_far = {start: 0}
+        expansions = 0
 
         while frontier:
             _, current = heapq.heappop(frontier)
+            expansions += 1
 
             if current == target:
                 break
@@ -78,10 +207,11 @@ class City:
                 new_cost = cost_so_far[current] + 1  # cost to move = 1
                 if next not in cost_so_far or new_cost < cost_so_far[next]:
                     cost_so_far[next] = new_cost
-                    priority = new_cost + self.get_estimated_path_cost(next, target)
+                    priority = new_cost + heuristic(next)
                     heapq.heappush(frontier, (priority, next))
                     came_from[next] = current
 
+        self.last_expansions = expansions
         if target not in came_from:
             return None  # No path found
 
@@ -96,9 +226,263 @@ class City:
         return path
 
     def get_shortest_path_length(self, start, target):
+        if self.distance_table is not None:
+            i = self._distance_index.get(start)
+            j = self._distance_index.get(target)
+            if i is not None and j is not None:
+                self.last_lookup_hit = True
+                return float(self.distance_table[i, j])
+
+        self.last_lookup_hit = False
         path = self.shortest_path(start, target)
         return len(path) if path else float('inf')
 
+    ############################################################################################################
+    # Cooperative pathfinding
+    ############################################################################################################
+
+    def enable_cooperative(self, window=16, cells_per_tick=64):
+        # Paths of cooperative_path() reserve their cells, later paths avoid them
+        self.reservations = ReservationTable(cells_per_tick)
+        self.window = window
+
+    def disable_cooperative(self):
+        self.reservations = None
+
+    def target_field(self, target):
+        # Exact distances to target, the heuristic of cooperative A*, computed once per target
+        if target not in self._target_fields:
+            self._target_fields[target] = self.distance_field(target)
+        return self._target_fields[target]
+
+    def cooperative_path(self, start, target, agent, t0=None):
+        """
+        Windowed cooperative A* (WHCA*, Silver 2005). Returns the space-time path from start
+        to target starting at time step t0 (default: the current tick), one cell per time step
+        (waits repeat a cell), avoiding the cells and swaps reserved by earlier paths. The path
+        is planned window moves at a time, and reserved for agent. Start and target cells are
+        buildings, they are never reserved. Returns None if target is unreachable.
+        """
+        assert self.reservations is not None, "Cooperative pathfinding is not enabled, see enable_cooperative()"
+        field = self.target_field(target)
+        if field[start] < 0:
+            self.last_expansions = 0
+            return None
+        t0 = self.reservations.now if t0 is None else t0
+        max_length = 4 * (int(field[start]) + self.window) # Give up on waiting in gridlocks
+        path = [start]
+        self.last_expansions = 0
+        while path[-1] != target:
+            segment = self._plan_window(path[-1], t0 + len(path) - 1, start, target, field, agent)
+            if segment is None or len(path) > max_length:
+                # Boxed in by reservations, finish without cooperation
+                expansions = self.last_expansions
+                path.extend(self.shortest_path(path[-1], target)[1:])
+                self.last_expansions += expansions
+                break
+            path.extend(segment[1:])
+
+        for i, cell in enumerate(path):
+            if cell != start and cell != target:
+                self.reservations.reserve(cell, t0 + i, agent)
+        return path
+
+    def _plan_window(self, cell, t, start, target, field, agent):
+        # Space-time A* from cell at time step t for up to window moves (or waits),
+        # ends at the target or at the most promising cell of the window
+        slots = self.reservations._slots
+        moves = self._moves
+        frontier = [(int(field[cell]), 0, cell)]
+        came_from = {(cell, 0): None}
+        expansions = 0
+        while frontier:
+            _, g, current = heapq.heappop(frontier)
+            expansions += 1
+            if current == target or g == self.window:
+                break
+            if current not in moves:
+                moves[current] = self.neighbors(current) + [current] # Waiting is a move too
+            reserved_now, reserved_next = slots.get(t + g, {}), slots.get(t + g + 1, {})
+            for next in moves[current]:
+                if (next, g + 1) in came_from:
+                    continue
+                if next != target and next != start:
+                    owner = reserved_next.get(next)
+                    if owner is not None and owner != agent:
+                        continue # Vertex conflict
+                    owner = reserved_next.get(current)
+                    if owner is not None and owner != agent and owner == reserved_now.get(next):
+                        continue # Swap conflict
+                came_from[(next, g + 1)] = (current, g)
+                heapq.heappush(frontier, (g + 1 + int(field[next]), g + 1, next))
+        else:
+            self.last_expansions += expansions
+            return None
+        self.last_expansions += expansions
+
+        segment = []
+        state = (current, g)
+        while state is not None:
+            segment.append(state[0])
+            state = came_from[state]
+        segment.reverse()
+        return segment
+
+    def distance_field(self, source):
+        """
+        Returns the number of moves from source to every cell of the grid
+        (breadth-first search), -1 for obstacles and unreachable cells.
+        """
+        assert self.in_bounds(source) and self.is_free(source), "Source out of bounds or blocked"
+        free = (self.grid == 0).ravel()
+        dist = np.full(self.width * self.height, -1, dtype=np.int32)
+        w, h = self.width, self.height
+        start = source[0] * h + source[1]
+        dist[start] = 0
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            d = dist[current] + 1
+            x, y = divmod(current, h)
+            for nx, ny in ((x-1, y), (x+1, y), (x, y-1), (x, y+1)):
+                if 0 <= nx < w and 0 <= ny < h:
+                    n = nx * h + ny
+                    if free[n] and dist[n] < 0:
+                        dist[n] = d
+                        queue.append(n)
+        return dist.reshape(self.grid.shape)
+
+    def precompute_distances(self, coords):
+        """
+        Precomputes shortest path lengths (as returned by get_shortest_path_length)
+        between every pair of the given cells with one breadth-first search per cell.
+        """
+        coords = [tuple(int(v) for v in c) for c in coords]
+        unique = list(dict.fromkeys(coords))
+        table = np.full((len(unique), len(unique)), np.inf)
+        for i, source in enumerate(unique):
+            field = self.distance_field(source)
+            for j, target in enumerate(unique):
+                if field[target] >= 0:
+                    table[i, j] = field[target] + 1 # Path length counts both start and target cells
+        self.set_distance_table(unique, table)
+        return table
+
+    def extend_distances(self, coords):
+        """
+        Adds the given cells to the distance table, only searching from the cells that are
+        not in the table yet. Distances are symmetric on the 4-connected grid, so the
+        distances from the cells already in the table come for free.
+        """
+        coords = [tuple(int(v) for v in c) for c in coords]
+        new = [c for c in dict.fromkeys(coords) if c not in self._distance_index]
+        if self.distance_table is None:
+            return self.precompute_distances(new)
+        if not new:
+            return self.distance_table
+
+        old = len(self.distance_coords)
+        cells = self.distance_coords + new
+        table = np.full((len(cells), len(cells)), np.inf)
+        table[:old, :old] = self.distance_table
+        for i, source in enumerate(new, start=old):
+            field = self.distance_field(source)
+            for j, target in enumerate(cells):
+                if field[target] >= 0:
+                    table[i, j] = field[target] + 1
+        table[:old, old:] = table[old:, :old].T
+        self.set_distance_table(cells, table)
+        return table
+
+    ############################################################################################################
+    # Landmarks
+    ############################################################################################################
+
+    def precompute_landmarks(self, num_landmarks=8, component=0, seed=0):
+        """
+        Selects num_landmarks well-spread cells of a connected component (by default the
+        largest) by farthest-point selection, and keeps their distance fields for the ALT
+        heuristic. The first landmark is the cell farthest from a random cell, every next
+        one the cell farthest from the landmarks selected so far.
+        """
+        cells = np.flatnonzero(self.labels.ravel() == component)
+        rng = np.random.default_rng(seed)
+        farthest = self.distance_field(divmod(int(rng.choice(cells)), self.height)).ravel()
+        landmarks, fields = [], []
+        for _ in range(min(num_landmarks, cells.size)):
+            landmark = divmod(int(np.argmax(farthest)), self.height) # Cells of other components are -1
+            field = self.distance_field(landmark).ravel()
+            farthest = field if not fields else np.minimum(farthest, field)
+            landmarks.append(landmark)
+            fields.append(field)
+        self.set_landmarks(landmarks, np.stack(fields, axis=1))
+        return self._landmark_fields
+
+    def set_landmarks(self, landmarks, fields):
+        """
+        fields[i, k] is the number of moves from landmarks[k] to the cell with flat index i,
+        negative if unreachable. Stored as uint16 (uint32 on maps with longer paths), the
+        largest value marking unreachable cells.
+        """
+        fields = np.asarray(fields)
+        assert fields.shape == (self.width * self.height, len(landmarks)), f"Expected a {self.width * self.height}x{len(landmarks)} array, got {fields.shape}"
+        if np.issubdtype(fields.dtype, np.signedinteger):
+            dtype = np.uint16 if fields.max(initial=0) < np.iinfo(np.uint16).max else np.uint32
+            fields = np.where(fields < 0, np.iinfo(dtype).max, fields).astype(dtype)
+        self._landmark_fields = fields
+        self.landmarks = [tuple(int(v) for v in c) for c in landmarks]
+
+    def set_distance_table(self, coords, table):
+        # table[i, j] is the shortest path length from coords[i] to coords[j]
+        assert table.shape == (len(coords), len(coords)), f"Expected a {len(coords)}x{len(coords)} table, got {table.shape}"
+        self.distance_table = table
+        self.distance_coords = [tuple(int(v) for v in c) for c in coords]
+        self._distance_index = {c: i for i, c in enumerate(self.distance_coords)}
+
+
+def label_components(free):
+    """
+    Labels the 4-connected components of a boolean grid of free cells. Returns the
+    labels (-1 for blocked cells) with components ordered by decreasing size, and
+    the size of every component. Uses scipy.ndimage if available, otherwise a
+    breadth-first search from every unlabelled cell.
+    """
+    try:
+        from scipy import ndimage
+        labels, num = ndimage.label(free) # Default structure is 4-connectivity
+        labels = labels.astype(np.int32) - 1
+    except ImportError:
+        labels, num = _label_components_bfs(free)
+
+    # Relabel by decreasing size, so component 0 is the largest
+    sizes = np.bincount(labels[labels >= 0], minlength=num)
+    order = np.argsort(-sizes, kind="stable")
+    rank = np.empty(num + 1, dtype=np.int32)
+    rank[order] = np.arange(num, dtype=np.int32)
+    rank[num] = -1 # labels of -1 index the last entry
+    return rank[labels], sizes[order]
+
+def _label_components_bfs(free):
+    w, h = free.shape
+    free = free.ravel()
+    labels = np.full(w * h, -1, dtype=np.int32)
+    num = 0
+    for start in np.flatnonzero(free):
+        if labels[start] >= 0:
+            continue
+        labels[start] = num
+        queue = deque([start])
+        while queue:
+            x, y = divmod(queue.popleft(), h)
+            for nx, ny in ((x-1, y), (x+1, y), (x, y-1), (x, y+1)):
+                if 0 <= nx < w and 0 <= ny < h:
+                    n = nx * h + ny
+                    if free[n] and labels[n] < 0:
+                        labels[n] = num
+                        queue.append(n)
+        num += 1
+    return labels.reshape(w, h), num
+
 
 if __name__ == '__main__':
     import os 
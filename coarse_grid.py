@@ -0,0 +1,109 @@
+"""
+
+Coarse-grid estimates of walking distances, a middle tier between Manhattan
+distance (cheap, but ignores walls) and A* (exact, but too slow to call for
+every action an agent scores). The map is divided into factor x factor blocks,
+and the connected free regions of every block are the cells of the coarse
+grid, so walls running through a block split it and blocks that are only
+connected around a corner are not adjacent. Regions of neighboring blocks
+sharing an edge of free cells are connected, weighted by the Manhattan
+distance of their centroids.
+
+A walk from a cell to another is estimated as the distance to the centroid of
+its region, plus the coarse distance between the regions, plus the distance
+from the centroid of the target region. Coarse distances to the regions of
+the buildings are precomputed once (Dijkstra on the region graph), so an
+estimate is a few array lookups. Smaller factors give more accurate estimates
+on larger coarse grids (config.yaml, pathfinding.coarse_factor).
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import heapq
+import numpy as np
+
+from city import label_components
+
+
+class CoarseGrid:
+    def __init__(self, grid, factor=8):
+        self.factor = factor
+        self.regions, self.num_regions = get_block_regions(np.asarray(grid) == 0, factor)
+
+        # Centroids of the regions
+        free = np.flatnonzero(self.regions.ravel() >= 0)
+        rows, cols = np.divmod(free, self.regions.shape[1])
+        labels = self.regions.ravel()[free]
+        sizes = np.bincount(labels, minlength=self.num_regions)
+        self.centroid_rows = np.bincount(labels, rows, self.num_regions) / sizes
+        self.centroid_cols = np.bincount(labels, cols, self.num_regions) / sizes
+
+        # Regions touching across a block boundary are neighbors
+        pairs = []
+        for a, b in ((self.regions[:-1, :], self.regions[1:, :]), (self.regions[:, :-1], self.regions[:, 1:])):
+            touching = (a >= 0) & (b >= 0) & (a != b)
+            pairs.append(np.stack([a[touching], b[touching]], axis=1))
+        pairs = np.unique(np.sort(np.concatenate(pairs), axis=1), axis=0)
+        weights = np.abs(self.centroid_rows[pairs[:, 0]] - self.centroid_rows[pairs[:, 1]]) + \
+                  np.abs(self.centroid_cols[pairs[:, 0]] - self.centroid_cols[pairs[:, 1]])
+        self._centroids = (self.centroid_rows.tolist(), self.centroid_cols.tolist()) # Faster to index one by one
+        self._neighbors = [[] for _ in range(self.num_regions)]
+        for (u, v), w in zip(pairs.tolist(), weights.tolist()):
+            self._neighbors[u].append((v, w))
+            self._neighbors[v].append((u, w))
+        self._fields = {} # Target region -> coarse distance from every region
+
+    @property
+    def nbytes(self):
+        return self.regions.nbytes + sum(field.nbytes for field in self._fields.values())
+
+    def region_field(self, target):
+        """Coarse distance from every region to the target region (inf if unreachable), cached."""
+        field = self._fields.get(target)
+        if field is None:
+            field = np.full(self.num_regions, np.inf)
+            field[target] = 0
+            frontier = [(0.0, target)]
+            while frontier:
+                d, current = heapq.heappop(frontier)
+                if d > field[current]:
+                    continue
+                for next, w in self._neighbors[current]:
+                    if d + w < field[next]:
+                        field[next] = d + w
+                        heapq.heappush(frontier, (d + w, next))
+            self._fields[target] = field
+        return field
+
+    def precompute(self, coords):
+        # Coarse distances to the regions of the given cells, e.g. every building
+        for coord in coords:
+            self.region_field(int(self.regions[coord[0], coord[1]]))
+
+    def estimate(self, start, target):
+        """Estimated number of moves from start to target, inf if they are not connected."""
+        rs = int(self.regions[start[0], start[1]])
+        rt = int(self.regions[target[0], target[1]])
+        if rs == rt: # Same region, no wall of the block in between
+            return abs(start[0] - target[0]) + abs(start[1] - target[1])
+        rows, cols = self._centroids
+        return (abs(start[0] - rows[rs]) + abs(start[1] - cols[rs]) + float(self.region_field(rt)[rs]) +
+                abs(target[0] - rows[rt]) + abs(target[1] - cols[rt]))
+
+
+def get_block_regions(free, factor):
+    """
+    Labels the connected free regions of every factor x factor block of a boolean grid
+    of free cells, -1 for blocked cells. Blocks are laid out with a blocked border in
+    between, so a single labelling of the whole map cannot connect cells of different blocks.
+    """
+    w, h = free.shape
+    bw, bh = -(-w // factor), -(-h // factor)
+    padded = np.zeros((bw * factor, bh * factor), dtype=bool)
+    padded[:w, :h] = free
+    mosaic = np.zeros((bw, factor + 1, bh, factor + 1), dtype=bool)
+    mosaic[:, :factor, :, :factor] = padded.reshape(bw, factor, bh, factor)
+    labels, sizes = label_components(mosaic.reshape(bw * (factor + 1), bh * (factor + 1)))
+    regions = labels.reshape(bw, factor + 1, bh, factor + 1)[:, :factor, :, :factor].reshape(bw * factor, bh * factor)
+    return np.ascontiguousarray(regions[:w, :h]), len(sizes)
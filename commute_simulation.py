@@ -20,11 +20,19 @@ for detailed description.
 import os
 import random
 import logging
+import time
 import argparse
+import numpy as np
     
-from city import City
-from agent import Agent
-from plot import plot_wealth_distribution, plot_relations
+from agent import Agent, step_agents
+from transit import Transit
+from locations import LocationIndex
+from scenario import compile_scenario
+from profiler import PROFILER
+from stats import StreamingSummary, collect_metrics
+from results_store import save_results, make_metadata, METRICS_FILE
+from result_cache import ResultCache, make_key, get_map_hash
+from map_registry import MapRegistry
 
 # Read config.yaml for simulation parameters
 import yaml
@@ -35,6 +43,8 @@ DAY_LENGTH = config['simulation']['day_length']
 MAX_TICKS = config['simulation']['max_ticks']
 NUM_AGENTS = config['simulation']['num_agents']
 BUS_PRICE = 0.005
+MAX_INCOME = 5.0 # Default Agent income per work tick, used to bound the wealth histogram
+MAPS = MapRegistry.from_config(config) # Loaded maps, shared by the runs of this process
 
 # For logging
 _TIME = 0 
@@ -42,44 +52,41 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(filename='simulation.log', encoding='utf-8', filemode='w', level=logging.INFO)
 
 
-def get_workplaces(policy):
-    workplaces = []
-    for wp in config["workplace_locations"]:
-        assert wp in config["policy"], f"Please specify policy for workplace {wp} in config.yaml under policy section."
-        if policy == config["policy"][wp]:
-            workplaces.append(wp)
-    
+def get_workplaces(scenario, policy):
+    # Building ids of the workplaces with the given policy
+    workplaces = scenario.workplaces_with_policy(policy)
     if len(workplaces) == 0:
         raise ValueError(f"No workplace found with policy {policy}. Consider adding it in config.yaml under policy section.")
     return workplaces
 
-def get_policy_colors(policy):
-    if policy == "fixed":
-        return "gray"
-    elif policy == "free":
-        return "cyan"
-    elif policy == "flex":
-        return "pink"
-    else:
-        print(f"WARNING: Undefined color for policy: {policy}")
-        return "pink"
-
-
-def prepare_results_path(policy):
-    results_dir = os.path.join(os.path.dirname(__file__), "results")
+def prepare_results_path(policy, results_dir=None):
+    if results_dir is None:
+        results_dir = os.path.join(os.path.dirname(__file__), "results")
     os.makedirs(results_dir, exist_ok=True)
 
     policy_results_dir = os.path.join(results_dir, policy)
     os.makedirs(policy_results_dir, exist_ok=True)
     return policy_results_dir
 
-def setup_agents(city):
+def get_available_tolerances():
+    return [i+1 for i in range(7)]
+
+def setup_transit(scenario):
+    # Bus crowd is randomized if no transit section is given in config.yaml
+    if "transit" not in config:
+        return None
+    return Transit.from_config(config, scenario)
+
+def setup_locations(scenario):
+    return LocationIndex(buildings=scenario.building_names, capacity=NUM_AGENTS)
+
+def setup_agents(city, scenario, policy, transit=None, locations=None):
     
-    available_homes = [k for k in config["houses"].keys()]
-    available_workplaces = get_workplaces(policy=POLICY)  # For the experiments only get the workplaces with the same policy
-    available_tolerances = [i+1 for i in range(7)]
-    print("Available workplaces: ", available_workplaces)
-    print("Available houses: ", available_homes)
+    available_homes = list(scenario.homes)
+    available_workplaces = get_workplaces(scenario, policy=policy)  # For the experiments only get the workplaces with the same policy
+    available_tolerances = get_available_tolerances()
+    print("Available workplaces: ", [scenario.name(w) for w in available_workplaces])
+    print("Available houses: ", [scenario.name(h) for h in available_homes])
     #available_cells = city.get_free_cell_coords()
     
     agents = []
@@ -88,55 +95,284 @@ def setup_agents(city):
                   city=city,
                   home=random.choice(available_homes),
                   workplace=random.choice(available_workplaces),
-                  social_tolerance=random.choice(available_tolerances)
+                  social_tolerance=random.choice(available_tolerances),
+                  transit=transit,
+                  locations=locations,
+                  scenario=scenario
                 ) 
         agents.append(a)
     return agents
 
-def load_simulation_map(assetspath='assets', mapname = 'maze-128-128-10.map'):
-    from io_handler import get_binary_map
+def load_simulation_map(name=None, coords=None):
+    # Shared City of a map name, path or hash (default: maps.default in config.yaml), see map_registry.py
+    city = MAPS.get(name, coords=coords)
+    print(f"Map loaded: {MAPS.resolve(name)} ({city.width}x{city.height})")
+    return city
 
-    mapfile_path = os.path.join(os.path.dirname(__file__), assetspath, mapname)
-    binary_grid = get_binary_map = get_binary_map(mapfile_path=mapfile_path)
-    print("Map loaded\n:", binary_grid)
+def apply_layout(layout_path):
+    # Replace the buildings of config.yaml by a building layout, e.g. written by map_generator.py
+    with open(layout_path, "r") as f:
+        layout = yaml.safe_load(f)
+    for key in ("houses", "workplace_locations", "policy"):
+        config[key] = layout[key]
+    if "transit" in config and "transit" in layout:
+        config["transit"]["routes"] = layout["transit"]["routes"]
 
-    city = City(map_array=binary_grid)
-    return city
+def get_streaming_summary():
+    stats_config = config.get('stats', {})
+    wealth_range = (-BUS_PRICE * MAX_TICKS, MAX_INCOME * MAX_TICKS)
+    return StreamingSummary(wealth_range=wealth_range,
+                            bins=stats_config.get('wealth_bins', 20),
+                            exact_gini=stats_config.get('exact_gini', True))
+def run_policy(args, city, scenario, policy, res_path, telemetry=None):
+    """
+    Simulate the agents of a policy and save the results under res_path. Returns the
+    per-agent metrics (None for chunked and sharded runs) and the paths of the saved files.
+    If a telemetry publisher is given, per-tick aggregates are published while simulating.
+    """
+    transit = setup_transit(scenario)
+    path_config = config.get("pathfinding") or {}
+    if city is not None:
+        heuristic = args.heuristic or path_config.get("heuristic", "manhattan")
+        if heuristic == "alt":
+            MAPS.precompute_landmarks(city, path_config.get("landmarks", 8)) # Loaded from disk if cached
+        estimator = path_config.get("estimate", "manhattan")
+        if estimator == "coarse":
+            MAPS.precompute_coarse(city, path_config.get("coarse_factor", 8), scenario.coords)
+        # Settings and reservations of this run stay off the City shared by the map registry,
+        # so a failed run cannot leak them into the next runs on the map
+        city = city.for_run(heuristic=heuristic, estimator=estimator)
+    if args.shards is not None:
+        from sharded import run_sharded
+        summary, _ = run_sharded(city, scenario, config, policy,
+                                 tolerances=get_available_tolerances(),
+                                 num_agents=NUM_AGENTS,
+                                 max_ticks=MAX_TICKS,
+                                 summary=get_streaming_summary(),
+                                 num_shards=args.shards,
+                                 seed=args.seed,
+                                 report_every=DAY_LENGTH)
+        summary.report()
+        summary.save(os.path.join(res_path, "summary.json"))
+        return None, [os.path.join(res_path, "summary.json")]
 
-            
-if __name__ == "__main__":
-    
+    if args.chunked:
+        from chunked import run_chunked
+        summary = run_chunked(city, scenario,
+                              homes=list(scenario.homes),
+                              workplaces=get_workplaces(scenario, policy=policy),
+                              tolerances=get_available_tolerances(),
+                              num_agents=NUM_AGENTS,
+                              max_ticks=MAX_TICKS,
+                              summary=get_streaming_summary(),
+                              memory_budget_mb=args.memory_budget,
+                              chunk_size=args.chunk_size,
+                              workdir=args.workdir,
+                              report_every=DAY_LENGTH,
+                              stats_path=os.path.join(res_path, "throughput.json"),
+                              transit=transit)
+        summary.report()
+        summary.save(os.path.join(res_path, "summary.json"))
+        return None, [os.path.join(res_path, "summary.json"), os.path.join(res_path, "throughput.json")]
+
+    agents = setup_agents(city, scenario, policy, transit=transit, locations=setup_locations(scenario))
+    monitor = None
+    if args.converge is not None:
+        from convergence import ConvergenceMonitor
+        monitor = ConvergenceMonitor.from_config(config, mode=args.converge or None)
+    cooperative = city is not None and (args.cooperative or path_config.get("cooperative", False))
+    if cooperative:
+        city.enable_cooperative(window=path_config.get("window", 16), cells_per_tick=path_config.get("cells_per_tick", 64))
+    commutes = None
+    if city is not None and (args.multi_tick or path_config.get("multi_tick", False)):
+        from commutes import CommuteTracker
+        commutes = CommuteTracker(city, scenario, agents, cells_per_tick=path_config.get("cells_per_tick", 64))
+    recorder = None
+    if args.trace is not None:
+        from decision_trace import TraceRecorder
+        recorder = TraceRecorder(os.path.join(args.trace, policy) if args.trace else os.path.join(res_path, "trace"), agents, MAX_TICKS, snapshot_every=DAY_LENGTH,
+                                 policy=policy, seed=args.seed, randomize_walk=args.randomize_walk, commutes=commutes)
+
+    if telemetry is not None:
+        telemetry.begin_run(policy=policy)
+
+
+    # Simulate
+    ticks_run = MAX_TICKS
+    with PROFILER.phase("simulation"):
+        for t in range(MAX_TICKS):
+            if recorder is not None:
+                recorder.begin_tick(t)
+            if cooperative:
+                city.reservations.begin_tick(t)
+            step_agents(agents, t, transit=transit, commutes=commutes)
+            if telemetry is not None:
+                telemetry.observe(agents, t)
+            if monitor is not None and monitor.observe(agents, t):
+                ticks_run = t + 1
+                break
+    if recorder is not None:
+        recorder.close(ticks_run)
+
+    metrics = collect_metrics(agents)
+    extra = {}
+    if monitor is not None:
+        if monitor.mode == "extrapolate":
+            metrics = monitor.extrapolate(metrics, MAX_TICKS)
+        extra["convergence"] = monitor.to_dict()
+
+    # Reduce final agent states into bounded-memory aggregates
+    summary = get_streaming_summary()
+    summary.update_arrays(tolerance=metrics["tolerance"], wealth=metrics["wealth"],
+                          social_burnout=metrics["social_burnout"], energy_burnout=metrics["energy_burnout"])
+    summary.report()
+    summary.save(os.path.join(res_path, "summary.json"))
+    metrics_path = save_results(res_path, metrics, make_metadata(policy, config=config, seed=args.seed, num_agents=NUM_AGENTS, randomize_walk=args.randomize_walk, **extra))
+    return metrics, [os.path.join(res_path, "summary.json"), metrics_path]
+
+def run_policy_cached(args, city, scenario, policy, res_path, cache, telemetry=None):
+    """
+    run_policy() through the result cache. Returns the metrics (the results directory if they
+    were restored from the cache, None if there are none) and whether they were restored.
+    """
+    key, key_parts = make_key(config, args.seed, get_map_hash(city), policy=policy, num_agents=NUM_AGENTS,
+                              randomize_walk=args.randomize_walk, chunked=args.chunked, shards=args.shards, converge=args.converge,
+                              cooperative=args.cooperative, multi_tick=args.multi_tick)
+    if cache.restore(key, res_path) is not None:
+        return (res_path if os.path.exists(os.path.join(res_path, METRICS_FILE)) else None), True
+    metrics, files = run_policy(args, city, scenario, policy, res_path, telemetry=telemetry)
+    cache.put(key, files, key_parts)
+    return metrics, False
+
+def configure(new_config):
+    # Replace the config of this module, e.g. by a config with the overrides of a batch scenario.
+    # Loaded maps are kept unless the maps section changes
+    global config, DAY_LENGTH, MAX_TICKS, NUM_AGENTS, MAPS
+    if new_config.get("maps") != config.get("maps"):
+        MAPS = MapRegistry.from_config(new_config)
+    config = new_config
+    DAY_LENGTH = config['simulation']['day_length']
+    MAX_TICKS = config['simulation']['max_ticks']
+    NUM_AGENTS = config['simulation']['num_agents']
+
+def check_run_options(args, cache=None):
+    """
+    Warnings about the options that a run ignores, e.g. --cooperative with --chunked.
+    Returns the warnings and the result cache to use, None for runs that must not be
+    cached (runs without a seed and traced runs).
+    """
+    warnings = []
+    if args.chunked or args.shards is not None:
+        if args.converge is not None:
+            warnings.append("--converge is only supported without --chunked and --shards, runs will not stop early")
+        if args.cooperative:
+            warnings.append("--cooperative is only supported without --chunked and --shards, agents route independently")
+        if args.multi_tick or (config.get("pathfinding") or {}).get("multi_tick"):
+            warnings.append("--multi-tick is only supported without --chunked and --shards, walks take a single time step")
+        if args.trace is not None:
+            warnings.append("--trace is only supported without --chunked and --shards, no trace is recorded")
+        if args.telemetry is not None:
+            warnings.append("--telemetry is only supported without --chunked and --shards, nothing is published")
+    if cache is not None and args.seed is None:
+        warnings.append("Results of runs without --seed are not cached")
+        cache = None
+    if cache is not None and args.trace is not None:
+        warnings.append("Traced runs are not cached")
+        cache = None
+    return warnings, cache
+
+def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("-rw", "--randomize-walk", help="Allow agents to walk in randomize path lengths instead of the shortest path.", action="store_true", default=False)
     parser.add_argument("-p", "--policy", help="Choose workplace policy (available options: 'fixed', 'free', 'flex'). If None, run simulations for all available policies. Default: None", type=str, default=None)
-    args = parser.parse_args()
+    parser.add_argument("-n", "--num-agents", help="Number of agents, overrides num_agents in config.yaml.", type=int, default=None)
+    parser.add_argument("--chunked", help="Process the population in chunks with memory-mapped agent states instead of keeping every Agent in memory. No plots are produced in this mode.", action="store_true", default=False)
+    parser.add_argument("--memory-budget", help="Memory budget in MB used to choose the chunk size in --chunked mode. Default: 512", type=float, default=512)
+    parser.add_argument("--chunk-size", help="Number of agents per chunk in --chunked mode, overrides --memory-budget.", type=int, default=None)
+    parser.add_argument("--workdir", help="Directory for the memory-mapped agent states in --chunked mode. Default: a temporary directory", type=str, default=None)
+    parser.add_argument("--shards", help="Split the population by agent range across this many processes, with the city grid and distance tables in shared memory. No plots are produced in this mode.", type=int, default=None)
+    parser.add_argument("--map", help="Map to simulate on: name of a .map file in maps.dir, path of a .map file (e.g. generated by map_generator.py) or content hash of a loaded map. Default: maps.default in config.yaml", type=str, default=None)
+    parser.add_argument("--layout", help="Building layout (.yaml with houses, workplace_locations, policy and transit routes) replacing the buildings of config.yaml, e.g. generated by map_generator.py", type=str, default=None)
+    parser.add_argument("--cooperative", help="Route walking agents together with windowed cooperative A* on a space-time reservation table, so congestion makes walks longer (see pathfinding section of config.yaml).", action="store_true", default=False)
+    parser.add_argument("--multi-tick", help="Walks take several ticks, agents follow their path at pathfinding.cells_per_tick cells per tick (see commutes.py).", action="store_true", default=False)
+    parser.add_argument("--heuristic", help="A* heuristic of shortest paths not covered by the distance table: 'manhattan', or 'alt' for landmark lower bounds (landmarks are precomputed once per map and cached on disk, see maps.landmarks_dir). Default: pathfinding.heuristic in config.yaml", type=str, default=None, choices=["manhattan", "alt"])
+    parser.add_argument("--seed", help="Random seed of the simulation. Default: None", type=int, default=None)
+    parser.add_argument("--profile", help="Record per-phase wall times, call counts, A* node expansions and distance table hit rates, and save them as JSON to the given path. Default path: results/profile.json", type=str, nargs="?", const=os.path.join("results", "profile.json"), default=None)
+    parser.add_argument("--converge", help="Stop runs early once per-day Gini and burnout rates by tolerance are stable (see convergence section of config.yaml). Optional mode: 'stop' reports the state at the stopping tick, 'extrapolate' extrapolates wealth and burnout counts to max_ticks. Default mode: convergence.mode in config.yaml", type=str, nargs="?", const="", default=None, choices=["", "stop", "extrapolate"])
+    parser.add_argument("--cache", help="Reuse the results of previous runs with the same config, seed, map and model code instead of simulating again, and cache new results (requires --seed). See result_cache.py", action="store_true", default=False)
+    parser.add_argument("--results-dir", help="Directory of the results, saved under <results-dir>/<policy>. Default: results", type=str, default=None)
+    parser.add_argument("--headless", help="Only save numeric results (summary.json and metrics.npz) without importing matplotlib. Figures can be rendered later with render.py", action="store_true", default=False)
+    parser.add_argument("--trace", help="Record the realized actions of every agent for replay with decision_trace.py, under <TRACE>/<policy>. Default: <results-dir>/<policy>/trace", type=str, nargs="?", const="", default=None)
+    parser.add_argument("--telemetry", help="Publish sampled per-tick aggregates (ticks per second, mean needs, agents in recovery, wealth quantiles, action mix) to a JSON lines file, or to unix:<path> of a socket, see telemetry.py. Default path: results/telemetry.jsonl", type=str, nargs="?", const=os.path.join("results", "telemetry.jsonl"), default=None)
+    parser.add_argument("--profile-dump", help="Also save a cProfile dump (e.g. for snakeviz or flameprof) to the given path.", type=str, default=None)
+    return parser
+
+            
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+
+    if args.profile is not None:
+        PROFILER.enable()
+    if args.profile_dump is not None:
+        import cProfile
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+    run_start = time.perf_counter()
 
     if args.randomize_walk: 
         print("No city provided for randomized walk setting.")
         city = None
     else:
         print("Loading city map...")
-        city = load_simulation_map()
+        city = load_simulation_map(args.map)
+
+    if args.layout is not None:
+        apply_layout(args.layout)
+    scenario = compile_scenario(config, city) # Validates buildings and policies
+    if city is not None:
+        MAPS.precompute(city, scenario.coords) # Walks between buildings are table lookups instead of A* searches
+    warnings, cache = check_run_options(args, ResultCache.from_config(config) if args.cache else None)
+    for warning in warnings:
+        print("WARNING: " + warning)
+    telemetry = None
+    if args.telemetry is not None and not (args.chunked or args.shards is not None):
+        from telemetry import Telemetry
+        telemetry = Telemetry.from_config(config, args.telemetry).start()
 
     if args.policy is None: policies = ["fixed", "free", "flex"] 
     else: policies = [args.policy]
     print("Simulation will run for policies: ", policies)
+    if args.num_agents is not None: NUM_AGENTS = args.num_agents
 
     for POLICY in policies:
         print("Current policy: ", POLICY)
-        agents = setup_agents(city)
+        res_path = prepare_results_path(POLICY, results_dir=args.results_dir)
+        if args.seed is not None:
+            # Every policy run starts from the seed, so it is reproducible (and cacheable) on its own
+            random.seed(args.seed)
+            np.random.seed(args.seed)
 
-        # Simulate
-        for t in range(MAX_TICKS):
-            for agent in agents:
-                logger.info(f'[{t}] Time step ------------')
-                agent.deliberate_action(t)
-                agent.decay_needs_sat() # Water tank model, decay needs
+        if cache is not None:
+            metrics, _ = run_policy_cached(args, city, scenario, POLICY, res_path, cache, telemetry=telemetry)
+        else:
+            metrics, _ = run_policy(args, city, scenario, POLICY, res_path, telemetry=telemetry)
 
         # Plot policy results
-        res_path = prepare_results_path(POLICY)
-        plot_wealth_distribution(agents, title=f"Policy: {POLICY}", color=get_policy_colors(POLICY), save=True, results_dir=res_path)
-        plot_relations(agents, lambda a: a.social_tolerance, lambda a: a.final_wealth(), xlabel="tolerance", ylabel="wealth", title="Social Tolerance vs. Wealth", results_dir=res_path)
-        plot_relations(agents, lambda a: a.social_tolerance, lambda a: a.social_burnout_sum,  xlabel="tolerance", ylabel="social-burnout", title="Social Tolerance vs. Social Burnout Rate", results_dir=res_path)
-        plot_relations(agents, lambda a: a.social_tolerance, lambda a: a.energy_burnout_sum,  xlabel="tolerance", ylabel="energy-burnout",  title="Social Tolerance vs. Energy Burnout Rate", results_dir=res_path)
-        plot_relations(agents, lambda a: a.social_burnout_sum, lambda a: a.final_wealth(),  xlabel="social-burnout", ylabel="wealth",  title="Social Burnout Rate vs. Wealth", results_dir=res_path)
+        if args.headless or metrics is None:
+            continue
+        with PROFILER.phase("plotting"):
+            from plot import plot_policy_results # Deferred, loads matplotlib
+            plot_policy_results(metrics, policy=POLICY, results_dir=res_path)
+
+    if telemetry is not None:
+        telemetry.close()
+    run_time = time.perf_counter() - run_start
+    if args.profile_dump is not None:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.profile_dump)
+        print(f"cProfile dump saved to: {args.profile_dump}")
+    if args.profile is not None:
+        PROFILER.disable()
+        PROFILER.print_report(wall_time=run_time)
+        os.makedirs(os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+        PROFILER.save(args.profile, wall_time=run_time)
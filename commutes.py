@@ -0,0 +1,120 @@
+"""
+
+Multi-tick commutes. Instead of relocating in the tick they start walking,
+walking agents follow their path at pathfinding.cells_per_tick cells per tick
+and only arrive once they reach its end. Paths are stored back to back in a
+single cell buffer (shortest paths between a pair of buildings only once,
+cooperative paths per walk), and every agent holds an offset into its path,
+so all agents in transit advance in one vectorized step per tick. Positions
+of the whole population are kept in an array of flat cell indices.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import numpy as np
+
+
+class CommuteTracker:
+    def __init__(self, city, scenario, agents, cells_per_tick=64):
+        self.city = city
+        self.scenario = scenario
+        self.cells_per_tick = cells_per_tick
+        self.agents = list(agents)
+        self.index = {id(agent): i for i, agent in enumerate(self.agents)}
+        n = len(self.agents)
+
+        self.cell = np.array([self._flat(scenario.coord_tuples[a.where]) for a in self.agents], dtype=np.int64) # Position of every agent
+        self.in_transit = np.zeros(n, dtype=bool)
+        self.progress = np.zeros(n, dtype=np.int64)    # Offset into the path of the agent
+        self.path_start = np.zeros(n, dtype=np.int64)  # Offset of the path of the agent in the buffer
+        self.path_length = np.zeros(n, dtype=np.int64)
+        self.destination = np.zeros(n, dtype=np.int32) # Building id
+
+        self.buffer = np.empty(1024, dtype=np.int64) # Cells of the paths, back to back
+        self.used = 0
+        self._shared = {} # (start, target) -> (offset, length) of shortest paths between buildings
+        for agent in self.agents:
+            agent.commutes = self
+
+    def _flat(self, coord):
+        return coord[0] * self.city.height + coord[1]
+
+    def _store(self, path):
+        # Append the cells of a path to the buffer, returns its (offset, length)
+        if self.used + len(path) > self.buffer.size:
+            self._compact(len(path))
+        cells = np.array([self._flat(c) for c in path], dtype=np.int64)
+        offset = self.used
+        self.buffer[offset:offset + len(cells)] = cells
+        self.used += len(cells)
+        return offset, len(cells)
+
+    def _compact(self, extra):
+        # Keep only the shared paths and the paths of agents in transit, grow if still too small
+        moving = np.flatnonzero(self.in_transit)
+        segments = dict(segment for segment in self._shared.values() if segment is not None)
+        segments.update(zip(self.path_start[moving].tolist(), self.path_length[moving].tolist()))
+        live = sum(segments.values())
+        buffer = np.empty(max(self.buffer.size, 2 * (live + extra)), dtype=np.int64)
+        moved = {}
+        used = 0
+        for offset, length in segments.items():
+            buffer[used:used + length] = self.buffer[offset:offset + length]
+            moved[offset] = used
+            used += length
+        self._shared = {key: (moved[segment[0]], segment[1]) if segment else None for key, segment in self._shared.items()}
+        self.path_start[moving] = [moved[offset] for offset in self.path_start[moving].tolist()]
+        self.buffer, self.used = buffer, used
+
+    def depart(self, agent, destination, path=None):
+        """
+        Start walking agent to the destination building along path (default: the shortest
+        path). Returns False if there is no path, the agent should relocate at once then.
+        """
+        start = self.scenario.coord_tuples[agent.where]
+        target = self.scenario.coord_tuples[destination]
+        if path is None:
+            if (start, target) not in self._shared:
+                shortest = self.city.shortest_path(start, target)
+                self._shared[(start, target)] = self._store(shortest) if shortest else None
+            segment = self._shared[(start, target)]
+        else:
+            segment = self._store(path)
+        if segment is None:
+            return False
+
+        i = self.index[id(agent)]
+        self.path_start[i], self.path_length[i] = segment
+        self.progress[i] = 0
+        self.destination[i] = destination
+        self.in_transit[i] = True
+        self.cell[i] = self.buffer[segment[0]]
+        return True
+
+    def place(self, agent, building):
+        # Agent relocated to building, e.g. by bus or on arrival
+        self.cell[self.index[id(agent)]] = self._flat(self.scenario.coord_tuples[building])
+
+    def advance(self):
+        """Move every agent in transit by cells_per_tick cells, returns the agents that arrived."""
+        moving = np.flatnonzero(self.in_transit)
+        if moving.size == 0:
+            return []
+        self.progress[moving] += self.cells_per_tick
+        last = self.path_length[moving] - 1
+        self.cell[moving] = self.buffer[self.path_start[moving] + np.minimum(self.progress[moving], last)]
+        arrived = moving[self.progress[moving] >= last]
+        self.in_transit[arrived] = False
+        agents = [self.agents[i] for i in arrived.tolist()]
+        for agent, destination in zip(agents, self.destination[arrived].tolist()):
+            agent.arrive(destination)
+        return agents
+
+    def positions(self):
+        # (row, col) of every agent, the cell of its building if it is not in transit
+        return np.stack(np.divmod(self.cell, self.city.height), axis=1)
+
+    @property
+    def num_in_transit(self):
+        return int(self.in_transit.sum())
@@ -0,0 +1,141 @@
+"""
+
+Steady-state detection for long simulation runs. At the end of every simulated
+day, the monitor records per-day aggregates of the population: the Gini index
+of wealth and the burnout rate (fraction of the day an agent spends in
+burnout, averaged) of every tolerance group. Once the Gini slope over the last
+`window` days falls below its tolerance and the mean burnout rate of every
+group over the last `window` days differs from its mean over the `window` days
+before by less than the burnout tolerance plus `burnout_z` standard errors, the
+run is considered converged and can be stopped early. Tolerance groups are
+small, so their daily rates are noisy and a fixed tolerance alone would rarely
+be met.
+
+Stopped runs either report the state at the stopping tick ("stop"), or
+extrapolate the per-agent wealth and burnout counts linearly to max_ticks
+with the rates of the last window ("extrapolate"). Either way, the stopping
+tick and the mode are logged and stored with the run metadata, so results of
+shortened runs can always be told apart.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import logging
+import numpy as np
+
+from stats import gini_coefficient, grouped_stats
+
+logger = logging.getLogger(__name__)
+
+MODES = ("stop", "extrapolate")
+
+
+class ConvergenceMonitor:
+    def __init__(self, day_length, window=3, gini_tolerance=0.002, burnout_tolerance=0.05, burnout_z=2.0, min_days=3, mode="stop"):
+        # window: number of days over which aggregates must be stable
+        # gini_tolerance: max absolute Gini slope per day over the window
+        # burnout_tolerance: max change of a group's mean burnout rate (fraction of the day in burnout) between two windows
+        # burnout_z: standard errors of the change of a group's mean burnout rate added to burnout_tolerance
+        assert mode in MODES, f"Unknown convergence mode {mode}, expected one of {MODES}"
+        self.day_length = day_length
+        self.window = window
+        self.gini_tolerance = gini_tolerance
+        self.burnout_tolerance = burnout_tolerance
+        self.burnout_z = burnout_z
+        self.min_days = max(min_days, 2 * window)
+        self.mode = mode
+
+        self.gini = []      # Gini index at the end of every day
+        self.burnout = []   # (groups,) burnout rates of every day
+        self.burnout_se = [] # (groups,) standard errors of the burnout rates of every day
+        self.groups = None  # Tolerance levels of the groups
+        self._snapshots = [] # Per-agent (wealth, social burnout, energy burnout) at the end of the last days
+        self.stopped_at = None
+        self.extrapolated = False
+
+    @classmethod
+    def from_config(cls, config, mode=None):
+        conv_config = config.get("convergence") or {}
+        return cls(day_length=config["simulation"]["day_length"],
+                   window=conv_config.get("window", 3),
+                   gini_tolerance=conv_config.get("gini_tolerance", 0.002),
+                   burnout_tolerance=conv_config.get("burnout_tolerance", 0.05),
+                   burnout_z=conv_config.get("burnout_z", 2.0),
+                   min_days=conv_config.get("min_days", 3),
+                   mode=mode or conv_config.get("mode", "stop"))
+
+    @property
+    def converged(self):
+        return self.stopped_at is not None
+
+    def _snapshot(self, agents):
+        return np.array([[a.final_wealth(), a.social_burnout_sum, a.energy_burnout_sum] for a in agents], dtype=float)
+
+    def observe(self, agents, t):
+        """Call after every tick t, returns True once the run has converged."""
+        if (t + 1) % self.day_length != 0 or self.converged:
+            return self.converged
+        snapshot = self._snapshot(agents)
+        previous = self._snapshots[-1] if self._snapshots else np.zeros_like(snapshot)
+        self._snapshots = (self._snapshots + [snapshot])[-(self.window + 1):]
+
+        # Fraction of the day every agent spent in burnout, averaged by tolerance group
+        if self.groups is None:
+            self.groups = np.array([a.social_tolerance for a in agents])
+        daily = (snapshot[:, 1:] - previous[:, 1:]).sum(axis=1) / self.day_length
+        _, counts, means, stds, _ = grouped_stats(self.groups, daily)
+        self.gini.append(float(gini_coefficient(snapshot[:, 0])))
+        self.burnout.append(means[0])
+        self.burnout_se.append(stds[0] / np.sqrt(counts))
+        day = len(self.gini)
+
+        if day < self.min_days:
+            return False
+        days = np.arange(self.window + 1)
+        gini_slope = np.polyfit(days, self.gini[-(self.window + 1):], 1)[0]
+        # Change of the mean burnout rate of every group between the last two windows, and its standard
+        # error (days taken as independent)
+        burnout = np.array(self.burnout[-2 * self.window:])
+        se = np.array(self.burnout_se[-2 * self.window:])
+        change = np.abs(burnout[self.window:].mean(axis=0) - burnout[:self.window].mean(axis=0))
+        allowed = self.burnout_tolerance + self.burnout_z * np.sqrt((se ** 2).sum(axis=0)) / self.window
+        worst = int(np.argmax(change / allowed))
+        logger.info(f"[CONVERGENCE] Day {day}: Gini {self.gini[-1]:.4f} (slope {gini_slope:+.5f}/day), "
+                    f"burnout rate change {change[worst]:.4f} (allowed {allowed[worst]:.4f}) of group {worst}")
+        if abs(gini_slope) < self.gini_tolerance and np.all(change < allowed):
+            self.stopped_at = t + 1
+            message = (f"[CONVERGENCE] Converged after {day} days (tick {self.stopped_at}): |Gini slope| {abs(gini_slope):.5f} < {self.gini_tolerance}, "
+                       f"burnout rate changes between the last two {self.window}-day windows within tolerance (at most {change[worst]:.4f} < {allowed[worst]:.4f}). Mode: {self.mode}")
+            logger.info(message)
+            print(message)
+        return self.converged
+
+    def extrapolate(self, metrics, max_ticks):
+        """
+        Extrapolate per-agent wealth and burnout counts (see stats.collect_metrics()) from the
+        stopping tick to max_ticks with the per-agent daily rates of the last window.
+        """
+        if not self.converged or self.stopped_at >= max_ticks:
+            return metrics
+        rates = (self._snapshots[-1] - self._snapshots[0]) / (len(self._snapshots) - 1)
+        remaining_days = (max_ticks - self.stopped_at) / self.day_length
+        metrics = dict(metrics)
+        metrics["wealth"] = metrics["wealth"] + rates[:, 0] * remaining_days
+        metrics["social_burnout"] = np.rint(metrics["social_burnout"] + rates[:, 1] * remaining_days).astype(np.int64)
+        metrics["energy_burnout"] = np.rint(metrics["energy_burnout"] + rates[:, 2] * remaining_days).astype(np.int64)
+        self.extrapolated = True
+        logger.info(f"[CONVERGENCE] Extrapolated wealth and burnout counts from tick {self.stopped_at} to {max_ticks}")
+        return metrics
+
+    def to_dict(self):
+        return {"converged": self.converged,
+                "stopped_at": self.stopped_at,
+                "mode": self.mode,
+                "extrapolated": self.extrapolated,
+                "window": self.window,
+                "gini_tolerance": self.gini_tolerance,
+                "burnout_tolerance": self.burnout_tolerance,
+                "burnout_z": self.burnout_z,
+                "daily_gini": self.gini,
+                "daily_burnout_rate": {str(k): [float(day[g]) for day in self.burnout] for g, k in enumerate(np.unique(self.groups))} if self.groups is not None else {}}
@@ -0,0 +1,255 @@
+"""
+
+Decision traces and deterministic replay. While recording, every action an
+agent takes is stored with its realized random effects (bus crowd, walk
+length, whether the agent socialized at work), one int8 action code and one
+float32 value per agent and tick. The state of the whole population is also
+snapshot every snapshot_every ticks and at the end of the run.
+
+Replaying a trace rebuilds the need and wealth trajectories of any agents by
+applying the recorded actions to fresh Agent objects, without scoring actions
+or searching paths, so inspecting a single agent or a window of ticks is cheap:
+replay starts from the latest snapshot before the window, e.g.
+
+    python decision_trace.py results/fixed/trace --agents 3 --start 240 --stop 264
+    python decision_trace.py results/fixed/trace --verify
+
+Traces are directories of .npy files (actions.npy, values.npy) that are
+memory-mapped when read, trace.json with the run parameters, and a
+snapshots/<tick> directory of agent states (see chunked.AgentStateStore).
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import json
+import shutil
+import logging
+import argparse
+import numpy as np
+
+from agent import Agent
+from chunked import AgentStateStore
+
+ACTIONS = ("take_bus", "walk", "rest", "sleep", "work", "wait") # Stored as int8 codes
+NO_ACTION = -1 # Tick spent on burnout recovery or meltdown
+VALUE_KWARGS = {"take_bus": "crowd", "walk": "length", "work": "socialize"} # Recorded random effect of an action
+TRACE_FILE = "trace.json"
+
+
+class TraceRecorder:
+    def __init__(self, path, agents, num_ticks, snapshot_every=24, commutes=None, **meta):
+        # commutes: commutes.CommuteTracker of runs with multi-tick commutes
+        # meta: run parameters stored in trace.json, e.g. policy and seed
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(os.path.join(path, "snapshots"))
+        self.path = path
+        self.agents = agents
+        self.snapshot_every = snapshot_every
+        self.rows = {id(agent): i for i, agent in enumerate(agents)}
+        self.tick = 0
+        self.commutes = commutes
+        self.meta = {"num_agents": len(agents), "num_ticks": num_ticks, "snapshot_every": snapshot_every,
+                     "need_keys": list(agents[0].needs), "income": agents[0].TIMESTEP_INCOME,
+                     "cells_per_tick": commutes.cells_per_tick if commutes is not None else None, **meta}
+
+        shape = (num_ticks, len(agents))
+        self.actions = np.lib.format.open_memmap(os.path.join(path, "actions.npy"), mode="w+", dtype=np.int8, shape=shape)
+        self.values = np.lib.format.open_memmap(os.path.join(path, "values.npy"), mode="w+", dtype=np.float32, shape=shape)
+        self.actions[:] = NO_ACTION
+        for agent in agents:
+            agent.trace = self
+
+    def begin_tick(self, t):
+        # Call before every tick t
+        self.tick = t
+        if t % self.snapshot_every == 0:
+            self.snapshot(t)
+
+    def record(self, agent, action, kwargs):
+        # Called by Agent.act() with the realized kwargs of the action
+        row = self.rows[id(agent)]
+        self.actions[self.tick, row] = ACTIONS.index(action)
+        if action in VALUE_KWARGS:
+            self.values[self.tick, row] = kwargs[VALUE_KWARGS[action]]
+
+    def snapshot(self, t):
+        # State of every agent before tick t
+        agents = self.agents
+        store = AgentStateStore(len(agents), self.meta["need_keys"], os.path.join(self.path, "snapshots", str(t)))
+        store.social_tolerance[:] = [a.social_tolerance for a in agents]
+        store.home[:] = [a.home for a in agents]
+        store.workplace[:] = [a.workplace for a in agents]
+        store.bus_route[:] = -1
+        store.dump(agents, slice(0, len(agents)))
+        store.flush()
+        if self.commutes is not None:
+            # Ticks until agents in transit arrive, and their destinations
+            c = self.commutes
+            left = np.where(c.in_transit, np.maximum(1, -(-(c.path_length - 1 - c.progress) // c.cells_per_tick)), 0)
+            np.save(os.path.join(self.path, "snapshots", str(t), "transit.npy"), np.stack([left, c.destination]))
+
+    def close(self, num_ticks_run):
+        # Final snapshot, num_ticks_run is less than num_ticks for runs stopped early
+        self.snapshot(num_ticks_run)
+        self.actions.flush()
+        self.values.flush()
+        self.meta["num_ticks_run"] = num_ticks_run
+        with open(os.path.join(self.path, TRACE_FILE), "w") as f:
+            json.dump(self.meta, f, indent=2, default=str)
+        for agent in self.agents:
+            agent.trace = None
+        print(f"Trace saved to: {self.path}")
+
+
+def load_trace(path):
+    # Run parameters and memory-mapped (ticks, agents) action codes and values of a trace
+    with open(os.path.join(path, TRACE_FILE), "r") as f:
+        meta = json.load(f)
+    actions = np.load(os.path.join(path, "actions.npy"), mmap_mode="r")
+    values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+    return meta, actions, values
+
+def get_snapshot_ticks(path):
+    return sorted(int(name) for name in os.listdir(os.path.join(path, "snapshots")))
+
+def load_snapshot(path, tick, rows, meta):
+    # Fresh Agent objects of the given rows in the state before tick
+    store = AgentStateStore(meta["num_agents"], meta["need_keys"], os.path.join(path, "snapshots", str(tick)), mode="r")
+    agents = [Agent(name="", social_tolerance=1, city=None, home=0, workplace=0, income=meta["income"]) for _ in rows]
+    store.load(agents, np.asarray(rows))
+    return agents
+
+class ReplayCommutes:
+    """
+    Stand-in of commutes.CommuteTracker for replays of runs with multi-tick commutes,
+    walks take as many ticks as in the recorded run, derived from their length.
+    """
+    def __init__(self, cells_per_tick, agents, transit=None):
+        self.cells_per_tick = cells_per_tick
+        self.length = None # Recorded length of the walk being replayed
+        self.walking = {} # id(agent) -> [ticks left, destination, agent]
+        for j, agent in enumerate(agents):
+            agent.commutes = self
+            if transit is not None and transit[0, j] > 0:
+                agent.in_transit = True
+                self.walking[id(agent)] = [int(transit[0, j]), int(transit[1, j]), agent]
+
+    def depart(self, agent, destination, path=None):
+        if not np.isfinite(self.length):
+            return False
+        self.walking[id(agent)] = [max(1, -(-(int(self.length) - 1) // self.cells_per_tick)), destination, agent]
+        return True
+
+    def place(self, agent, building):
+        pass
+
+    def advance(self):
+        for key, walk in list(self.walking.items()):
+            walk[0] -= 1
+            if walk[0] <= 0:
+                del self.walking[key]
+                walk[2].arrive(walk[1])
+
+def _realized_kwargs(action, value):
+    if action not in VALUE_KWARGS:
+        return {}
+    if action == "work":
+        return {"socialize": bool(value)}
+    return {VALUE_KWARGS[action]: float(value)} # Crowds and path lengths are whole numbers, exact in float32
+
+def replay(path, rows=None, start=0, stop=None):
+    """
+    Rebuild the trajectories of the agents in rows (default: every agent) over ticks
+    [start, stop) of a trace. Returns a dict of (ticks, agents) arrays of the state after
+    every tick: wealth, needs (with a last axis over need_keys), in_recovery and action codes.
+    """
+    meta, actions, values = load_trace(path)
+    stop = meta["num_ticks_run"] if stop is None else min(stop, meta["num_ticks_run"])
+    rows = np.arange(meta["num_agents"]) if rows is None else np.atleast_1d(rows)
+    assert 0 <= start < stop, f"Expected 0 <= start < stop <= {meta['num_ticks_run']}, got [{start}, {stop})"
+
+    first = max(t for t in get_snapshot_ticks(path) if t <= start)
+    agents = load_snapshot(path, first, rows, meta)
+    commutes = None
+    if meta.get("cells_per_tick") is not None:
+        transit = np.load(os.path.join(path, "snapshots", str(first), "transit.npy"))[:, rows]
+        commutes = ReplayCommutes(meta["cells_per_tick"], agents, transit)
+    need_keys = meta["need_keys"]
+    window = (stop - start, len(rows))
+    out = {"ticks": np.arange(start, stop),
+           "wealth": np.empty(window),
+           "needs": np.empty(window + (len(need_keys),)),
+           "in_recovery": np.empty(window, dtype=bool),
+           "action": np.asarray(actions[start:stop][:, rows]),
+           "need_keys": need_keys}
+
+    logging.disable(logging.INFO) # Replays are not logged again
+    try:
+        for t in range(first, stop):
+            if commutes is not None:
+                commutes.advance()
+            codes = actions[t, rows]
+            tick_values = values[t, rows]
+            for j, agent in enumerate(agents):
+                action = ACTIONS[codes[j]] if codes[j] != NO_ACTION else None
+                chosen = agent.decide(t, choose=lambda _: action)
+                if chosen is None and action is not None:
+                    raise RuntimeError(f"Trace diverged at tick {t}: agent {rows[j]} is in burnout recovery but took {action}")
+                if chosen is not None:
+                    if action is None:
+                        raise RuntimeError(f"Trace diverged at tick {t}: agent {rows[j]} has no recorded action")
+                    kwargs = _realized_kwargs(action, tick_values[j])
+                    if commutes is not None:
+                        commutes.length = kwargs.get("length")
+                    agent.act(action, kwargs=kwargs)
+                agent.decay_needs_sat()
+                if t >= start:
+                    out["wealth"][t - start, j] = agent.wealth
+                    out["needs"][t - start, j] = [agent.needs[k] for k in need_keys]
+                    out["in_recovery"][t - start, j] = agent.in_recovery
+    finally:
+        logging.disable(logging.NOTSET)
+    return out
+
+def verify(path):
+    # Replay every agent over the whole trace and compare with the final snapshot
+    meta, _, _ = load_trace(path)
+    ticks = meta["num_ticks_run"]
+    out = replay(path, start=0, stop=ticks)
+    final = AgentStateStore(meta["num_agents"], meta["need_keys"], os.path.join(path, "snapshots", str(ticks)), mode="r")
+    wealth_error = float(np.max(np.abs(out["wealth"][-1] - final.wealth)))
+    needs_error = float(np.max(np.abs(out["needs"][-1] - final.needs)))
+    return wealth_error, needs_error
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="Trace directory, e.g. results/fixed/trace", type=str)
+    parser.add_argument("--agents", help="Agent rows to replay. Default: every agent", type=int, nargs="+", default=None)
+    parser.add_argument("--start", help="First tick of the replayed window. Default: 0", type=int, default=0)
+    parser.add_argument("--stop", help="End (exclusive) of the replayed window. Default: end of the run", type=int, default=None)
+    parser.add_argument("--verify", help="Replay every agent over the whole run and compare the final wealth and needs with the recorded run.", action="store_true", default=False)
+    parser.add_argument("-o", "--output", help="Save the replayed trajectories as .npz to the given path.", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.verify:
+        wealth_error, needs_error = verify(args.path)
+        print(f"Max abs. difference of final wealth {wealth_error:.3g}, needs {needs_error:.3g}")
+        raise SystemExit(0 if wealth_error == 0 and needs_error == 0 else 1)
+
+    out = replay(args.path, rows=args.agents, start=args.start, stop=args.stop)
+    if args.output is not None:
+        np.savez_compressed(args.output, **out)
+        print(f"Replay saved to: {args.output}")
+    elif len(out["action"][0]) == 1:
+        print(f"{'tick':>6} {'action':>9} {'wealth':>9} " + " ".join(f"{k[:12]:>12}" for k in out["need_keys"]))
+        for i, t in enumerate(out["ticks"]):
+            code = out["action"][i, 0]
+            action = ACTIONS[code] if code != NO_ACTION else "-"
+            print(f"{t:>6} {action:>9} {out['wealth'][i, 0]:>9.3f} " + " ".join(f"{v:>12.4f}" for v in out["needs"][i, 0]))
+    else:
+        print(f"Replayed {out['wealth'].shape[1]} agents over ticks [{out['ticks'][0]}, {out['ticks'][-1] + 1}), "
+              f"final mean wealth {out['wealth'][-1].mean():.3f}")
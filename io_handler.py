@@ -1,33 +1,36 @@
 import numpy as np
 
+def _read_map_bytes(filepath):
+    # Read .map file as a (height, width) array of characters codes
+    # Header is assumed to be the first 4 lines: type, height, width, map
+    with open(filepath, 'rb') as f:
+        header = [f.readline().decode().strip() for _ in range(4)]
+        data = f.read()
+
+    height = int(header[1][len("height "):])
+    width = int(header[2][len("width "):])
+    chars = np.frombuffer(data, dtype=np.uint8)
+    chars = chars[(chars != ord('\n')) & (chars != ord('\r'))]
+    assert chars.size == height * width, f"Expected grid to have shape ({height},{width}), got {chars.size} cells"
+    return chars.reshape(height, width)
+
 def read_map_file(filepath, return_arr=True):
     # Read .map file
     # If return_arr, returns a numpy array
     # otherwise return a list
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-
-    # Skip header lines (WARNING: assumed to be first 4)
-    lines = [line.strip() for line in lines if line.strip()] 
-    grid_lines = lines[4:]
-    grid = [list(line) for line in grid_lines]
-
-    height = int(lines[1][len("height "):])
-    width = int(lines[1][len("width "):])
-    grid_arr = np.array(grid)
-    assert grid_arr.shape == (height, width), f"Expected grid to have shape ({height},{width}), got {grid_arr.shape}"
+    grid_arr = _read_map_bytes(filepath).view('S1').astype('U1')
 
     if return_arr: return grid_arr
-    return grid
+    return grid_arr.tolist()
 
 def get_binary_map(mapfile_path, free_sym=0, blocked_sym=1):
     # Read a .map file and replace free and blocked symbols 
     # with free_sym and blocked_sym
-    grid = read_map_file(filepath=mapfile_path, return_arr=True)
+    grid = _read_map_bytes(filepath=mapfile_path)
 
     binary_map = np.zeros_like(grid, dtype=int)
-    binary_map[grid == '.'] = free_sym
-    binary_map[grid == '@'] = blocked_sym
+    binary_map[grid == ord('.')] = free_sym
+    binary_map[grid == ord('@')] = blocked_sym
 
     return binary_map
 
@@ -0,0 +1,84 @@
+"""
+
+Location index of the agents, i.e. which building every agent is at, kept up
+to date as agents relocate. Membership is stored as a single integer array
+(building id per agent) and head counts per building are maintained
+incrementally, so moving an agent and querying how many agents are co-present
+at a building are both O(1). Grouped counts over the whole population are a
+single np.bincount.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import numpy as np
+
+NOWHERE = -1 # Building id of agents that are not registered at any building
+
+
+class LocationIndex:
+    def __init__(self, buildings, capacity=16, where=None):
+        # buildings: list of building names indexed by building id (see Scenario.building_names)
+        # capacity: number of agents to preallocate for, agents are registered with add()
+        # where: optional int32 array (e.g. a memmap) holding the building id of
+        #        every agent of a population registered in bulk, see rebuild_counts()
+        self.buildings = list(buildings)
+        self.counts = np.zeros(len(self.buildings), dtype=np.int64)
+        self.background = None # Head counts of agents tracked elsewhere, e.g. other shards
+        if where is None:
+            self.where = np.full(max(capacity, 1), NOWHERE, dtype=np.int32)
+            self.num_agents = 0
+        else:
+            self.where = where
+            self.num_agents = where.size
+            self.rebuild_counts()
+
+    def add(self, building, agent_id=None):
+        # Registers a new agent at building and returns its id
+        if agent_id is None:
+            agent_id = self.num_agents
+        if agent_id >= self.where.size:
+            grown = np.full(max(agent_id + 1, 2 * self.where.size), NOWHERE, dtype=np.int32)
+            grown[:self.where.size] = self.where
+            self.where = grown
+        self.num_agents = max(self.num_agents, agent_id + 1)
+        self.move(agent_id, building)
+        return agent_id
+
+    def move(self, agent_id, building):
+        old = self.where[agent_id]
+        if old != NOWHERE:
+            self.counts[old] -= 1
+        self.counts[building] += 1
+        self.where[agent_id] = building
+
+    def leave(self, agent_id):
+        # The agent is not at any building, e.g. while commuting
+        old = self.where[agent_id]
+        if old != NOWHERE:
+            self.counts[old] -= 1
+        self.where[agent_id] = NOWHERE
+
+    def count(self, building):
+        # Number of agents currently at building
+        if self.background is not None:
+            return int(self.counts[building] + self.background[building])
+        return int(self.counts[building])
+
+    def set_background(self, counts):
+        # Agents of other populations (e.g. other shards of a simulation)
+        # that are co-present at the buildings but not tracked here
+        self.background = np.asarray(counts, dtype=np.int64)
+
+    def members(self, building):
+        # Ids of the agents at building, O(N) so only meant for reporting
+        return np.flatnonzero(self.where[:self.num_agents] == building)
+
+    def rebuild_counts(self):
+        # Recompute head counts from the membership array, e.g. after
+        # the array has been filled in bulk
+        where = self.where[:self.num_agents]
+        self.counts[:] = np.bincount(where[where != NOWHERE], minlength=len(self.buildings))
+
+    def counts_by_name(self):
+        return {name: int(self.counts[i]) for i, name in enumerate(self.buildings)}
@@ -0,0 +1,203 @@
+"""
+
+Procedural maps for scaling tests. Writes maze, room and city-block maps of
+any size in the MAPF .map format of assets/maze-128-128-10.map, e.g.
+
+    python map_generator.py maze --size 4096 4096 -o assets/maze-4096-4096-10.map
+    python map_generator.py city --size 8192 8192 --density 0.7 -o assets/city-8192-8192.map
+
+Maps are generated and written band by band (one row of rooms, blocks or maze
+cells at a time) with vectorized numpy operations, so memory stays bounded by
+a band even for very large maps. Every band draws from its own random
+generator seeded by (seed, band), so the output does not depend on the band
+size. Alongside the map, a building layout for config.yaml (houses,
+workplaces with policies and a bus route) is written to <output>.yaml, with
+buildings sampled from the largest connected component of the map, so they
+can all reach each other. Sampling reads the written map back once.
+
+The meaning of --density depends on the kind of map:
+    maze: probability that an inner wall of the perfect maze is kept, lower values add loops
+    rooms: probability that a cell inside a room is cluttered with an obstacle
+    city: probability that a block is built (blocked), the others are open squares
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import argparse
+import numpy as np
+import yaml
+
+from city import City
+from scenario import POLICIES
+from io_handler import get_binary_map
+
+FREE_SYMBOL, BLOCKED_SYMBOL = ord('.'), ord('@')
+DEFAULT_DENSITY = {"maze": 1.0, "rooms": 0.0, "city": 0.8}
+
+
+################################################################################################################
+# Bands
+################################################################################################################
+# Every generator yields boolean bands (True = blocked) covering the rows of the map from top to bottom
+
+def maze_bands(height, width, corridor=10, density=1.0, seed=0):
+    # Binary tree maze with corridors of width corridor and 1 cell thick walls, like the shipped
+    # maze. Passages are the odd cells of a coarse grid, every passage opens either its north or
+    # its west wall, which only depends on its own draw
+    rows, cols = 2 * (-(-height // (corridor + 1))) + 1, 2 * (-(-width // (corridor + 1))) + 1
+    odd_cols = np.arange(1, cols, 2)
+    widths = np.where(np.arange(cols) % 2 == 1, corridor, 1) # Cells per coarse cell
+
+    def passage_row(i):
+        # Draws of the passages on odd coarse row i: opens north (True) or west (False), and kept walls
+        rng = np.random.default_rng([seed, i])
+        north = rng.random(len(odd_cols)) < 0.5
+        north[odd_cols == 1] = True # Passages on the borders can only open inwards
+        if i == 1: north[:] = False
+        keep = rng.random((2, cols)) < density # Inner walls knocked down at random to add loops
+        return north, keep
+
+    row = 0
+    for i in range(rows):
+        coarse = np.ones(cols, dtype=bool)
+        if i % 2 == 1:
+            north, keep = passage_row(i)
+            coarse[odd_cols] = False
+            west = odd_cols[~north & (odd_cols > 1)] - 1
+            coarse[west] = False
+            inner = np.arange(2, cols - 1, 2)
+            coarse[inner] &= keep[0, inner]
+        elif 0 < i < rows - 1:
+            north, keep = passage_row(i + 1)
+            coarse[odd_cols[north]] = False
+            inner = odd_cols[~north]
+            coarse[inner] &= keep[1, inner]
+        band_height = min(corridor if i % 2 == 1 else 1, height - row)
+        if band_height <= 0:
+            return
+        yield np.repeat(np.repeat(coarse, widths)[None, :width], band_height, axis=0)
+        row += band_height
+
+def room_bands(height, width, room=16, door=3, density=0.0, seed=0):
+    # Rooms of room x room cells separated by 1 cell thick walls, with a door of width door
+    # in every wall between neighbouring rooms
+    period = room + 1
+    door = min(door, room)
+    cols = -(-width // period)
+    x = np.arange(width)
+    for i in range(-(-height // period)):
+        rng = np.random.default_rng([seed, i])
+        band = np.zeros((period, width), dtype=bool)
+        band[:room] = rng.random((room, width)) < density
+
+        # Vertical walls between rooms of this row, doors at random rows
+        offsets = rng.integers(0, room - door + 1, size=cols)
+        wall_x = x[x % period == room]
+        band[:room, wall_x] = True
+        rows = np.arange(room)[:, None]
+        in_door = (rows >= offsets[wall_x // period]) & (rows < offsets[wall_x // period] + door)
+        band[:room, wall_x] &= ~in_door
+
+        # Horizontal wall below this row, doors at random columns
+        offsets = rng.integers(0, room - door + 1, size=cols)
+        local = x % period
+        band[room] = ~((local >= offsets[x // period]) & (local < offsets[x // period] + door))
+        yield band[:height - i * period]
+
+def city_bands(height, width, block=12, street=3, density=0.8, seed=0):
+    # Blocks of block x block cells separated by streets, every block is built with probability density
+    period = block + street
+    cols = -(-width // period)
+    x = np.arange(width)
+    in_block_x = (x % period) < block
+    for i in range(-(-height // period)):
+        rng = np.random.default_rng([seed, i])
+        built = rng.random(cols) < density
+        band = np.zeros((period, width), dtype=bool)
+        band[:block] = (in_block_x & built[x // period])[None, :]
+        yield band[:height - i * period]
+
+GENERATORS = {"maze": maze_bands, "rooms": room_bands, "city": city_bands}
+
+
+################################################################################################################
+# Output
+################################################################################################################
+
+def write_map(path, bands, height, width):
+    # Stream bands to a MAPF .map file, returns the number of free cells
+    num_free = 0
+    row = 0
+    with open(path, "wb") as f:
+        f.write(f"type octile\nheight {height}\nwidth {width}\nmap\n".encode())
+        for band in bands:
+            chars = np.where(band, BLOCKED_SYMBOL, FREE_SYMBOL).astype(np.uint8)
+            lines = np.concatenate([chars, np.full((len(band), 1), ord('\n'), dtype=np.uint8)], axis=1)
+            f.write(lines.tobytes())
+            num_free += int(np.count_nonzero(~band))
+            row += len(band)
+    assert row == height, f"Generated {row} rows, expected {height}"
+    return num_free
+
+def sample_buildings(path, num_buildings, seed=0):
+    """
+    Samples num_buildings cells of the largest connected component of a written map, so
+    every building can reach every other one. None if the component has fewer free cells.
+    """
+    city = City(map_array=get_binary_map(mapfile_path=path).astype(np.int8), copy_array=False)
+    if city.component_sizes.size == 0 or city.component_sizes[0] < num_buildings:
+        return None
+    return city.sample_free_cells(num_buildings, rng=np.random.default_rng([seed, 2**31]))
+
+def make_layout(cells, num_homes, num_workplaces):
+    # Buildings of config.yaml on the sampled cells, workplaces get the policies in turn
+    homes = {f"home_{i}": list(cells[i]) for i in range(num_homes)}
+    workplaces = {f"workplace_{i}": list(cells[num_homes + i]) for i in range(num_workplaces)}
+    return {"houses": homes,
+            "workplace_locations": workplaces,
+            "policy": {name: POLICIES[i % len(POLICIES)] for i, name in enumerate(workplaces)},
+            "transit": {"routes": {"bus_0": list(homes) + list(workplaces)}}}
+
+def generate(kind, height, width, output, density=None, seed=0, num_homes=4, num_workplaces=3, **params):
+    """Write a map of the given kind to output and its building layout to <output>.yaml."""
+    density = DEFAULT_DENSITY[kind] if density is None else density
+    bands = GENERATORS[kind](height, width, density=density, seed=seed, **params)
+    num_free = write_map(output, bands, height, width)
+    print(f"Map saved to: {output} ({height}x{width}, {num_free / (height * width):.1%} free)")
+    cells = sample_buildings(output, num_homes + num_workplaces, seed=seed)
+    if cells is None:
+        print(f"WARNING: No connected area of the map has {num_homes + num_workplaces} free cells, no building layout written")
+        return None
+
+    layout_path = os.path.splitext(output)[0] + ".yaml"
+    with open(layout_path, "w") as f:
+        yaml.safe_dump(make_layout(cells, num_homes, num_workplaces), f, default_flow_style=None, sort_keys=False)
+    print(f"Building layout saved to: {layout_path}")
+    return layout_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", help="Kind of map.", choices=list(GENERATORS))
+    parser.add_argument("--size", help="Height and width of the map. Default: 1024 1024", type=int, nargs=2, default=[1024, 1024])
+    parser.add_argument("--density", help="Obstacle density, see the module docstring for its meaning per kind. Default: maze 1.0, rooms 0.0, city 0.8", type=float, default=None)
+    parser.add_argument("--seed", help="Random seed. Default: 0", type=int, default=0)
+    parser.add_argument("--corridor", help="Corridor width of maze maps. Default: 10", type=int, default=10)
+    parser.add_argument("--room", help="Room size of room maps. Default: 16", type=int, default=16)
+    parser.add_argument("--door", help="Door width of room maps. Default: 3", type=int, default=3)
+    parser.add_argument("--block", help="Block size of city maps. Default: 12", type=int, default=12)
+    parser.add_argument("--street", help="Street width of city maps. Default: 3", type=int, default=3)
+    parser.add_argument("--homes", help="Number of houses in the building layout. Default: 4", type=int, default=4)
+    parser.add_argument("--workplaces", help="Number of workplaces in the building layout. Default: 3", type=int, default=3)
+    parser.add_argument("-o", "--output", help="Path of the .map file. Default: assets/<kind>-<height>-<width>.map", type=str, default=None)
+    args = parser.parse_args()
+
+    height, width = args.size
+    output = args.output or os.path.join("assets", f"{args.kind}-{height}-{width}.map")
+    params = {"maze": {"corridor": args.corridor},
+              "rooms": {"room": args.room, "door": args.door},
+              "city": {"block": args.block, "street": args.street}}[args.kind]
+    generate(args.kind, height, width, output, density=args.density, seed=args.seed,
+             num_homes=args.homes, num_workplaces=args.workplaces, **params)
@@ -0,0 +1,170 @@
+"""
+
+Registry of loaded city maps, so that sweeps over many MAPF maps (or a
+long-lived worker serving many scenarios) do not read and preprocess the same
+map again for every run. Maps are loaded on first use by name (a .map file in
+the maps directory), path or content hash, and stay resident together with
+their derived data (connected components, building distance tables, coarse
+grids of the walk estimator) until the registry exceeds its memory cap
+(config.yaml, maps.max_size_mb); least recently used maps are evicted first. Landmark distance fields of the ALT
+heuristic are also cached on disk by map hash (maps.landmarks_dir), since
+selecting them takes a breadth-first search over the map per landmark.
+
+The City objects handed out are shared between runs, so their arrays (grid,
+labels, distance table) are read-only, and runs keep their own pathfinding
+settings and reservations on a view of the city (City.for_run). Grids are stored as int8, and distance
+tables are only ever extended with the buildings of new scenarios (see
+City.extend_distances), so lookups of earlier scenarios stay valid.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import sys
+import numpy as np
+from collections import OrderedDict
+
+from city import City
+from coarse_grid import CoarseGrid
+from result_cache import get_map_hash
+
+DEFAULT_MAP = "maze-128-128-10.map"
+DEFAULT_LANDMARKS_DIR = os.path.join("results", "cache", "landmarks")
+
+
+def get_moves_bytes(moves):
+    # Memory of the neighbor lists cached by cooperative paths (see City._plan_window), Python objects
+    return sys.getsizeof(moves) + sum(sys.getsizeof(cells) + sum(sys.getsizeof(cell) for cell in cells) for cells in moves.values())
+
+def get_city_bytes(city):
+    # Memory of the grid and the derived data of a city
+    arrays = (city.grid, city.distance_table, city._labels, city._component_sizes, city._landmark_fields, *city._target_fields.values())
+    return (sum(arr.nbytes for arr in arrays if arr is not None) + (city.coarse.nbytes if city.coarse is not None else 0)
+            + get_moves_bytes(city._moves))
+
+def _freeze(city):
+    for arr in (city.grid, city.distance_table, city._labels, city._component_sizes, city._landmark_fields):
+        if arr is not None:
+            arr.setflags(write=False)
+
+
+class MapRegistry:
+    def __init__(self, maps_dir="assets", max_size_mb=1024, default=DEFAULT_MAP, landmarks_dir=DEFAULT_LANDMARKS_DIR):
+        self.maps_dir = maps_dir
+        self.landmarks_dir = landmarks_dir
+        self.max_bytes = int(max_size_mb * 2**20)
+        self.default = default
+        self._maps = OrderedDict() # Absolute path -> City, least recently used first
+        self._hashes = {}          # Content hash -> absolute path
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        maps_config = config.get("maps") or {}
+        return cls(maps_dir=maps_config.get("dir", "assets"),
+                   max_size_mb=maps_config.get("max_size_mb", 1024),
+                   default=maps_config.get("default", DEFAULT_MAP),
+                   landmarks_dir=maps_config.get("landmarks_dir", DEFAULT_LANDMARKS_DIR))
+
+    def resolve(self, name=None):
+        # Absolute path of a map given by name, path or (a unique prefix of) its content hash
+        name = self.default if name is None else name
+        matches = [path for h, path in self._hashes.items() if h.startswith(name)] if len(name) >= 8 else []
+        if len(matches) == 1:
+            return matches[0]
+        dirs = (self.maps_dir, os.path.join(os.path.dirname(os.path.abspath(__file__)), self.maps_dir))
+        for path in [name] + [os.path.join(d, n) for d in dirs for n in (name, name + ".map")]:
+            if os.path.isfile(path):
+                return os.path.abspath(path)
+        raise FileNotFoundError(f"No map {name} found, expected a path, a map in {self.maps_dir} or the hash of a loaded map")
+
+    def get(self, name=None, coords=None):
+        """
+        Shared, read-only City of a map (default: maps.default of config.yaml). If coords
+        are given, the distance table of the city covers them.
+        """
+        path = self.resolve(name)
+        city = self._maps.get(path)
+        if city is not None:
+            self._maps.move_to_end(path)
+            self.hits += 1
+        else:
+            from io_handler import get_binary_map
+            city = City(map_array=get_binary_map(mapfile_path=path).astype(np.int8), copy_array=False)
+            self._maps[path] = city
+            self._hashes[get_map_hash(city)] = path
+            self.misses += 1
+        if coords is not None:
+            self.precompute(city, coords)
+        else:
+            _freeze(city)
+            self.evict()
+        return city
+
+    def precompute(self, city, coords):
+        # Extend the distance table of a registered city with the given cells
+        city.extend_distances(coords)
+        _freeze(city)
+        self.evict()
+        return city.distance_table
+
+    def precompute_landmarks(self, city, num_landmarks=8):
+        """
+        Landmarks of the ALT heuristic of a city (see City.precompute_landmarks), loaded from
+        <landmarks_dir>/<map hash>-<num_landmarks>.npz if another run already selected them.
+        """
+        if city._landmark_fields is not None and len(city.landmarks) == num_landmarks:
+            return city._landmark_fields
+        path = os.path.join(self.landmarks_dir, f"{get_map_hash(city)}-{num_landmarks}.npz")
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                city.set_landmarks(data["landmarks"], data["fields"])
+        else:
+            city.precompute_landmarks(num_landmarks)
+            os.makedirs(self.landmarks_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp" # Concurrent runs on the same map write the same file
+            with open(tmp_path, "wb") as f:
+                np.savez(f, landmarks=np.array(city.landmarks, dtype=np.int32), fields=city._landmark_fields)
+            os.replace(tmp_path, path)
+        _freeze(city)
+        self.evict()
+        return city._landmark_fields
+
+    def precompute_coarse(self, city, factor=8, coords=()):
+        # Coarse grid of the walk estimator of a city (see coarse_grid.py), with the coarse distances to the given cells
+        if city.coarse is None or city.coarse.factor != factor:
+            city.coarse = CoarseGrid(city.grid, factor)
+        city.coarse.precompute(coords)
+        self.evict()
+        return city.coarse
+
+    def hash_of(self, name=None):
+        path = self.resolve(name)
+        return next((h for h, p in self._hashes.items() if p == path), None)
+
+    @property
+    def nbytes(self):
+        return sum(get_city_bytes(city) for city in self._maps.values())
+
+    def evict(self):
+        # Remove least recently used maps until the registry fits in max_bytes, the most
+        # recently used map is always kept. Runs holding an evicted City can keep using it
+        evicted = []
+        total = self.nbytes
+        while total > self.max_bytes and len(self._maps) > 1:
+            path, city = self._maps.popitem(last=False)
+            self._hashes = {h: p for h, p in self._hashes.items() if p != path}
+            total -= get_city_bytes(city)
+            evicted.append(path)
+        return evicted
+
+    def __contains__(self, name):
+        try:
+            return self.resolve(name) in self._maps
+        except FileNotFoundError:
+            return False
+
+    def __len__(self):
+        return len(self._maps)
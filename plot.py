@@ -4,29 +4,36 @@ import numpy as np
 import os
 import scipy.stats as st
 
+from stats import gini_coefficient, bootstrap_gini, grouped_stats
+from results_store import load_results, combine_results
+
 
 ################################################################################################################
 # Wealth distribution with gini plots
 ################################################################################################################
 
-def gini_coefficient(values):
-    """Compute Gini index of a list of values (e.g., wealth)."""
-    array = np.array(values)
-    if np.amin(array) < 0:
-        array -= np.amin(array)  # Make non-negative
-    array += 1e-8  # Avoid divide by zero
-    array = np.sort(array)
-    n = len(array)
-    index = np.arange(1, n + 1)
-    return (np.sum((2 * index - n - 1) * array)) / (n * np.sum(array))
+def get_policy_colors(policy):
+    if policy == "fixed":
+        return "gray"
+    elif policy == "free":
+        return "cyan"
+    elif policy == "flex":
+        return "pink"
+    else:
+        print(f"WARNING: Undefined color for policy: {policy}")
+        return "pink"
 
 def plot_wealth_distribution(agents, title="No norms", color="gray", save=False, results_dir="results"):
     """Plot wealth histogram with Gini annotation like in the aporophobia paper."""
-    wealths = np.array([agent.final_wealth() for agent in agents])
+    plot_wealth_histogram(np.array([agent.final_wealth() for agent in agents]), title=title, color=color, save=save, results_dir=results_dir)
+
+def plot_wealth_histogram(wealths, title="No norms", color="gray", save=False, results_dir="results"):
+    """Same as plot_wealth_distribution() for an array of final wealths."""
+    wealths = np.asarray(wealths, dtype=float)
 
     # Compute Gini and 95% CI using bootstrapping
     gini = gini_coefficient(wealths)
-    bootstraps = [gini_coefficient(np.random.choice(wealths, size=len(wealths), replace=True)) for _ in range(1000)]
+    bootstraps = bootstrap_gini(wealths, num_resamples=1000)
     gini_std = np.std(bootstraps)
     ci = 1.96 * gini_std
 
@@ -70,22 +77,18 @@ def save_plot(title, results_dir):
     
 
 def plot_relations(agents, x_fn, y_fn, xlabel="", ylabel="", title="", save_fig=True, results_dir="results"):
-    # Gather data for plotting
-    tolerance_groups = {}
-    for agent in agents:
-        tol = x_fn(agent)
-        if tol not in tolerance_groups:
-            tolerance_groups[tol] = []
-        tolerance_groups[tol].append(y_fn(agent))
+    plot_grouped([x_fn(agent) for agent in agents], [y_fn(agent) for agent in agents],
+                 xlabel=xlabel, ylabel=ylabel, title=title, save_fig=save_fig, results_dir=results_dir)
 
+def plot_grouped(x, y, xlabel="", ylabel="", title="", save_fig=True, results_dir="results"):
+    # Same as plot_relations() for arrays of per-agent values
     # TODO: Confidence interval should be computed for trials of same experimental settings 
     # I think for social tolerance levels we should just show max/mean/min values
     # Compute mean and 95% confidence intervals
-    labels = sorted(tolerance_groups.keys())
-    means = [np.mean(tolerance_groups[t]) for t in labels]
-    stds = [np.std(tolerance_groups[t]) for t in labels]
-    cis = [1.96 * std / np.sqrt(len(tolerance_groups[t])) for t, std in zip(labels, stds)]
+    labels, _, means, _, cis = grouped_stats(x, y)
+    plot_group_stats(labels, means[0], cis[0], xlabel=xlabel, ylabel=ylabel, title=title, save_fig=save_fig, results_dir=results_dir)
 
+def plot_group_stats(labels, means, cis, xlabel="", ylabel="", title="", save_fig=True, results_dir="results"):
     # Plot
     plt.figure(figsize=(8, 5))
     plt.errorbar(labels, means, yerr=cis, fmt='o', capsize=5, label="95% CI")
@@ -101,3 +104,41 @@ def plot_relations(agents, x_fn, y_fn, xlabel="", ylabel="", title="", save_fig=
         plt.close()
     else:
         plt.show()
+
+
+################################################################################################################
+# Figures of a policy run
+################################################################################################################
+
+def get_metrics(results):
+    # results: dict of per-agent arrays (see stats.collect_metrics()), a stored metrics file
+    # or results directory, or a list of those to combine. Returns metrics and policy name
+    if isinstance(results, dict):
+        return results, None
+    if isinstance(results, (str, os.PathLike)):
+        metrics, metadata = load_results(results)
+        return metrics, metadata.get("policy")
+    metrics, metadatas = combine_results(results)
+    policies = {m.get("policy") for m in metadatas}
+    return metrics, policies.pop() if len(policies) == 1 else None
+
+def plot_stored(results, x="tolerance", y="wealth", xlabel=None, ylabel=None, title="", save_fig=True, results_dir="results"):
+    # Grouped plot of two metric columns of stored results, see get_metrics()
+    metrics, _ = get_metrics(results)
+    plot_grouped(metrics[x], metrics[y], xlabel=xlabel or x, ylabel=ylabel or y, title=title, save_fig=save_fig, results_dir=results_dir)
+
+def plot_policy_results(results, policy=None, results_dir=None):
+    # results: see get_metrics(), figures are saved next to a stored results file by default
+    metrics, stored_policy = get_metrics(results)
+    policy = policy or stored_policy or "combined"
+    if results_dir is None:
+        assert isinstance(results, (str, os.PathLike)), "results_dir is required unless results is a stored file"
+        results_dir = results if os.path.isdir(results) else os.path.dirname(results)
+    plot_wealth_histogram(metrics["wealth"], title=f"Policy: {policy}", color=get_policy_colors(policy), save=True, results_dir=results_dir)
+
+    # Every metric grouped by tolerance in a single pass
+    labels, _, means, _, cis = grouped_stats(metrics["tolerance"], metrics["wealth"], metrics["social_burnout"], metrics["energy_burnout"])
+    plot_group_stats(labels, means[0], cis[0], xlabel="tolerance", ylabel="wealth", title="Social Tolerance vs. Wealth", results_dir=results_dir)
+    plot_group_stats(labels, means[1], cis[1], xlabel="tolerance", ylabel="social-burnout", title="Social Tolerance vs. Social Burnout Rate", results_dir=results_dir)
+    plot_group_stats(labels, means[2], cis[2], xlabel="tolerance", ylabel="energy-burnout", title="Social Tolerance vs. Energy Burnout Rate", results_dir=results_dir)
+    plot_grouped(metrics["social_burnout"], metrics["wealth"], xlabel="social-burnout", ylabel="wealth", title="Social Burnout Rate vs. Wealth", results_dir=results_dir)
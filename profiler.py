@@ -0,0 +1,174 @@
+"""
+
+Opt-in profiling of simulation runs with a per-phase timing breakdown.
+
+Profiling is done by wrapping the methods of the simulation phases (action
+scoring, pathfinding, applying actions, needs decay, logging) with timers
+when the profiler is enabled, and restoring the original methods when it is
+disabled. So there is no overhead at all in regular runs. Nested phases are
+reported both with their total (inclusive) time and their self time, i.e.
+excluding the time of nested phases.
+
+Besides wall times and call counts, the profiler reports A* node expansions
+and the hit rate of the precomputed building distance table.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import json
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from collections import defaultdict
+
+from city import City
+from agent import Agent
+from transit import Transit
+
+# (owner, attribute, phase) of the methods timed by the profiler
+PHASES = [
+    (Agent, "choose_action", "action_scoring"),
+    (Agent, "get_action_kwargs", "action_kwargs"),
+    (City, "get_shortest_path_length", "path_length"),
+    (City, "shortest_path", "astar"),
+    (City, "cooperative_path", "cooperative_astar"),
+    (Agent, "apply_action", "apply_action"),
+    (Agent, "decay_needs_sat", "decay_needs_sat"),
+    (Agent, "_recover_burnout_step", "burnout_recovery"),
+    (Transit, "observe_counts", "transit_counts"),
+    (logging.Logger, "_log", "logging"),
+]
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+        self._originals = []
+
+    def reset(self):
+        self.total_time = defaultdict(float)
+        self.self_time = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self._stack = [] # Time spent in nested phases of the phases being timed
+
+    def _enter(self):
+        self._stack.append(0.0)
+        return time.perf_counter()
+
+    def _exit(self, phase, start):
+        elapsed = time.perf_counter() - start
+        nested = self._stack.pop()
+        self.total_time[phase] += elapsed
+        self.self_time[phase] += elapsed - nested
+        self.calls[phase] += 1
+        if self._stack:
+            self._stack[-1] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        # Times a block of code, e.g. with PROFILER.phase("plotting"): ...
+        if not self.enabled:
+            yield
+            return
+        start = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, start)
+
+    def _wrap(self, phase, fn):
+        profiler = self
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = profiler._enter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler._exit(phase, start)
+        return timed
+
+    def _wrap_astar(self, fn, phase="astar"):
+        # Also counts node expansions and distance table misses
+        profiler = self
+        timed = self._wrap(phase, fn)
+        @functools.wraps(fn)
+        def counted(city, *args, **kwargs):
+            try:
+                return timed(city, *args, **kwargs)
+            finally:
+                profiler.counters[f"{phase}_expansions"] += city.last_expansions
+        return counted
+
+    def _wrap_lookup(self, fn, phase="path_length"):
+        # Also counts distance table misses, i.e. lookups that fell back to A*. Other A* queries
+        # (e.g. full paths of multi-tick commutes) are not lookups
+        profiler = self
+        timed = self._wrap(phase, fn)
+        @functools.wraps(fn)
+        def counted(city, *args, **kwargs):
+            try:
+                return timed(city, *args, **kwargs)
+            finally:
+                profiler.counters["distance_table_misses"] += not city.last_lookup_hit
+        return counted
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, attr, phase in PHASES:
+            fn = getattr(owner, attr)
+            self._originals.append((owner, attr, fn))
+            if phase in ("astar", "cooperative_astar"):
+                fn = self._wrap_astar(fn, phase)
+            elif phase == "path_length":
+                fn = self._wrap_lookup(fn, phase)
+            else:
+                fn = self._wrap(phase, fn)
+            setattr(owner, attr, fn)
+        self.enabled = True
+
+    def disable(self):
+        for owner, attr, fn in reversed(self._originals):
+            setattr(owner, attr, fn)
+        self._originals = []
+        self.enabled = False
+
+    def report(self, wall_time=None):
+        phases = {}
+        for name in self.total_time:
+            phases[name] = {"total_s": self.total_time[name],
+                            "self_s": self.self_time[name],
+                            "calls": self.calls[name],
+                            "mean_us": 1e6 * self.total_time[name] / self.calls[name]}
+            if wall_time:
+                phases[name]["self_share"] = self.self_time[name] / wall_time
+
+        lookups = self.calls.get("path_length", 0)
+        counters = dict(self.counters)
+        misses = counters.get("distance_table_misses", 0)
+        counters["astar_queries"] = self.calls.get("astar", 0)
+        if counters["astar_queries"] > 0:
+            counters["astar_expansions_per_query"] = self.counters["astar_expansions"] / counters["astar_queries"]
+        counters["distance_table_lookups"] = lookups
+        counters["distance_table_hit_rate"] = (lookups - misses) / lookups if lookups > 0 else None
+        return {"wall_time_s": wall_time, "phases": phases, "counters": counters}
+
+    def save(self, path, wall_time=None):
+        with open(path, "w") as f:
+            json.dump(self.report(wall_time), f, indent=2)
+        print(f"Profile saved to: {path}")
+
+    def print_report(self, wall_time=None):
+        report = self.report(wall_time)
+        print(f"{'phase':<20} {'self (s)':>10} {'total (s)':>10} {'calls':>10} {'mean (us)':>10}")
+        for name, p in sorted(report["phases"].items(), key=lambda item: -item[1]["self_s"]):
+            print(f"{name:<20} {p['self_s']:>10.3f} {p['total_s']:>10.3f} {p['calls']:>10} {p['mean_us']:>10.1f}")
+        for name, value in report["counters"].items():
+            print(f"{name}: {value}")
+
+
+PROFILER = Profiler() # Shared by the simulation modules
@@ -0,0 +1,56 @@
+"""
+
+Renders the figures of simulation runs from their saved numeric results, so
+that simulations can run headless (see --headless in commute_simulation.py)
+without importing matplotlib or paying for plotting. Every results directory
+with a stored metrics.npz file (see results_store.py) is rendered in its own
+process with the Agg backend, or all of them are combined into one set of
+figures with --combine, e.g.
+
+    python commute_simulation.py --headless
+    python render.py results
+    python render.py results/sweep --combine results/sweep-combined
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from results_store import find_results, METRICS_FILE
+
+
+def render_results(results, results_dir=None):
+    # results: a results directory, or a list of them to combine into results_dir
+    # Imports are deferred so that only rendering processes load matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    from plot import plot_policy_results
+
+    plot_policy_results(results, results_dir=results_dir)
+    return results_dir or results
+
+def render_all(results_dirs, jobs=None):
+    if jobs == 1 or len(results_dirs) <= 1:
+        return [render_results(d) for d in results_dirs]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render_results, results_dirs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", help="Results directories to search for saved metrics. Default: results", nargs="*", default=["results"])
+    parser.add_argument("--combine", help="Render the metrics of all found runs combined into this directory instead of one set of figures per run.", type=str, default=None)
+    parser.add_argument("-j", "--jobs", help="Number of rendering processes. Default: number of CPUs", type=int, default=None)
+    args = parser.parse_args()
+
+    results_dirs = find_results(args.paths)
+    if not results_dirs:
+        print(f"No {METRICS_FILE} found under: {', '.join(args.paths)}")
+    elif args.combine is not None:
+        os.makedirs(args.combine, exist_ok=True)
+        render_results(results_dirs, results_dir=args.combine)
+    else:
+        render_all(results_dirs, jobs=args.jobs)
@@ -0,0 +1,181 @@
+"""
+
+Adaptive replicate allocation. Instead of a fixed number of trials per
+scenario, seeded trials are launched until the cross-trial confidence interval
+of the chosen metrics (e.g. the Gini index of the final wealth) is narrow
+enough, or a budget is exhausted. Trials always go to the scenario whose
+metrics are furthest from their target half-width, so noisy scenarios get more
+trials and stable ones stop early, e.g.
+
+    python replicates.py --policies fixed free flex --target gini=0.01 mean_wealth=5 --max-trials 30
+
+Every trial is a headless, cached run of commute_simulation.py with its own
+seed, so interrupted or repeated allocations reuse finished trials. Arguments
+after -- are passed to commute_simulation.py.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from stats import gini_coefficient, ci_half_width
+from results_store import load_results
+
+# Per-trial metrics computed from the stored per-agent metrics of a run
+METRICS = {
+    "gini": lambda m: float(gini_coefficient(m["wealth"])),
+    "mean_wealth": lambda m: float(np.mean(m["wealth"])),
+    "social_burnout": lambda m: float(np.mean(m["social_burnout"])),
+    "energy_burnout": lambda m: float(np.mean(m["energy_burnout"])),
+}
+
+
+class PolicyTrials:
+    """Trials of one policy and their metrics."""
+    def __init__(self, policy, targets, min_trials=3, max_trials=30, confidence=0.95):
+        self.policy = policy
+        self.targets = targets # Metric name -> target CI half-width
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.confidence = confidence
+        self.seeds = []
+        self.values = {name: [] for name in targets}
+        self.in_flight = 0
+
+    @property
+    def num_trials(self):
+        return len(self.seeds)
+
+    def add(self, seed, metrics):
+        self.seeds.append(seed)
+        for name in self.targets:
+            self.values[name].append(METRICS[name](metrics))
+
+    def half_widths(self):
+        return {name: ci_half_width(values, self.confidence) for name, values in self.values.items()}
+
+    def need(self):
+        # Largest ratio of CI half-width to target, the scenario is done below 1
+        if self.num_trials < self.min_trials:
+            return float('inf')
+        return max(hw / self.targets[name] for name, hw in self.half_widths().items())
+
+    def done(self):
+        return self.num_trials >= self.max_trials or (self.num_trials >= self.min_trials and self.need() < 1)
+
+    def to_dict(self):
+        return {"policy": self.policy,
+                "trials": self.num_trials,
+                "seeds": self.seeds,
+                "converged": self.num_trials >= self.min_trials and self.need() < 1,
+                "metrics": {name: {"values": values,
+                                   "mean": float(np.mean(values)) if values else None,
+                                   "ci_half_width": self.half_widths()[name],
+                                   "target": self.targets[name]} for name, values in self.values.items()}}
+
+
+def run_trial(policy, seed, results_dir, extra_args=()):
+    # One headless, cached simulation run, returns its per-agent metrics
+    trial_dir = os.path.join(results_dir, policy, f"seed_{seed}")
+    cmd = [sys.executable, "commute_simulation.py", "-p", policy, "--seed", str(seed),
+           "--headless", "--cache", "--results-dir", trial_dir, *extra_args]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    metrics, _ = load_results(os.path.join(trial_dir, policy))
+    return metrics
+
+def pick_scenario(scenarios, budget_left):
+    # PolicyTrials of the scenario that needs a trial most, None if all are done or the budget is exhausted
+    if budget_left <= 0:
+        return None
+    candidates = [s for s in scenarios if not s.done() and s.num_trials + s.in_flight < s.max_trials]
+    if not candidates:
+        return None
+    # Trials in flight are expected to reduce the need, so spread concurrent trials over scenarios
+    return max(candidates, key=lambda s: (s.need() if s.num_trials + s.in_flight >= s.min_trials else float('inf'),
+                                          -(s.num_trials + s.in_flight)))
+
+def allocate(scenarios, budget, results_dir, jobs=1, first_seed=0, extra_args=()):
+    """Launch trials until every scenario is done or budget trials have been run."""
+    next_seed = {s.policy: first_seed for s in scenarios}
+    launched = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while True:
+            while len(running) < jobs:
+                scenario = pick_scenario(scenarios, budget - launched)
+                if scenario is None:
+                    break
+                seed = next_seed[scenario.policy]
+                next_seed[scenario.policy] += 1
+                scenario.in_flight += 1
+                launched += 1
+                running[pool.submit(run_trial, scenario.policy, seed, results_dir, extra_args)] = (scenario, seed)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                scenario, seed = running.pop(future)
+                scenario.in_flight -= 1
+                scenario.add(seed, future.result())
+                widths = ", ".join(f"{name} ±{hw:.4f} (target {scenario.targets[name]})" for name, hw in scenario.half_widths().items())
+                print(f"[{scenario.policy}] trial {scenario.num_trials} (seed {seed}): {widths}")
+    return launched
+
+
+def parse_targets(items):
+    targets = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if name not in METRICS or not value:
+            raise ValueError(f"Expected targets as <metric>=<half-width> with metrics in {list(METRICS)}, got {item}")
+        targets[name] = float(value)
+    return targets
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--policies", help="Scenarios to replicate. Default: fixed free flex", nargs="+", default=["fixed", "free", "flex"])
+    parser.add_argument("--target", help=f"Target CI half-widths as <metric>=<value>, metrics: {', '.join(METRICS)}. Default: gini=0.01", nargs="+", default=["gini=0.01"])
+    parser.add_argument("--confidence", help="Confidence level of the intervals. Default: 0.95", type=float, default=0.95)
+    parser.add_argument("--min-trials", help="Trials per scenario before its CI is considered. Default: 3", type=int, default=3)
+    parser.add_argument("--max-trials", help="Maximum trials per scenario. Default: 30", type=int, default=30)
+    parser.add_argument("--budget", help="Maximum trials over all scenarios. Default: no limit besides --max-trials", type=int, default=None)
+    parser.add_argument("--seed", help="Seed of the first trial of every scenario, next trials use the next seeds. Default: 0", type=int, default=0)
+    parser.add_argument("-j", "--jobs", help="Number of trials run in parallel. Default: 1", type=int, default=1)
+    parser.add_argument("-o", "--output", help="Directory of the trial results and summary.json. Default: results/replicates", type=str, default=os.path.join("results", "replicates"))
+    args = parser.parse_args(argv)
+
+    try:
+        targets = parse_targets(args.target)
+    except ValueError as e:
+        parser.error(str(e))
+    scenarios = [PolicyTrials(policy, targets, args.min_trials, args.max_trials, args.confidence) for policy in args.policies]
+    budget = args.budget if args.budget is not None else args.max_trials * len(scenarios)
+
+    launched = allocate(scenarios, budget, args.output, jobs=args.jobs, first_seed=args.seed, extra_args=extra_args)
+    print(f"Ran {launched} trials")
+    for s in scenarios:
+        status = "target reached" if s.to_dict()["converged"] else "budget exhausted"
+        print(f"  {s.policy}: {s.num_trials} trials, {status}, " +
+              ", ".join(f"{name} {np.mean(v):.4f} ± {s.half_widths()[name]:.4f}" for name, v in s.values.items()))
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, "summary.json")
+    with open(path, "w") as f:
+        json.dump({"targets": targets, "confidence": args.confidence, "budget": budget,
+                   "scenarios": [s.to_dict() for s in scenarios]}, f, indent=2)
+    print(f"Replicates saved to: {path}")
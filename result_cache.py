@@ -0,0 +1,196 @@
+"""
+
+Content-addressed cache of simulation results. A result is keyed by the hash
+of everything that determines it: the resolved config, the seed, the policy and
+run options, the content of the city map, and the source code of the model.
+Runs with a key already in the cache copy the cached files (summary.json,
+metrics.npz, ...) instead of simulating again.
+
+Entries are directories under the cache root (config.yaml, cache.dir). The
+cache is bounded by cache.max_size_mb, least recently used entries are evicted
+first. Entries can also be dropped explicitly:
+
+    python result_cache.py list
+    python result_cache.py invalidate <key> [<key> ...]
+    python result_cache.py invalidate --all
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+# Modules of the repository root that cannot change simulation results, every other
+# module is part of the model hash, so new modules are covered without being listed
+TOOL_MODULES = ("render.py", "plot.py", "benchmark.py", "map_generator.py", "telemetry.py")
+ENTRY_FILE = "entry.json" # Key parts and metadata of a cache entry
+
+_model_hash = None
+
+
+def get_model_modules(root):
+    # Python modules of the repository root whose code determines simulation results
+    return sorted(name for name in os.listdir(root) if name.endswith(".py") and name not in TOOL_MODULES)
+
+def get_model_hash():
+    # Hash of the source code of the model modules, computed once per process
+    global _model_hash
+    if _model_hash is None:
+        h = hashlib.sha256()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in get_model_modules(root):
+            with open(os.path.join(root, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+        _model_hash = h.hexdigest()
+    return _model_hash
+
+def get_map_hash(city):
+    # Hash of the content of the city grid, None for runs without a city (randomized walk)
+    if city is None:
+        return None
+    h = hashlib.sha256(str(city.grid.shape).encode())
+    h.update((city.grid != 0).tobytes())
+    return h.hexdigest()
+
+def make_key(config, seed, map_hash, **options):
+    """
+    Key of a simulation result. config is the resolved config dict (its cache section is
+    ignored), options are the run options that change results (e.g. policy, num_agents).
+    """
+    parts = {"config": {k: v for k, v in config.items() if k != "cache"},
+             "seed": seed,
+             "map": map_hash,
+             "model": get_model_hash(),
+             "options": options}
+    blob = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest(), parts
+
+
+class ResultCache:
+    def __init__(self, root=os.path.join("results", "cache"), max_size_mb=2048):
+        self.root = root
+        self.max_bytes = int(max_size_mb * 2**20)
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config.get("cache") or {}
+        return cls(root=cache_config.get("dir", os.path.join("results", "cache")),
+                   max_size_mb=cache_config.get("max_size_mb", 2048))
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        # Path of the cached entry or None, a hit marks the entry as recently used
+        path = self._path(key)
+        if not os.path.exists(os.path.join(path, ENTRY_FILE)):
+            return None
+        os.utime(path)
+        return path
+
+    def restore(self, key, dest_dir):
+        # Copy the files of a cached entry to dest_dir, returns the copied paths or None on a miss
+        path = self.get(key)
+        if path is None:
+            return None
+        copied = []
+        for name in os.listdir(path):
+            if name != ENTRY_FILE:
+                copied.append(shutil.copy2(os.path.join(path, name), os.path.join(dest_dir, name)))
+        print(f"Cached results restored from: {path}")
+        return copied
+
+    def put(self, key, files, parts=None):
+        # Store copies of files under key. Entries are written to a temporary directory
+        # first and renamed, so concurrent runs never see half-written entries
+        tmp = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        try:
+            for f in files:
+                shutil.copy2(f, os.path.join(tmp, os.path.basename(f)))
+            with open(os.path.join(tmp, ENTRY_FILE), "w") as f:
+                json.dump({"key": key, "time": time.strftime("%Y-%m-%d %H:%M:%S"), "parts": parts}, f, indent=2, default=str)
+            if os.path.exists(self._path(key)):
+                shutil.rmtree(self._path(key))
+            os.rename(tmp, self._path(key))
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        self.evict()
+        return self._path(key)
+
+    def entries(self):
+        # (key, size in bytes, last used time) of every entry, least recently used first. Other
+        # directories under the root are not entries, e.g. the landmark cache (maps.landmarks_dir)
+        entries = []
+        for key in os.listdir(self.root):
+            path = self._path(key)
+            if key.startswith(".") or not os.path.exists(os.path.join(path, ENTRY_FILE)):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((key, size, os.path.getmtime(path)))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        # Remove least recently used entries until the cache fits in max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def invalidate(self, keys=None):
+        # Remove the given entries (unique key prefixes are accepted), or every entry if keys is None
+        existing = [key for key, _, _ in self.entries()]
+        if keys is None:
+            targets = existing
+        else:
+            targets = []
+            for prefix in keys:
+                matches = [key for key in existing if key.startswith(prefix)]
+                if len(matches) != 1:
+                    raise ValueError(f"Key prefix {prefix} matches {len(matches)} cache entries")
+                targets.append(matches[0])
+        for key in targets:
+            shutil.rmtree(self._path(key), ignore_errors=True)
+        return targets
+
+
+if __name__ == "__main__":
+    import yaml
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", help="list: show cached entries, invalidate: remove entries", choices=["list", "invalidate"])
+    parser.add_argument("keys", help="Keys (or unique key prefixes) of the entries to invalidate.", nargs="*")
+    parser.add_argument("--all", help="Invalidate every entry.", action="store_true", default=False)
+    args = parser.parse_args()
+
+    cache = ResultCache.from_config(config)
+    if args.command == "list":
+        entries = cache.entries()
+        for key, size, used in reversed(entries):
+            with open(os.path.join(cache._path(key), ENTRY_FILE), "r") as f:
+                options = json.load(f).get("parts", {}).get("options", {})
+            print(f"{key[:16]}  {size / 2**20:8.2f} MB  {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  {options}")
+        print(f"{len(entries)} entries, {sum(e[1] for e in entries) / 2**20:.2f} MB of {cache.max_bytes / 2**20:.0f} MB")
+    else:
+        if not args.all and not args.keys:
+            parser.error("invalidate needs keys or --all")
+        try:
+            removed = cache.invalidate(None if args.all else args.keys)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Invalidated {len(removed)} entries")
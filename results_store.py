@@ -0,0 +1,88 @@
+"""
+
+Compact store of simulation results. Every run writes the final metrics of
+its agents as columns of a compressed .npz file (see stats.collect_metrics()),
+together with the run metadata: policy, config, seed and code version. Stored
+runs can be reloaded, combined and re-plotted (see plot.py and render.py)
+without simulating again.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import json
+import time
+import subprocess
+import numpy as np
+
+from result_cache import ENTRY_FILE
+
+METRICS_FILE = "metrics.npz"
+METADATA_KEY = "metadata" # JSON string stored next to the metric columns
+
+
+def get_code_version():
+    # Git revision of the code, with a -dirty suffix if there are uncommitted changes
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=cwd).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, cwd=cwd).stdout.strip()
+    except OSError:
+        return ""
+    return rev + ("-dirty" if rev and dirty else "")
+
+def make_metadata(policy, config=None, seed=None, **extra):
+    return {"policy": policy,
+            "config": config,
+            "seed": seed,
+            "code_version": get_code_version(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **extra}
+
+def save_results(results_dir, metrics, metadata):
+    """Save per-agent metrics (dict of equally long arrays) and run metadata to results_dir/metrics.npz."""
+    assert METADATA_KEY not in metrics, f"'{METADATA_KEY}' is reserved for run metadata"
+    path = os.path.join(results_dir, METRICS_FILE)
+    np.savez_compressed(path, **{METADATA_KEY: np.array(json.dumps(metadata))}, **metrics)
+    print(f"Metrics saved to: {path}")
+    return path
+
+def load_results(path):
+    """Load (metrics, metadata) from a metrics file or a results directory containing one."""
+    if os.path.isdir(path):
+        path = os.path.join(path, METRICS_FILE)
+    with np.load(path, allow_pickle=False) as data:
+        metrics = {key: data[key] for key in data.files if key != METADATA_KEY}
+        metadata = json.loads(str(data[METADATA_KEY]))
+    return metrics, metadata
+
+def combine_results(paths):
+    """
+    Concatenate the metrics of several stored runs, e.g. replicates of the same
+    setting. A "run" column holds the index of the run every agent belongs to.
+    Returns the combined metrics and the list of run metadata.
+    """
+    columns = {}
+    metadatas = []
+    for run, path in enumerate(paths):
+        metrics, metadata = load_results(path)
+        metadatas.append(metadata)
+        n = len(next(iter(metrics.values()))) if metrics else 0
+        metrics["run"] = np.full(n, run, dtype=np.int64)
+        for key, values in metrics.items():
+            columns.setdefault(key, []).append(values)
+    return {key: np.concatenate(values) for key, values in columns.items()}, metadatas
+
+def find_results(paths):
+    # Directories under paths containing a metrics file. Entries of a result cache (and
+    # its half-written .tmp directories) are skipped, e.g. results/cache under results
+    found = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            if ENTRY_FILE in files:
+                continue
+            if METRICS_FILE in files:
+                found.append(root)
+    return sorted(found)
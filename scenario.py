@@ -0,0 +1,121 @@
+"""
+
+Compiled simulation scenario. The config dict (see config.yaml) is compiled
+once at startup into an immutable Scenario object where every building has an
+integer id, coordinates are kept in an array, and the policy of every
+workplace is an integer policy id. References between sections (e.g. a policy
+for every workplace, coordinates inside the city) are validated here, so the
+simulation hot paths only compare and index integers. Building and policy
+names are kept for reporting.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+from dataclasses import dataclass, field
+import numpy as np
+
+POLICIES = ("fixed", "free", "flex")
+FIXED, FREE, FLEX = range(len(POLICIES))
+
+HOME, WORKPLACE = 0, 1 # Building kinds
+NO_POLICY = -1         # Policy id of buildings that are not workplaces
+
+
+def get_policy_id(policy):
+    try:
+        return POLICIES.index(policy)
+    except ValueError:
+        raise ValueError(f"Unknown policy {policy}. Available policies: {POLICIES}")
+
+
+@dataclass(frozen=True, eq=False)
+class Scenario:
+    building_names: tuple   # Building id -> name
+    building_kinds: np.ndarray  # Building id -> HOME or WORKPLACE
+    coords: np.ndarray      # Building id -> (row, col) cell on the city grid
+    policy_ids: np.ndarray  # Building id -> policy id, NO_POLICY for homes
+    day_length: int
+    homes: tuple = field(init=False)
+    workplaces: tuple = field(init=False)
+    coord_tuples: tuple = field(init=False, repr=False) # Python tuples for the City interface
+    policy_of: tuple = field(init=False, repr=False)    # Python ints for fast lookups in hot paths
+    _ids: dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        for arr in (self.building_kinds, self.coords, self.policy_ids):
+            arr.flags.writeable = False
+        set_ = lambda name, value: object.__setattr__(self, name, value)
+        set_("homes", tuple(int(i) for i in np.flatnonzero(self.building_kinds == HOME)))
+        set_("workplaces", tuple(int(i) for i in np.flatnonzero(self.building_kinds == WORKPLACE)))
+        set_("coord_tuples", tuple((int(r), int(c)) for r, c in self.coords))
+        set_("policy_of", tuple(int(p) for p in self.policy_ids))
+        set_("_ids", {name: i for i, name in enumerate(self.building_names)})
+
+    @property
+    def num_buildings(self):
+        return len(self.building_names)
+
+    def building_id(self, name):
+        try:
+            return self._ids[name]
+        except KeyError:
+            raise ValueError(f"Unknown building name: {name}. Please make sure this building is declared in .yaml")
+
+    def name(self, building):
+        return self.building_names[building]
+
+    def is_home(self, building):
+        return self.building_kinds[building] == HOME
+
+    def workplaces_with_policy(self, policy):
+        # policy can be a policy name or id
+        policy_id = get_policy_id(policy) if isinstance(policy, str) else policy
+        return [w for w in self.workplaces if self.policy_of[w] == policy_id]
+
+
+def compile_scenario(config, city=None):
+    """Compile and validate the buildings and policies of a config dict. If a city is given,
+    buildings are also checked to lie on free cells of the city grid."""
+    houses = config.get("houses") or {}
+    workplaces = config.get("workplace_locations") or {}
+    policies = config.get("policy") or {}
+    if len(houses) == 0: raise ValueError("No houses declared in config.yaml")
+    if len(workplaces) == 0: raise ValueError("No workplaces declared in config.yaml")
+
+    names, kinds, coords, policy_ids = [], [], [], []
+    for kind, buildings in ((HOME, houses), (WORKPLACE, workplaces)):
+        for name, coord in buildings.items():
+            if name in names:
+                raise ValueError(f"Building {name} is declared more than once in config.yaml")
+            if len(coord) != 2:
+                raise ValueError(f"Expected 2D coordinates for {name}, got {coord}.")
+            names.append(name)
+            kinds.append(kind)
+            coords.append((int(coord[0]), int(coord[1])))
+            if kind == WORKPLACE:
+                if name not in policies:
+                    raise ValueError(f"Please specify policy for workplace {name} in config.yaml under policy section.")
+                policy_ids.append(get_policy_id(policies[name]))
+            else:
+                policy_ids.append(NO_POLICY)
+
+    for name in policies:
+        if name not in workplaces:
+            raise ValueError(f"Policy is given for undeclared workplace {name} in config.yaml")
+
+    if city is not None:
+        for name, coord in zip(names, coords):
+            if not city.in_bounds(coord):
+                raise ValueError(f"Building {name} at {coord} is out of the city bounds ({city.width}, {city.height})")
+            if not city.is_free(coord):
+                raise ValueError(f"Building {name} at {coord} is on an obstacle cell of the city grid")
+        for name, coord in zip(names[1:], coords[1:]):
+            if not city.is_reachable(coords[0], coord):
+                raise ValueError(f"Building {name} at {coord} is not reachable from {names[0]} at {coords[0]} on the city grid")
+
+    return Scenario(building_names=tuple(names),
+                    building_kinds=np.array(kinds, dtype=np.int8),
+                    coords=np.array(coords, dtype=np.int32).reshape(-1, 2),
+                    policy_ids=np.array(policy_ids, dtype=np.int8),
+                    day_length=int(config["simulation"]["day_length"]))
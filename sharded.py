@@ -0,0 +1,217 @@
+"""
+
+Sharded multi-process simulation. The population is split by agent range
+across worker processes, each advancing its own agents. The city grid and the
+precomputed building distance table are placed in multiprocessing shared
+memory once, so workers attach to them instead of receiving pickled copies.
+
+Agents of different shards only interact through aggregate counts (riders per
+bus route and agents per building). Every tick, shards publish their local
+counts to shared arrays and synchronize on a barrier. Bus riders are exchanged
+before anyone rides, so the bus crowd is the same as in a single-process run.
+Agents per building are exchanged at the end of the tick, so the co-presence of
+agents of other shards is the one of the previous tick (agents of the own shard
+are counted immediately). Per-tick
+aggregates are written by every shard into its own row of a shared array and
+reduced in the parent, final agent states are reduced into StreamingSummary
+objects that are merged in the parent.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import time
+import queue
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+import numpy as np
+
+from city import City
+from coarse_grid import CoarseGrid
+from agent import Agent, decide_and_act, ride_bus
+from transit import Transit
+from locations import LocationIndex
+from scenario import compile_scenario
+
+# Per-tick sums over the agents of a shard, see _record_aggregates()
+AGGREGATES = ("agents", "wealth", "in_recovery", "bus_riders",
+              "energy", "alone_time", "socialization", "financial_security", "self_esteem")
+
+
+def _create_shared(arr):
+    # Copy arr into a new shared memory block, returns the block, its spec and a view
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str), view
+
+def _attach_shared(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _record_aggregates(row, agents, num_riders):
+    row[0] = len(agents)
+    row[1] = sum(a.wealth for a in agents)
+    row[2] = sum(a.in_recovery for a in agents)
+    row[3] = num_riders
+    for k, need in enumerate(AGGREGATES[4:]):
+        row[4 + k] = sum(a.needs[need] for a in agents)
+
+def _run_shard(shard, first_agent, num_agents, seed, config, policy, tolerances, max_ticks,
+               specs, barrier, results, summary):
+    shms = []
+    try:
+        random.seed(seed + shard)
+        np.random.seed(seed + shard)
+        arrays = {}
+        for key, spec in specs.items():
+            shm, arrays[key] = _attach_shared(spec)
+            shms.append(shm)
+
+        city = None
+        if "grid" in arrays:
+            city = City(map_array=arrays["grid"], copy_array=False)
+            city.set_distance_table(arrays["distance_coords"].tolist(), arrays["distances"])
+            path_config = config.get("pathfinding") or {}
+            city.estimator = path_config.get("estimate", "manhattan")
+            if city.estimator == "coarse": # Cheap enough to build in every shard
+                city.coarse = CoarseGrid(city.grid, path_config.get("coarse_factor", 8))
+
+        scenario = compile_scenario(config) # Already validated against the city in the parent
+        transit = Transit.from_config(config, scenario) if "transit" in config else None
+        locations = LocationIndex(buildings=scenario.building_names, capacity=num_agents)
+        workplaces = scenario.workplaces_with_policy(policy)
+        agents = [Agent(name="A" + str(first_agent + i),
+                        city=city,
+                        home=random.choice(scenario.homes),
+                        workplace=random.choice(workplaces),
+                        social_tolerance=random.choice(tolerances),
+                        transit=transit,
+                        locations=locations,
+                        scenario=scenario) for i in range(num_agents)]
+
+        bus_counts = arrays.get("bus_counts")
+        location_counts = arrays["location_counts"]
+        aggregates = arrays["aggregates"]
+        for t in range(max_ticks):
+            buf = t % 2 # Double buffered, a fast shard never overwrites counts that are still read
+            riders = []
+            if transit is not None:
+                transit.begin_tick(t)
+                riders = decide_and_act(agents, t, defer_bus=True)
+                bus_counts[buf, shard] = np.bincount(np.array([a.get_bus_route() for a in riders], dtype=np.int64),
+                                                     minlength=transit.num_routes)
+                barrier.wait()
+                transit.observe_counts(bus_counts[buf].sum(axis=0))
+                ride_bus(riders)
+            else:
+                decide_and_act(agents, t)
+
+            location_counts[buf, shard] = locations.counts
+            barrier.wait()
+            locations.set_background(location_counts[buf].sum(axis=0) - locations.counts)
+            _record_aggregates(aggregates[shard, t], agents, len(riders))
+
+        summary.update_agents(agents)
+        results.put((shard, summary, None))
+    except BrokenBarrierError:
+        results.put((shard, None, "aborted because another shard failed"))
+    except Exception as e:
+        barrier.abort()
+        results.put((shard, None, repr(e)))
+        raise
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def run_sharded(city, scenario, config, policy, tolerances, num_agents, max_ticks, summary,
+                num_shards=None, seed=None, report_every=240, poll_interval=1.0):
+    """
+    Simulate num_agents agents of the given policy on num_shards processes.
+    Returns the merged StreamingSummary and the per-tick aggregates (summed over
+    all agents) as a dict of arrays keyed by AGGREGATES. Raises RuntimeError if a
+    shard fails or exits without reporting, polling every poll_interval seconds.
+    """
+    num_shards = min(num_shards or mp.cpu_count(), num_agents)
+    seed = random.randrange(2**31) if seed is None else seed
+    bounds = np.linspace(0, num_agents, num_shards + 1).astype(int)
+
+    shms = []
+    specs = {}
+    views = {}
+    def share(key, arr):
+        shm, specs[key], views[key] = _create_shared(arr)
+        shms.append(shm)
+
+    if city is not None:
+        if city.distance_table is None:
+            city.precompute_distances(scenario.coords)
+        share("grid", city.grid.astype(np.uint8))
+        share("distances", city.distance_table)
+        share("distance_coords", np.array(city.distance_coords, dtype=np.int32).reshape(-1, 2))
+    if "transit" in config:
+        num_routes = Transit.from_config(config, scenario).num_routes
+        share("bus_counts", np.zeros((2, num_shards, num_routes), dtype=np.int64))
+    share("location_counts", np.zeros((2, num_shards, scenario.num_buildings), dtype=np.int64))
+    share("aggregates", np.zeros((num_shards, max_ticks, len(AGGREGATES)), dtype=np.float64))
+
+    # Workers only receive the names of the shared memory blocks, never the arrays
+    ctx = mp.get_context()
+    barrier = ctx.Barrier(num_shards)
+    results = ctx.Queue()
+    print(f"Sharded run: {num_agents} agents on {num_shards} processes (seed {seed})")
+
+    start_time = time.perf_counter()
+    workers = []
+    try:
+        for shard in range(num_shards):
+            p = ctx.Process(target=_run_shard,
+                            args=(shard, int(bounds[shard]), int(bounds[shard + 1] - bounds[shard]), seed,
+                                  config, policy, tolerances, max_ticks, specs, barrier, results, summary.empty_like()))
+            p.start()
+            workers.append(p)
+
+        errors = []
+        pending = set(range(num_shards))
+        while pending:
+            try:
+                shard, shard_summary, error = results.get(timeout=poll_interval)
+            except queue.Empty:
+                # A worker that died without reporting (e.g. killed for memory) never puts a result
+                dead = [shard for shard in pending if workers[shard].exitcode is not None]
+                if dead:
+                    barrier.abort()
+                    raise RuntimeError("Sharded simulation failed, " + "; ".join(
+                        f"shard {shard} exited with code {workers[shard].exitcode}" for shard in sorted(dead)))
+                continue
+            pending.discard(shard)
+            if error is not None:
+                errors.append(f"shard {shard}: {error}")
+            else:
+                summary.merge(shard_summary)
+        for p in workers:
+            p.join()
+        if errors:
+            raise RuntimeError("Sharded simulation failed, " + "; ".join(errors))
+
+        elapsed = time.perf_counter() - start_time
+        totals = views["aggregates"].sum(axis=0) # Reduce shards
+    finally:
+        views.clear()
+        for p in workers:
+            if p.is_alive(): p.terminate()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    print(f"Simulated {num_agents * max_ticks} agent-steps in {elapsed:.1f}s ({num_agents * max_ticks / elapsed:.0f} agent-steps/s)")
+    for t in range(report_every - 1, max_ticks, report_every):
+        n = totals[t, 0]
+        print(f"[{t+1}/{max_ticks}] mean wealth {totals[t, 1] / n:.3f}, in recovery {int(totals[t, 2])}, bus riders {int(totals[t, 3])}")
+    return summary, {key: totals[:, k] for k, key in enumerate(AGGREGATES)}
@@ -0,0 +1,399 @@
+"""
+
+Online accumulators for the aggregate statistics reported at the end of a
+simulation run. Agents can be reduced into these accumulators as soon as
+they finish, so the final Agent objects do not have to be kept around to
+compute wealth histograms, Gini index, or per-tolerance statistics.
+
+All accumulators can be merged, so partial results (e.g. chunks or shards
+of a population) can be reduced independently and combined afterwards.
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import json
+import numpy as np
+
+
+################################################################################################################
+# Gini index
+################################################################################################################
+
+def gini_coefficient(values):
+    """Compute Gini index of a list of values (e.g., wealth)."""
+    array = np.array(values, dtype=float)
+    if np.amin(array) < 0:
+        array -= np.amin(array)  # Make non-negative
+    array += 1e-8  # Avoid divide by zero
+    array = np.sort(array)
+    n = len(array)
+    index = np.arange(1, n + 1)
+    return (np.sum((2 * index - n - 1) * array)) / (n * np.sum(array))
+
+def gini_from_counts(values, counts):
+    """Gini index of sorted distinct values with multiplicities (e.g. histogram bins)."""
+    values = np.asarray(values, dtype=float)
+    counts = np.asarray(counts, dtype=float)
+    mask = counts > 0
+    values, counts = values[mask], counts[mask]
+    n = np.sum(counts)
+    if n == 0:
+        return float('nan')
+    if np.amin(values) < 0:
+        values = values - np.amin(values)
+    values = values + 1e-8
+
+    # A run of c equal values starting after position p contributes
+    # c * (2p + c - n) * x to the sum in gini_coefficient()
+    positions = np.cumsum(counts) - counts
+    return float(np.sum(counts * (2 * positions + counts - n) * values) / (n * np.sum(counts * values)))
+
+def bootstrap_gini(values, num_resamples=1000, max_bytes=64 * 2**20, rng=None):
+    """
+    Gini index of num_resamples bootstrap resamples of values. Resample indices
+    are drawn as a (B, N) matrix and every Gini is computed in one vectorized
+    pass, in batches of rows so that the temporaries stay below max_bytes.
+    """
+    values = np.sort(np.asarray(values, dtype=float).ravel())
+    n = values.size
+    draw = np.random.randint if rng is None else rng.integers
+
+    # Values are sorted once, so the multiplicities of the resampled indices give
+    # every resample in sorted order without sorting each row (see gini_from_counts)
+    x = values + 1e-8
+    batch = int(max(1, min(num_resamples, max_bytes // (24 * max(n, 1)))))
+    ginis = np.empty(num_resamples, dtype=float)
+    for start in range(0, num_resamples, batch):
+        b = min(batch, num_resamples - start)
+        indices = draw(0, n, size=(b, n))
+        indices += np.arange(b)[:, None] * n
+        counts = np.bincount(indices.ravel(), minlength=b * n).reshape(b, n)
+        del indices
+
+        # c * (2p + c) summed over the runs is n^2, so the numerator does not depend on
+        # the shift by the resample min that gini_coefficient() applies to negative values
+        weights = np.cumsum(counts, axis=1)
+        weights *= 2
+        weights -= counts
+        total = counts @ x
+        shift = np.minimum(values[np.argmax(counts > 0, axis=1)], 0)
+        ginis[start:start + b] = (np.einsum('ij,ij,j->i', weights, counts, x) - n * total) / (n * (total - n * shift))
+    return ginis
+
+def ci_half_width(values, confidence=0.95):
+    """Half-width of the confidence interval of the mean of values (Student t, normal if scipy is missing)."""
+    values = np.asarray(values, dtype=float)
+    n = values.size
+    if n < 2:
+        return float('inf')
+    try:
+        from scipy.stats import t
+        q = t.ppf(0.5 + confidence / 2, df=n - 1)
+    except ImportError:
+        from statistics import NormalDist
+        q = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return float(q * np.std(values, ddof=1) / np.sqrt(n))
+
+
+################################################################################################################
+# Per-agent metrics
+################################################################################################################
+
+def collect_metrics(agents):
+    """Final metrics of agents as a dict of columnar arrays, e.g. to be saved and plotted later.
+    Workplaces are building ids and policies are policy ids of the agents' scenario."""
+    return {"tolerance": np.array([a.social_tolerance for a in agents], dtype=np.int64),
+            "wealth": np.array([a.final_wealth() for a in agents], dtype=float),
+            "social_burnout": np.array([a.social_burnout_sum for a in agents], dtype=np.int64),
+            "energy_burnout": np.array([a.energy_burnout_sum for a in agents], dtype=np.int64),
+            "workplace": np.array([a.workplace for a in agents], dtype=np.int64),
+            "policy": np.array([a.scenario.policy_of[a.workplace] for a in agents], dtype=np.int64)}
+
+def grouped_stats(keys, *columns):
+    """
+    Size, mean, std (ddof=0) and 95% CI half-width of every column grouped by keys.
+    Groups are found with one np.unique pass and the sums of all columns with one
+    np.bincount pass. Returns labels, counts, and (num_columns, num_groups) arrays
+    of means, stds and CIs.
+    """
+    labels, inverse, counts = np.unique(np.asarray(keys), return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    values = np.asarray(columns, dtype=float).reshape(len(columns), -1)
+    num_groups = len(labels)
+
+    # Column k of group g is bin k * num_groups + g
+    bins = (np.arange(len(columns))[:, None] * num_groups + inverse[None, :]).ravel()
+    size = len(columns) * num_groups
+    means = np.bincount(bins, weights=values.ravel(), minlength=size).reshape(-1, num_groups) / counts
+    m2 = np.bincount(bins, weights=((values - means[:, inverse]) ** 2).ravel(), minlength=size).reshape(-1, num_groups)
+    stds = np.sqrt(m2 / counts)
+    cis = 1.96 * stds / np.sqrt(counts)
+    return labels, counts, means, stds, cis
+
+
+################################################################################################################
+# Accumulators
+################################################################################################################
+
+class Welford:
+    """Running mean and (population) variance, see Welford (1962) and Chan et al. (1979) for merging."""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def update_many(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        if xs.size == 0:
+            return
+        self.merge(Welford.from_moments(xs.size, np.mean(xs), np.sum((xs - np.mean(xs)) ** 2)))
+
+    @classmethod
+    def from_moments(cls, n, mean, m2):
+        # Accumulator of a batch with known size, mean and sum of squared deviations
+        batch = cls()
+        batch.n = int(n)
+        batch.mean = float(mean)
+        batch.m2 = float(m2)
+        return batch
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / self.n if self.n > 0 else float('nan') # ddof=0, same as np.std() in plot.py
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self):
+        return {"n": self.n, "mean": self.mean, "std": self.std}
+
+
+class WealthHistogram:
+    """Fixed-bin histogram with under/overflow counters and exact min/max."""
+    def __init__(self, value_range, bins=20):
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def update_many(self, values):
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return
+        self.min = min(self.min, float(np.amin(values)))
+        self.max = max(self.max, float(np.amax(values)))
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+        counts, _ = np.histogram(values, bins=self.edges)
+        self.counts += counts
+
+    def update(self, value):
+        self.update_many([value])
+
+    def merge(self, other):
+        assert np.array_equal(self.edges, other.edges), "Cannot merge histograms with different bins"
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def total(self):
+        return int(np.sum(self.counts)) + self.underflow + self.overflow
+
+    def gini(self):
+        # Sketch estimate, every value is approximated by its bin center
+        # and out-of-range values by the observed min/max
+        centers = 0.5 * (self.edges[:-1] + self.edges[1:])
+        values = np.concatenate(([self.min], centers, [self.max]))
+        counts = np.concatenate(([self.underflow], self.counts, [self.overflow]))
+        return gini_from_counts(values, counts)
+
+    def to_dict(self):
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(),
+                "underflow": self.underflow, "overflow": self.overflow,
+                "min": self.min, "max": self.max}
+
+
+class GiniAccumulator:
+    """
+    Gini index over a stream of values. If exact, values are kept in a compact
+    float array (8 bytes per agent), otherwise it is estimated from the histogram.
+    """
+    def __init__(self, histogram, exact=True):
+        self.histogram = histogram
+        self.exact = exact
+        self._buffer = np.empty(1024 if exact else 0, dtype=float)
+        self._size = 0
+
+    def update_many(self, values):
+        if not self.exact:
+            return # Histogram is updated by the owner
+        values = np.asarray(values, dtype=float).ravel()
+        needed = self._size + values.size
+        if needed > self._buffer.size:
+            grown = np.empty(max(needed, 2 * self._buffer.size), dtype=float)
+            grown[:self._size] = self._buffer[:self._size]
+            self._buffer = grown
+        self._buffer[self._size:needed] = values
+        self._size = needed
+
+    def merge(self, other):
+        if self.exact:
+            assert other.exact, "Cannot merge a sketch Gini into an exact one"
+            self.update_many(other.values)
+        return self
+
+    @property
+    def values(self):
+        return self._buffer[:self._size]
+
+    def value(self):
+        if self.exact:
+            return float(gini_coefficient(self.values)) if self._size > 0 else float('nan')
+        return self.histogram.gini()
+
+
+class ToleranceGroup:
+    """Statistics of agents sharing the same social tolerance."""
+    def __init__(self):
+        self.wealth = Welford()
+        self.social_burnout = Welford()
+        self.energy_burnout = Welford()
+        self.n_social_burnout = 0 # Number of agents with at least one social burnout tick
+        self.n_energy_burnout = 0
+
+    def update_many(self, wealth, social_burnout, energy_burnout):
+        self.wealth.update_many(wealth)
+        self.social_burnout.update_many(social_burnout)
+        self.energy_burnout.update_many(energy_burnout)
+        self.n_social_burnout += int(np.count_nonzero(np.asarray(social_burnout) > 0))
+        self.n_energy_burnout += int(np.count_nonzero(np.asarray(energy_burnout) > 0))
+
+    def merge(self, other):
+        self.wealth.merge(other.wealth)
+        self.social_burnout.merge(other.social_burnout)
+        self.energy_burnout.merge(other.energy_burnout)
+        self.n_social_burnout += other.n_social_burnout
+        self.n_energy_burnout += other.n_energy_burnout
+        return self
+
+    def to_dict(self):
+        return {"wealth": self.wealth.to_dict(),
+                "social_burnout": self.social_burnout.to_dict(),
+                "energy_burnout": self.energy_burnout.to_dict(),
+                "n_social_burnout": self.n_social_burnout,
+                "n_energy_burnout": self.n_energy_burnout}
+
+
+class StreamingSummary:
+    """
+    Bounded-memory summary of a population: wealth histogram, Gini index,
+    and per-tolerance mean/std of wealth and burnout sums.
+    """
+    def __init__(self, wealth_range, bins=20, exact_gini=True):
+        self.histogram = WealthHistogram(value_range=wealth_range, bins=bins)
+        self.gini = GiniAccumulator(self.histogram, exact=exact_gini)
+        self.wealth = Welford()
+        self.groups = {}
+
+    def empty_like(self):
+        # New summary with the same histogram bins and Gini mode, e.g. for shards of a population
+        return StreamingSummary(wealth_range=(self.histogram.edges[0], self.histogram.edges[-1]),
+                                bins=len(self.histogram.counts), exact_gini=self.gini.exact)
+
+    def update(self, agent):
+        self.update_arrays(tolerance=[agent.social_tolerance],
+                           wealth=[agent.final_wealth()],
+                           social_burnout=[agent.social_burnout_sum],
+                           energy_burnout=[agent.energy_burnout_sum])
+
+    def update_agents(self, agents):
+        self.update_arrays(tolerance=[a.social_tolerance for a in agents],
+                           wealth=[a.final_wealth() for a in agents],
+                           social_burnout=[a.social_burnout_sum for a in agents],
+                           energy_burnout=[a.energy_burnout_sum for a in agents])
+
+    def update_arrays(self, tolerance, wealth, social_burnout, energy_burnout):
+        tolerance = np.asarray(tolerance)
+        wealth = np.asarray(wealth, dtype=float)
+        social_burnout = np.asarray(social_burnout, dtype=float)
+        energy_burnout = np.asarray(energy_burnout, dtype=float)
+
+        self.histogram.update_many(wealth)
+        self.gini.update_many(wealth)
+        self.wealth.update_many(wealth)
+        if tolerance.size == 0:
+            return
+
+        # Per-tolerance moments in one grouped pass, merged into the Welford accumulators
+        labels, counts, means, stds, _ = grouped_stats(tolerance, wealth, social_burnout, energy_burnout,
+                                                       social_burnout > 0, energy_burnout > 0)
+        m2 = stds ** 2 * counts
+        for g, tol in enumerate(labels):
+            key = tol.item()
+            if key not in self.groups:
+                self.groups[key] = ToleranceGroup()
+            group = self.groups[key]
+            group.wealth.merge(Welford.from_moments(counts[g], means[0, g], m2[0, g]))
+            group.social_burnout.merge(Welford.from_moments(counts[g], means[1, g], m2[1, g]))
+            group.energy_burnout.merge(Welford.from_moments(counts[g], means[2, g], m2[2, g]))
+            group.n_social_burnout += int(round(means[3, g] * counts[g]))
+            group.n_energy_burnout += int(round(means[4, g] * counts[g]))
+
+    def merge(self, other):
+        self.histogram.merge(other.histogram)
+        self.gini.merge(other.gini)
+        self.wealth.merge(other.wealth)
+        for key, group in other.groups.items():
+            if key not in self.groups:
+                self.groups[key] = ToleranceGroup()
+            self.groups[key].merge(group)
+        return self
+
+    @property
+    def n(self):
+        return self.wealth.n
+
+    def to_dict(self):
+        return {"n": self.n,
+                "gini": self.gini.value(),
+                "gini_exact": self.gini.exact,
+                "wealth": self.wealth.to_dict(),
+                "histogram": self.histogram.to_dict(),
+                "tolerance_groups": {str(k): self.groups[k].to_dict() for k in sorted(self.groups)}}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"Summary saved to: {path}")
+
+    def report(self):
+        print(f"Agents: {self.n} | Mean wealth: {self.wealth.mean:.3f} ± {self.wealth.std:.3f} | Gini: {self.gini.value():.3f}")
+        for key in sorted(self.groups):
+            g = self.groups[key]
+            print(f"  tolerance {key}: wealth {g.wealth.mean:.3f} ± {g.wealth.std:.3f}, "
+                  f"social burnout {g.social_burnout.mean:.2f} ({g.n_social_burnout}/{g.wealth.n} agents), "
+                  f"energy burnout {g.energy_burnout.mean:.2f} ({g.n_energy_burnout}/{g.wealth.n} agents)")
@@ -0,0 +1,192 @@
+"""
+
+Live telemetry of simulation runs. Every `every` ticks, the simulation loop
+samples per-tick aggregates of the population (ticks per second, mean needs,
+agents in recovery, wealth quantiles and the mix of actions taken) and hands
+them to a background thread through a bounded queue. The thread reduces and
+publishes them as JSON lines to a file or to a Unix datagram socket. If the
+queue is full, samples are dropped (and counted) instead of blocking, so
+publishing never slows the simulation down.
+
+A tiny viewer follows the published records live:
+
+    python commute_simulation.py --telemetry results/telemetry.jsonl
+    python telemetry.py results/telemetry.jsonl
+
+    python telemetry.py unix:/tmp/simulation.sock  # Start the viewer first, it binds the socket
+    python commute_simulation.py --telemetry unix:/tmp/simulation.sock
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+import numpy as np
+from collections import Counter
+
+SOCKET_PREFIX = "unix:"
+
+
+class Telemetry:
+    def __init__(self, sink, every=10, queue_size=256, quantiles=(0.1, 0.5, 0.9)):
+        # sink: path of a JSON lines file, or unix:<path> of a datagram socket bound by the viewer
+        self.sink = sink
+        self.every = every
+        self.quantiles = list(quantiles)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.published = 0
+        self.context = {} # Added to every record, e.g. the policy of the run
+        self._last = None # (tick, time) of the last sample
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config, sink):
+        telemetry_config = config.get("telemetry") or {}
+        return cls(sink, every=telemetry_config.get("every", 10),
+                   queue_size=telemetry_config.get("queue_size", 256),
+                   quantiles=telemetry_config.get("quantiles", [0.1, 0.5, 0.9]))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._publish, name="telemetry", daemon=True)
+        self._thread.start()
+        return self
+
+    def begin_run(self, **context):
+        self.context = context
+        self._last = None
+
+    def observe(self, agents, t):
+        """Call after every tick t, samples the agents every `every` ticks."""
+        if (t + 1) % self.every != 0:
+            return
+        now = time.perf_counter()
+        tps = None
+        if self._last is not None:
+            tps = (t - self._last[0]) / max(now - self._last[1], 1e-12)
+        self._last = (t, now)
+
+        # Only copy the raw per-agent values here, the publishing thread reduces them
+        need_keys = list(agents[0].needs)
+        sample = {"tick": t + 1, "time": time.time(), "ticks_per_s": tps, "num_agents": len(agents), **self.context,
+                  "need_keys": need_keys,
+                  "needs": [[a.needs[k] for k in need_keys] for a in agents],
+                  "wealth": [a.wealth for a in agents],
+                  "in_recovery": sum(a.in_recovery for a in agents),
+                  "actions": Counter(a.last_action for a in agents)}
+        try:
+            self.queue.put_nowait(sample)
+        except queue.Full:
+            self.dropped += 1
+
+    def reduce(self, sample):
+        needs = np.asarray(sample.pop("needs"), dtype=float)
+        wealth = np.asarray(sample.pop("wealth"), dtype=float)
+        actions = sample.pop("actions")
+        sample["mean_needs"] = dict(zip(sample.pop("need_keys"), needs.mean(axis=0).round(6).tolist()))
+        sample["wealth_quantiles"] = dict(zip((str(q) for q in self.quantiles), np.quantile(wealth, self.quantiles).round(6).tolist()))
+        sample["mean_wealth"] = float(wealth.mean())
+        sample["action_mix"] = {str(action) if action is not None else "idle": count / len(wealth) for action, count in actions.items()}
+        sample["dropped"] = self.dropped
+        return sample
+
+    def _publish(self):
+        if self.sink.startswith(SOCKET_PREFIX):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            write = lambda line: self._send(sock, line)
+            close = sock.close
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.sink)), exist_ok=True)
+            f = open(self.sink, "w")
+            def write(line):
+                f.write(line + "\n")
+                f.flush() # Viewers follow the file
+                return True
+            close = f.close
+        try:
+            while True:
+                sample = self.queue.get()
+                if sample is None:
+                    break
+                if write(json.dumps(self.reduce(sample))):
+                    self.published += 1
+        finally:
+            close()
+
+    def _send(self, sock, line):
+        # Datagrams are lost while no viewer is bound to the socket
+        try:
+            sock.sendto(line.encode(), self.sink[len(SOCKET_PREFIX):])
+            return True
+        except OSError:
+            self.dropped += 1
+            return False
+
+    def close(self):
+        # Publish the remaining samples and stop the thread
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        print(f"Telemetry: {self.published} records published to {self.sink}, {self.dropped} dropped")
+
+
+################################################################################################################
+# Viewer
+################################################################################################################
+
+def follow(source):
+    # Records published to a JSON lines file (waits for new lines) or a datagram socket
+    if source.startswith(SOCKET_PREFIX):
+        path = source[len(SOCKET_PREFIX):]
+        if os.path.exists(path):
+            os.remove(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        try:
+            while True:
+                yield json.loads(sock.recv(2**20))
+        finally:
+            sock.close()
+            os.remove(path)
+    else:
+        while not os.path.exists(source):
+            time.sleep(0.5)
+        with open(source, "r") as f:
+            partial = ""
+            while True:
+                line = f.readline()
+                if not line:
+                    time.sleep(0.2)
+                    continue
+                partial += line
+                if partial.endswith("\n"): # Skip lines that are still being written
+                    yield json.loads(partial)
+                    partial = ""
+
+def format_record(record):
+    tps = f"{record['ticks_per_s']:8.1f}" if record.get("ticks_per_s") else f"{'-':>8}"
+    needs = " ".join(f"{k[:6]} {v:6.2f}" for k, v in record["mean_needs"].items())
+    wealth = "/".join(f"{v:.1f}" for v in record["wealth_quantiles"].values())
+    mix = " ".join(f"{a} {share:.0%}" for a, share in sorted(record["action_mix"].items(), key=lambda item: -item[1]))
+    return (f"{record.get('policy', ''):>5} tick {record['tick']:>6} | {tps} ticks/s | recovery {record['in_recovery']:>5} | "
+            f"wealth q {wealth} | {needs} | {mix}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="JSON lines file written by commute_simulation.py --telemetry, or unix:<path> to bind a socket.", type=str)
+    args = parser.parse_args()
+    try:
+        for record in follow(args.source):
+            print(format_record(record))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,44 @@
+import pytest
+
+import batch
+import commute_simulation as sim
+
+SMALL = {"simulation": {"num_agents": 4, "max_ticks": 24}}
+
+
+
+@pytest.fixture(autouse=True)
+def restore_config(monkeypatch):
+    # Scenarios replace the config of commute_simulation, see configure()
+    for name in ("config", "MAPS", "DAY_LENGTH", "MAX_TICKS", "NUM_AGENTS"):
+        monkeypatch.setattr(sim, name, getattr(sim, name))
+
+
+def run(tmp_path, monkeypatch, *args, **config):
+    monkeypatch.setattr(batch, "BASE_CONFIG", batch.merge_config(sim.config, {"cache": {"dir": str(tmp_path / "cache")}}))
+    spec = {"id": "s", "seed": 1, "policy": "fixed", "config": {**SMALL, **config}, "args": list(args)}
+    return batch.run_scenario(spec, str(tmp_path / "results"))
+
+
+def test_traced_scenarios_are_not_cached(tmp_path, monkeypatch):
+    # A cache hit would restore results without a trace
+    run(tmp_path, monkeypatch, "--trace")
+    record = run(tmp_path, monkeypatch, "--trace")
+    assert "error" not in record
+    assert not record["policies"]["fixed"]["cached"]
+    assert record["warnings"] == ["Traced runs are not cached"]
+
+
+def test_ignored_options_are_reported(tmp_path, monkeypatch):
+    record = run(tmp_path, monkeypatch, "--chunked", "--converge")
+    assert "error" not in record
+    assert any(warning.startswith("--converge") for warning in record["warnings"])
+
+
+def test_maps_overrides_rebuild_the_registry():
+    registry = sim.MAPS
+    sim.configure(batch.merge_config(sim.config, {"maps": {"max_size_mb": 1}}))
+    assert sim.MAPS is not registry and sim.MAPS.max_bytes == 2**20
+    current = sim.MAPS
+    sim.configure(batch.merge_config(sim.config, SMALL))
+    assert sim.MAPS is current # Loaded maps are kept
@@ -0,0 +1,11 @@
+import numpy as np
+
+from chunked import AgentStateStore
+
+
+def test_tolerance_is_stored_as_integer(tmp_path):
+    # Summary groups are keyed by str(tolerance), "1" like in-memory runs and not "1.0"
+    store = AgentStateStore(4, ["energy"], str(tmp_path))
+    store.social_tolerance[:] = [1, 2, 3, 7]
+    assert np.issubdtype(store.social_tolerance.dtype, np.integer)
+    assert [str(tol.item()) for tol in store.social_tolerance] == ["1", "2", "3", "7"]
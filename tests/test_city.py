@@ -0,0 +1,92 @@
+import numpy as np
+
+from city import City, ReservationTable
+
+
+def make_city():
+    # Wall across the map with a gap at the bottom, so paths are much longer than Manhattan distance
+    grid = np.zeros((20, 20), dtype=np.int8)
+    grid[:19, 10] = 1
+    return City(map_array=grid)
+
+
+def test_landmark_bound_without_landmarks_is_manhattan():
+    city = make_city()
+    assert city.get_landmark_bound((0, 0), (0, 19)) == 19
+
+
+def test_landmark_bound_is_admissible():
+    city = make_city()
+    city.precompute_landmarks(4)
+    cells = [(0, 0), (0, 19), (5, 3), (12, 15), (19, 10)]
+    for start in cells:
+        for target in cells:
+            moves = len(city.shortest_path(start, target)) - 1
+            assert 0 <= city.get_landmark_bound(start, target) <= moves
+    assert city.get_landmark_bound((0, 0), (0, 19)) > 19
+
+
+def test_alt_and_manhattan_paths_have_the_same_length():
+    city = make_city()
+    city.precompute_landmarks(4)
+    manhattan = len(city.shortest_path((0, 0), (0, 19)))
+    expansions = city.last_expansions
+    city.heuristic = "alt"
+    assert len(city.shortest_path((0, 0), (0, 19))) == manhattan
+    assert city.last_expansions <= expansions
+
+
+def assert_conflict_free(path, other, buildings):
+    # No shared cell at a time step and no swap, except in buildings (never reserved)
+    for t in range(min(len(path), len(other))):
+        if path[t] not in buildings:
+            assert path[t] != other[t], f"vertex conflict at {path[t]}, time step {t}"
+        if t + 1 < min(len(path), len(other)):
+            assert not (path[t] == other[t + 1] and path[t + 1] == other[t]), f"swap conflict at time step {t}"
+
+
+def test_cooperative_paths_on_crossing_corridors():
+    # Corridors cross at (4, 4), both agents would be there at time step 4
+    grid = np.ones((9, 9), dtype=np.int8)
+    grid[4, :] = 0
+    grid[:, 4] = 0
+    city = City(map_array=grid)
+    city.enable_cooperative(window=8, cells_per_tick=16)
+    east = city.cooperative_path((4, 0), (4, 8), agent="east")
+    south = city.cooperative_path((0, 4), (8, 4), agent="south")
+    assert len(east) == 9
+    assert len(south) > 9 # Waits for the crossing
+    assert_conflict_free(east, south, {(4, 0), (4, 8), (0, 4), (8, 4)})
+
+
+def test_cooperative_paths_on_opposite_corridors():
+    # Two lanes, agents walking in opposite directions pass each other
+    city = City(map_array=np.zeros((2, 8), dtype=np.int8))
+    city.enable_cooperative(window=8, cells_per_tick=16)
+    forth = city.cooperative_path((0, 0), (0, 7), agent="forth")
+    back = city.cooperative_path((0, 7), (0, 0), agent="back")
+    assert forth[-1] == (0, 7) and back[-1] == (0, 0)
+    assert_conflict_free(forth, back, {(0, 0), (0, 7)})
+
+
+def test_cooperative_path_falls_back_in_gridlocks():
+    # The only way to the target stays reserved, waiting is given up and the shortest path taken
+    city = City(map_array=np.zeros((1, 8), dtype=np.int8))
+    city.enable_cooperative(window=4, cells_per_tick=16)
+    for t in range(1000):
+        city.reservations.reserve((0, 3), t, "blocker")
+    path = city.cooperative_path((0, 0), (0, 7), agent="walker")
+    assert len(path) > 4 * (7 + city.window)
+    assert path[:3] == [(0, 0), (0, 1), (0, 2)] # Waits in front of the blocked cell
+    assert path[-6:] == [(0, k) for k in range(2, 8)]
+
+
+def test_begin_tick_drops_past_reservations():
+    table = ReservationTable(cells_per_tick=4)
+    for t in (1, 5, 9):
+        table.reserve((0, 0), t, "agent")
+    table.begin_tick(2)
+    assert table.now == 8
+    assert len(table) == 1
+    assert table.owner((0, 0), 5) is None
+    assert table.owner((0, 0), 9) == "agent"
@@ -0,0 +1,46 @@
+import numpy as np
+
+from convergence import ConvergenceMonitor
+
+DAY_LENGTH = 10
+
+
+class FakeAgent:
+    def __init__(self, social_tolerance):
+        self.social_tolerance = social_tolerance
+        self.wealth = 0.0
+        self.social_burnout_sum = 0
+        self.energy_burnout_sum = 0
+
+    def final_wealth(self):
+        return self.wealth
+
+
+def simulate(monitor, agents, num_days, burnout_rate, rng):
+    # Every day, every agent earns a fixed income and is in burnout for a random number of ticks
+    for day in range(num_days):
+        for i, agent in enumerate(agents):
+            agent.wealth += 1 + i % 5
+            agent.social_burnout_sum += int(rng.binomial(DAY_LENGTH, burnout_rate(day)))
+        if monitor.observe(agents, (day + 1) * DAY_LENGTH - 1):
+            return
+
+
+def make_agents(group_size=14, num_groups=7):
+    return [FakeAgent(social_tolerance=g + 1) for g in range(num_groups) for _ in range(group_size)]
+
+
+def test_stationary_noisy_run_stops():
+    # Small groups with noisy daily burnout rates still converge once the rates are stationary
+    monitor = ConvergenceMonitor(DAY_LENGTH, window=3, min_days=3)
+    simulate(monitor, make_agents(), 30, lambda day: 0.5, np.random.default_rng(0))
+    assert monitor.converged
+    assert monitor.stopped_at <= 10 * DAY_LENGTH
+    assert monitor.to_dict()["stopped_at"] == monitor.stopped_at
+
+
+def test_trending_run_does_not_stop():
+    monitor = ConvergenceMonitor(DAY_LENGTH, window=3, min_days=3)
+    simulate(monitor, make_agents(), 10, lambda day: 0.08 * day, np.random.default_rng(0))
+    assert not monitor.converged
+    assert monitor.to_dict()["stopped_at"] is None
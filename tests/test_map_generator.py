@@ -0,0 +1,43 @@
+import copy
+
+import numpy as np
+import pytest
+import yaml
+
+from city import City
+from io_handler import get_binary_map
+from map_generator import generate
+from scenario import compile_scenario
+
+HIGH_DENSITY = {"maze": 1.0, "rooms": 0.5, "city": 0.95}
+
+
+@pytest.fixture(scope="module")
+def config():
+    with open("config.yaml", "r") as f:
+        return yaml.safe_load(f)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("kind", list(HIGH_DENSITY))
+def test_layout_compiles(tmp_path, config, kind, seed):
+    # Every building of a generated layout is reachable from the others, so the simulator accepts it
+    output = str(tmp_path / f"{kind}.map")
+    layout_path = generate(kind, 128, 128, output, density=HIGH_DENSITY[kind], seed=seed)
+    assert layout_path is not None
+    with open(layout_path, "r") as f:
+        layout = yaml.safe_load(f)
+
+    scenario_config = copy.deepcopy(config)
+    for key in ("houses", "workplace_locations", "policy"):
+        scenario_config[key] = layout[key]
+    scenario_config["transit"]["routes"] = layout["transit"]["routes"]
+    city = City(map_array=get_binary_map(mapfile_path=output).astype(np.int8), copy_array=False)
+    scenario = compile_scenario(scenario_config, city)
+    assert len(scenario.coords) == 7
+
+
+def test_no_layout_without_room(tmp_path):
+    # A fully blocked map has no component to place the buildings in
+    output = str(tmp_path / "blocked.map")
+    assert generate("city", 24, 24, output, density=1.0, block=24, street=0) is None
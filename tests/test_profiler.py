@@ -0,0 +1,21 @@
+import numpy as np
+
+from city import City
+from profiler import Profiler
+
+
+def test_only_lookups_that_fall_back_to_astar_are_misses():
+    city = City(map_array=np.zeros((10, 10), dtype=np.int8))
+    city.precompute_distances([(0, 0), (9, 9)])
+    profiler = Profiler()
+    profiler.enable()
+    try:
+        city.get_shortest_path_length((0, 0), (9, 9)) # Hit
+        city.shortest_path((0, 0), (9, 9))            # Full path, e.g. of a multi-tick commute, not a lookup
+        city.get_shortest_path_length((0, 0), (5, 5)) # Miss
+    finally:
+        profiler.disable()
+    counters = profiler.report()["counters"]
+    assert counters["astar_queries"] == 2
+    assert counters["distance_table_lookups"] == 2
+    assert counters["distance_table_hit_rate"] == 0.5
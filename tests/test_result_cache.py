@@ -0,0 +1,53 @@
+import os
+
+import result_cache
+from conftest import ROOT
+from results_store import find_results, METRICS_FILE
+
+
+def test_model_hash_covers_new_modules():
+    modules = result_cache.get_model_modules(ROOT)
+    for name in ("agent.py", "convergence.py", "commutes.py", "coarse_grid.py", "io_handler.py"):
+        assert name in modules
+    assert not set(modules) & set(result_cache.TOOL_MODULES)
+
+
+def test_model_hash_changes_with_a_module(tmp_path, monkeypatch):
+    # Any module of the root changes the hash, not only listed ones
+    (tmp_path / "model.py").write_text("A = 1\n")
+    (tmp_path / "plot.py").write_text("B = 1\n")
+    monkeypatch.setattr(result_cache, "__file__", str(tmp_path / "result_cache.py"))
+
+    def model_hash():
+        monkeypatch.setattr(result_cache, "_model_hash", None)
+        return result_cache.get_model_hash()
+
+    before = model_hash()
+    (tmp_path / "plot.py").write_text("B = 2\n")
+    assert model_hash() == before
+    (tmp_path / "model.py").write_text("A = 2\n")
+    assert model_hash() != before
+
+
+def test_find_results_skips_cache_entries(tmp_path):
+    # Rendering results/ must not write figures into the entries of results/cache
+    run = tmp_path / "fixed"
+    run.mkdir()
+    (run / METRICS_FILE).write_bytes(b"")
+    cache = result_cache.ResultCache(root=str(tmp_path / "cache"))
+    cache.put("key", [str(run / METRICS_FILE)])
+    os.makedirs(tmp_path / "cache" / ".tmp-1")
+    (tmp_path / "cache" / ".tmp-1" / METRICS_FILE).write_bytes(b"")
+    assert find_results([str(tmp_path)]) == [str(run)]
+
+
+def test_landmark_cache_is_not_an_entry(tmp_path):
+    # maps.landmarks_dir defaults to results/cache/landmarks, it must survive eviction and invalidate --all
+    cache = result_cache.ResultCache(root=str(tmp_path), max_size_mb=0)
+    os.makedirs(tmp_path / "landmarks")
+    (tmp_path / "landmarks" / "map.npz").write_bytes(b"0" * 1024)
+    (tmp_path / "summary.json").write_text("{}")
+    cache.put("key", [str(tmp_path / "summary.json")])
+    assert cache.entries() == []
+    cache.invalidate()
+    assert (tmp_path / "landmarks" / "map.npz").exists()
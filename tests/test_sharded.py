@@ -0,0 +1,77 @@
+import os
+import random
+
+import numpy as np
+import pytest
+
+import commute_simulation as sim
+from agent import Agent, step_agents
+from locations import LocationIndex
+from scenario import compile_scenario
+import sharded
+from sharded import AGGREGATES, _record_aggregates, run_sharded
+from transit import Transit
+
+NUM_AGENTS = 12
+MAX_TICKS = 60
+SEED = 3
+
+
+def run_single_process(city, scenario, policy):
+    # Same population and random stream as shard 0 of a sharded run, stepped in this process
+    random.seed(SEED)
+    np.random.seed(SEED)
+    transit = Transit.from_config(sim.config, scenario)
+    locations = LocationIndex(buildings=scenario.building_names, capacity=NUM_AGENTS)
+    workplaces = scenario.workplaces_with_policy(policy)
+    agents = [Agent(name="A" + str(i),
+                    city=city,
+                    home=random.choice(scenario.homes),
+                    workplace=random.choice(workplaces),
+                    social_tolerance=random.choice(sim.get_available_tolerances()),
+                    transit=transit,
+                    locations=locations,
+                    scenario=scenario) for i in range(NUM_AGENTS)]
+    totals = np.zeros((MAX_TICKS, len(AGGREGATES)))
+    for t in range(MAX_TICKS):
+        step_agents(agents, t, transit)
+        _record_aggregates(totals[t], agents, int(transit.riders.sum()))
+    return {key: totals[:, k] for k, key in enumerate(AGGREGATES)}
+
+
+@pytest.fixture
+def city():
+    return sim.MAPS.get()
+
+
+def test_single_shard_matches_single_process(city):
+    # Bus crowds are exchanged within the tick, so bus counts and totals are those of an unsharded run
+    scenario = compile_scenario(sim.config, city)
+    sim.MAPS.precompute(city, scenario.coords)
+    _, totals = run_sharded(city, scenario, sim.config, "fixed", sim.get_available_tolerances(),
+                            NUM_AGENTS, MAX_TICKS, sim.get_streaming_summary(), num_shards=1, seed=SEED)
+    expected = run_single_process(city.for_run(estimator=sim.config["pathfinding"]["estimate"]), scenario, "fixed")
+    assert expected["bus_riders"].sum() > 0
+    for key in AGGREGATES:
+        np.testing.assert_allclose(totals[key], expected[key], err_msg=key)
+
+
+def test_shards_cover_population(city):
+    scenario = compile_scenario(sim.config, city)
+    sim.MAPS.precompute(city, scenario.coords)
+    _, totals = run_sharded(city, scenario, sim.config, "fixed", sim.get_available_tolerances(),
+                            NUM_AGENTS, MAX_TICKS, sim.get_streaming_summary(), num_shards=3, seed=SEED)
+    assert (totals["agents"] == NUM_AGENTS).all()
+    assert totals["bus_riders"].max() <= NUM_AGENTS
+
+
+def die(*args):
+    os._exit(1) # e.g. killed for memory, without reporting a result
+
+
+def test_dead_shard_raises(city, monkeypatch):
+    scenario = compile_scenario(sim.config, city)
+    monkeypatch.setattr(sharded, "_run_shard", die)
+    with pytest.raises(RuntimeError, match="exited with code 1"):
+        run_sharded(None, scenario, sim.config, "fixed", sim.get_available_tolerances(),
+                    NUM_AGENTS, MAX_TICKS, sim.get_streaming_summary(), num_shards=2, seed=SEED, poll_interval=0.1)
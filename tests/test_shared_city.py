@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import commute_simulation as sim
+from city import City
+from map_registry import get_city_bytes
+from scenario import compile_scenario
+
+
+@pytest.fixture
+def city():
+    return sim.MAPS.get()
+
+
+def test_run_view_shares_data_but_not_settings(city):
+    view = city.for_run(heuristic="alt", estimator="coarse")
+    view.enable_cooperative(window=8, cells_per_tick=16)
+    assert view.grid is city.grid
+    assert city.reservations is None
+    assert (city.heuristic, city.estimator) == ("manhattan", "manhattan")
+
+
+def test_failed_run_leaves_shared_city_untouched(city, tmp_path, monkeypatch):
+    # A run that fails mid-simulation (e.g. in a long-lived batch worker) must not leak its
+    # reservations or settings into the next runs on the same map
+    args = sim.get_parser().parse_args(["--headless", "--cooperative", "--seed", "0"])
+    scenario = compile_scenario(sim.config, city)
+    sim.MAPS.precompute(city, scenario.coords)
+    monkeypatch.setattr(sim, "NUM_AGENTS", 5)
+    monkeypatch.setattr(sim, "MAX_TICKS", 3)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("failed mid-run")
+    monkeypatch.setattr(sim, "step_agents", fail)
+    with pytest.raises(RuntimeError):
+        sim.run_policy(args, city, scenario, "fixed", str(tmp_path))
+    assert city.reservations is None
+
+
+
+def test_cooperative_neighbor_cache_is_counted():
+    # Neighbor lists of cooperative paths are cached on the shared City, its size must include them
+    city = City(map_array=np.zeros((16, 16), dtype=np.int8))
+    before = get_city_bytes(city)
+    view = city.for_run()
+    view.enable_cooperative()
+    view.cooperative_path((0, 0), (15, 15), agent="walker")
+    assert len(city._moves) > 0
+    assert get_city_bytes(city) > before + len(city._moves) * 56
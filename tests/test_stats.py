@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from stats import bootstrap_gini, gini_coefficient
+
+
+def reference_bootstrap_gini(values, num_resamples, seed):
+    # Direct resampling, one gini_coefficient() per resample
+    values = np.sort(np.asarray(values, dtype=float))
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, values.size, size=(num_resamples, values.size))
+    return np.array([gini_coefficient(values[row]) for row in indices])
+
+
+@pytest.mark.parametrize("shift", [0.0, -30.0]) # Negative wealth is shifted by the resample min
+@pytest.mark.parametrize("batch", [None, 7])
+def test_bootstrap_gini_matches_resampling(shift, batch):
+    values = np.random.default_rng(0).gamma(2.0, 10.0, size=40) + shift
+    max_bytes = 64 * 2**20 if batch is None else 24 * values.size * batch # Resamples split into batches of 7 rows
+    ginis = bootstrap_gini(values, num_resamples=50, max_bytes=max_bytes, rng=np.random.default_rng(1))
+    np.testing.assert_allclose(ginis, reference_bootstrap_gini(values, 50, seed=1), rtol=1e-9)
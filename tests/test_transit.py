@@ -0,0 +1,23 @@
+import copy
+
+import pytest
+
+import commute_simulation as sim
+from scenario import compile_scenario
+from transit import Transit
+
+
+def test_routes_serve_every_commute():
+    scenario = compile_scenario(sim.config)
+    transit = Transit.from_config(sim.config, scenario)
+    for home in scenario.homes:
+        for workplace in scenario.workplaces:
+            assert transit.get_route(workplace, home) != transit.get_route(home, workplace)
+
+
+def test_unserved_commute_fails_at_startup():
+    # Previously raised during the first deliberation of an agent living there
+    config = copy.deepcopy(sim.config)
+    config["houses"]["home_1"] = [30, 30]
+    with pytest.raises(ValueError, match="home_1 -> workplace_0"):
+        Transit.from_config(config, compile_scenario(config))
@@ -0,0 +1,117 @@
+"""
+
+Bus transit between buildings of the city. Crowd levels are no longer drawn
+at random: every tick, the number of agents that chose "take_bus" on each
+route (and direction) is counted in a single np.bincount pass, and the crowd
+level experienced by the riders is derived from that count and the route
+capacity. Agents deliberating about the bus see a forecast instead, that is
+the average crowd observed at the same time of the day on previous days.
+
+Routes are declared in config.yaml under transit.routes as ordered lists of
+stops (building names), e.g.
+
+    transit:
+      capacity: 50
+      routes:
+        bus_0: [home_0, workplace_0, workplace_1]
+
+@author: bartu
+@date: Spring 2025
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Transit:
+    def __init__(self, routes, capacity=50, max_crowd=9, day_length=240, forecast_smoothing=0.5):
+        # routes: dict of route name -> ordered list of stops (building ids)
+        # capacity: number of riders at which a bus reaches max_crowd level
+        # forecast_smoothing: weight of the latest day in the per time-of-day forecast
+        assert len(routes) > 0, "Expected at least one bus route."
+        self.route_names = list(routes.keys())
+        self.capacity = capacity
+        self.max_crowd = max_crowd
+        self.day_length = day_length
+        self.forecast_smoothing = forecast_smoothing
+
+        # Every route has two directions, the route id of a trip is 2*route + direction
+        self._trip_route = {}
+        for r, name in enumerate(self.route_names):
+            stops = routes[name]
+            assert len(stops) >= 2, f"Expected at least 2 stops for route {name}, got {len(stops)}."
+            for i, origin in enumerate(stops):
+                for j, destination in enumerate(stops):
+                    if i != j and (origin, destination) not in self._trip_route:
+                        self._trip_route[(origin, destination)] = 2 * r + (0 if i < j else 1)
+
+        self.num_routes = 2 * len(self.route_names)
+        self.riders = np.zeros(self.num_routes, dtype=np.int64)
+        self.forecast = np.zeros((day_length, self.num_routes), dtype=float)
+        self._observed = np.zeros(day_length, dtype=bool)
+        self.time = 0
+
+    @classmethod
+    def from_config(cls, config, scenario):
+        # Stop names are resolved to building ids of the compiled scenario. Every commute
+        # of the scenario must be served, so a missing route fails here and not mid-run
+        transit_config = config["transit"]
+        routes = {name: [scenario.building_id(stop) for stop in stops] for name, stops in transit_config["routes"].items()}
+        transit = cls(routes=routes,
+                      capacity=transit_config.get("capacity", 50),
+                      max_crowd=transit_config.get("max_crowd", 9),
+                      day_length=config["simulation"]["day_length"],
+                      forecast_smoothing=transit_config.get("forecast_smoothing", 0.5))
+        missing = transit.get_unserved(scenario.homes, scenario.workplaces)
+        if missing:
+            trips = ", ".join(f"{scenario.name(o)} -> {scenario.name(d)}" for o, d in missing)
+            raise ValueError(f"No bus route for the commutes {trips}. Please declare routes covering them in config.yaml under transit.routes")
+        return transit
+
+    def get_unserved(self, homes, workplaces):
+        # Commutes from a home to a workplace that no route serves, routes run in both
+        # directions so the trips back home are served as well
+        return [(h, w) for h in homes for w in workplaces if (h, w) not in self._trip_route]
+
+    def get_route(self, origin, destination):
+        # Route id serving the trip from origin to destination
+        route = self._trip_route.get((origin, destination))
+        if route is None:
+            raise ValueError(f"No bus route from building {origin} to building {destination}. Please declare one in config.yaml under transit.routes")
+        return route
+
+    def route_name(self, route):
+        return f"{self.route_names[route // 2]}{'' if route % 2 == 0 else ' (return)'}"
+
+    def crowd_level(self, riders):
+        # Map number of riders to a crowd level in [0, max_crowd]
+        return np.minimum(self.max_crowd, np.asarray(riders, dtype=float) * self.max_crowd / self.capacity)
+
+    def get_crowd(self, route, forecast=False):
+        if forecast:
+            return float(self.crowd_level(self.forecast[self.time % self.day_length, route]))
+        return float(self.crowd_level(self.riders[route]))
+
+    def begin_tick(self, time):
+        self.time = time
+        self.riders[:] = 0
+
+    def observe(self, route_ids):
+        # Count riders of this tick per route in one pass
+        route_ids = np.asarray(route_ids, dtype=np.int64)
+        self.observe_counts(np.bincount(route_ids, minlength=self.num_routes))
+
+    def observe_counts(self, counts):
+        # Riders of this tick per route, e.g. summed over chunks of a population
+        self.riders[:] = counts
+        slot = self.time % self.day_length
+        if self._observed[slot]:
+            w = self.forecast_smoothing
+            self.forecast[slot] = w * self.riders + (1 - w) * self.forecast[slot]
+        else:
+            self.forecast[slot] = self.riders
+            self._observed[slot] = True
+        if self.riders.any():
+            logger.info(f"[BUS] Riders per route at {self.time}: {dict((self.route_name(r), int(c)) for r, c in enumerate(self.riders) if c > 0)}")